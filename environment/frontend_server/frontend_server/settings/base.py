@@ -130,6 +130,13 @@ STATICFILES_DIRS = (
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(os.path.dirname(BASE_DIR), "media_root")
 
+# Whether the environment of each step is also written to 
+# storage/{sim_code}/environment/{step}.json. The backend only needs these 
+# files when it does not set <frontend_server_url> (see 
+# reverie/backend_server/frontend_channel.py); otherwise they are an audit 
+# trail. 
+HANDOFF_AUDIT_FILES = True
+
 
 # CORS_ORIGIN_WHITELIST = [
 # 'http://127.0.0.1:8080'
@@ -10,6 +10,9 @@ from os import listdir
 import os
 
 import datetime
+import threading
+import time
+from django.conf import settings
 from django.shortcuts import render, redirect, HttpResponseRedirect
 from django.http import HttpResponse, JsonResponse
 from global_methods import *
@@ -17,6 +20,54 @@ from global_methods import *
 from django.contrib.staticfiles.templatetags.staticfiles import static
 from .models import *
 
+# The environments and movements of the running simulations, handed over in 
+# memory between the frontend and the backend server. They map (sim_code, 
+# step) to the environment or movement of that step. <handoff_condition> is 
+# notified whenever one of them is handed over, which wakes up the requests 
+# that are waiting for it (long polls). 
+handoff_environments = dict()
+handoff_movements = dict()
+handoff_condition = threading.Condition()
+
+
+def store_handoff(store, sim_code, step, payload): 
+  """
+  Stores the payload of a step in <store> and wakes up the requests waiting 
+  for it. Only the latest step of each simulation is kept. 
+  """
+  with handoff_condition: 
+    for key in list(store.keys()): 
+      if key[0] == sim_code and key[1] < step: 
+        del store[key]
+    store[(sim_code, step)] = payload
+    handoff_condition.notify_all()
+
+
+def wait_for_handoff(ready, wait, fallback=None, poll_sleep=0.1): 
+  """
+  Waits up to <wait> seconds until <ready>() or, failing that, <fallback>() 
+  returns something other than None, and returns that (or None). <ready> 
+  looks at the payloads handed over in memory; it is called with 
+  <handoff_condition> held, again whenever a payload is handed over. 
+  <fallback> looks for the files written by a backend that does not push; 
+  it is called every <poll_sleep> seconds without the lock, so that its 
+  disk reads do not hold up the handoffs. 
+  """
+  deadline = time.time() + wait
+  while True: 
+    with handoff_condition: 
+      ret = ready()
+    if ret is None and fallback is not None: 
+      ret = fallback()
+    if ret is not None or time.time() >= deadline: 
+      return ret
+    with handoff_condition: 
+      # A payload may have been handed over while the lock was released. 
+      ret = ready()
+      if ret is not None: 
+        return ret
+      handoff_condition.wait(max(min(poll_sleep, deadline - time.time()), 0))
+
 def landing(request): 
   context = {}
   template = "landing/landing.html"
@@ -199,8 +250,15 @@ def replay_persona_state(request, sim_code, step, persona_name):
   with open(memory + "/spatial_memory.json") as json_file:  
     spatial = json.load(json_file)
 
-  with open(memory + "/associative_memory/nodes.json") as json_file:  
-    associative = json.load(json_file)
+  if os.path.exists(memory + "/associative_memory/nodes.json"):
+    with open(memory + "/associative_memory/nodes.json") as json_file:
+      associative = json.load(json_file)
+  else:
+    # The memory was saved in the binary layout of the backend.
+    # 记忆以后端的二进制布局保存。
+    sys.path.append("../../reverie/backend_server/persona/memory_structures")
+    from memory_columns import read_nodes_json
+    associative = read_nodes_json(memory + "/associative_memory")
 
   a_mem_event = []
   a_mem_chat = []
@@ -242,8 +300,11 @@ def process_environment(request):
   """
   <FRONTEND to BACKEND> 
   This sends the frontend visual world information to the backend server. 
-  It does this by writing the current environment representation to 
-  "storage/environment.json" file. 
+  It does this by handing the current environment representation over in 
+  memory to the backend (see wait_environment), and, unless 
+  HANDOFF_AUDIT_FILES is off, by writing it to the 
+  "storage/{sim_code}/environment/{step}.json" file, which a backend without
+  <frontend_server_url> polls for. 
 
   ARGS:
     request: Django request
@@ -259,9 +320,53 @@ def process_environment(request):
   sim_code = data["sim_code"]
   environment = data["environment"]
 
-  with open(f"storage/{sim_code}/environment/{step}.json", "w") as outfile:
-    outfile.write(json.dumps(environment, indent=2))
+  if getattr(settings, "HANDOFF_AUDIT_FILES", True): 
+    with open(f"storage/{sim_code}/environment/{step}.json", "w") as outfile:
+      outfile.write(json.dumps(environment, indent=2))
+  store_handoff(handoff_environments, sim_code, step, environment)
+
+  return HttpResponse("received")
+
 
+def wait_environment(request): 
+  """
+  <BACKEND waits for FRONTEND> 
+  Long poll of the backend server: waits until the environment of the 
+  requested step is handed over by process_environment, or until "wait" 
+  seconds have passed. 
+
+  ARGS:
+    request: Django request with {"sim_code", "step", "wait"}
+  RETURNS: 
+    JsonResponse: {"<step>": step, "environment": environment}, or 
+                  {"<step>": -1} if the environment has not arrived yet. 
+  """
+  data = json.loads(request.body)
+  step = data["step"]
+  sim_code = data["sim_code"]
+
+  environment = wait_for_handoff(
+    lambda: handoff_environments.get((sim_code, step)), 
+    data.get("wait", 10))
+  if environment is None: 
+    return JsonResponse({"<step>": -1})
+  return JsonResponse({"<step>": step, "environment": environment})
+
+
+def push_movement(request): 
+  """
+  <BACKEND to FRONTEND> 
+  The backend server pushes the movements of a step here as soon as they 
+  are computed. They are handed over to update_environment in memory. 
+
+  ARGS:
+    request: Django request with {"sim_code", "step", "movement"}
+  RETURNS: 
+    HttpResponse: string confirmation message. 
+  """
+  data = json.loads(request.body)
+  store_handoff(handoff_movements, data["sim_code"], data["step"], 
+                data["movement"])
   return HttpResponse("received")
 
 
@@ -270,8 +375,11 @@ def update_environment(request):
   <BACKEND to FRONTEND> 
   This sends the backend computation of the persona behavior to the frontend
   visual server. 
-  It does this by reading the new movement information from 
-  "storage/movement.json" file.
+  It does this by reading the new movement information that the backend 
+  pushed (see push_movement), or else from the 
+  "storage/{sim_code}/movement/{step}.json" file. With "wait" in the 
+  request, it waits up to that many seconds for the movement (a long poll) 
+  instead of answering right away. 
 
   ARGS:
     request: Django request
@@ -286,11 +394,26 @@ def update_environment(request):
   step = data["step"]
   sim_code = data["sim_code"]
 
-  response_data = {"<step>": -1}
-  if (check_if_file_exists(f"storage/{sim_code}/movement/{step}.json")):
-    with open(f"storage/{sim_code}/movement/{step}.json") as json_file: 
-      response_data = json.load(json_file)
-      response_data["<step>"] = step
+  def ready(): 
+    if (sim_code, step) in handoff_movements: 
+      return dict(handoff_movements[(sim_code, step)])
+    return None
+
+  def fallback(): 
+    if (check_if_file_exists(f"storage/{sim_code}/movement/{step}.json")):
+      try: 
+        with open(f"storage/{sim_code}/movement/{step}.json") as json_file: 
+          return json.load(json_file)
+      except ValueError: 
+        # The backend may still be writing the file. 
+        pass
+    return None
+
+  response_data = wait_for_handoff(ready, data.get("wait", 0), fallback)
+  if response_data is None: 
+    response_data = {"<step>": -1}
+  else: 
+    response_data["<step>"] = step
 
   return JsonResponse(response_data)
 
@@ -0,0 +1,42 @@
+"""
+File: compile_maze.py
+Description: Compiles the maze of env_matrix (see utils.py) into 
+maze_compiled.npz next to its maze_meta_info.json, so that every Maze built
+afterwards loads it instead of reading the CSV files. A Maze also compiles 
+itself the first time it is built after the CSV files change; this script 
+does it ahead of time (e.g., before the map folder is made read-only). 
+
+Usage: python compile_maze.py
+"""
+"""
+文件：compile_maze.py
+描述：将env_matrix（参见utils.py）的迷宫编译为其maze_meta_info.json旁边的
+maze_compiled.npz，使得之后构建的每个Maze都加载它而不是读取CSV文件。Maze在CSV文件
+变化后第一次构建时也会编译自己；这个脚本则提前完成编译（例如在地图文件夹被设为只读
+之前）。
+
+用法：python compile_maze.py
+"""
+from global_methods import *
+from utils import *
+from maze import *
+
+
+def compile_maze(maze_name="the_ville"): 
+  """
+  Reads the maze from the CSV files and writes its compiled form. 
+  """
+  """
+  从CSV文件中读取迷宫并写入它的编译形式。
+  """
+  start = time.time()
+  source_key = maze_source_key(env_matrix)
+  maze = Maze(maze_name)
+  maze.read_maze_csv(json.load(open(f"{env_matrix}/maze_meta_info.json")))
+  maze.save_compiled(f"{env_matrix}/{MAZE_COMPILED_FILE}", source_key)
+  print (f"{env_matrix}/{MAZE_COMPILED_FILE} compiled in "
+         f"{time.time() - start:.2f}s")
+
+
+if __name__ == '__main__':
+  compile_maze()
@@ -0,0 +1,45 @@
+"""
+File: convert_memory_storage.py
+Description: Converts the associative memories of a saved simulation between
+the JSON layout (nodes.json, kw_strength.json, embeddings.json) and the
+binary layout (nodes.npz, embeddings.npy). See memory_columns.py.
+
+Usage: python convert_memory_storage.py <sim_code> <json|binary>
+"""
+"""
+文件：convert_memory_storage.py
+描述：在JSON布局（nodes.json、kw_strength.json、embeddings.json）和二进制布局
+（nodes.npz、embeddings.npy）之间转换已保存仿真的联想记忆。参见memory_columns.py。
+
+用法：python convert_memory_storage.py <sim_code> <json|binary>
+"""
+import sys
+
+from global_methods import *
+from utils import *
+from persona.memory_structures.associative_memory import *
+
+
+def convert(sim_code, storage_format):
+  """
+  Rewrites the associative memory of every persona of <sim_code> in
+  <storage_format> ("json" or "binary").
+  """
+  """
+  以<storage_format>（"json"或"binary"）重写<sim_code>中每个角色的联想记忆。
+  """
+  persona_folder = f"{fs_storage}/{sim_code}/personas"
+  for persona_name in sorted(os.listdir(persona_folder)):
+    if persona_name[0] == ".":
+      continue
+    f_a_mem = (f"{persona_folder}/{persona_name}"
+               + "/bootstrap_memory/associative_memory")
+    start = time.time()
+    a_mem = AssociativeMemory(f_a_mem)
+    a_mem.save(f_a_mem, storage_format)
+    print (f"{persona_name}: {len(a_mem.id_to_node)} nodes converted to "
+           f"{storage_format} in {time.time() - start:.2f}s")
+
+
+if __name__ == '__main__':
+  convert(sys.argv[1], sys.argv[2])
@@ -0,0 +1,190 @@
+"""
+File: frontend_channel.py
+Description: Hands the environment and the movements of each step over
+between the simulation server and the environment server. By default, they
+are handed over through the files environment/{step}.json and
+movement/{step}.json of the simulation folder, which both servers poll. With
+<frontend_server_url> set, they are handed over in memory instead: the
+simulation server waits on the environment server for the environment of a
+step (a long poll), and pushes the movements to it as soon as they are
+computed. The files are then only an audit trail, which can be turned off.
+In headless mode, there is no environment server: the environment of each
+step is where the movements of the previous step put the personas.
+"""
+"""
+文件：frontend_channel.py
+描述：在仿真服务和环境服务之间传递每一步的环境和移动。默认情况下，它们通过仿真文件夹
+中的environment/{step}.json和movement/{step}.json文件传递，两个服务都会轮询这些
+文件。设置<frontend_server_url>后，它们改为在内存中传递：仿真服务在环境服务上等待
+某一步的环境（长轮询），并在移动计算完成后立即推送给它。此时这些文件只是一份审计记录，
+可以关闭。在无头模式下没有环境服务：每一步的环境就是上一步的移动将角色带到的位置。
+"""
+import json
+import os
+import time
+import urllib.error
+import urllib.request
+
+import utils
+
+# <frontend_server_url> is the address of the environment server (e.g.,
+# "http://localhost:8000") the step data is pushed to, or None to hand it
+# over through files. <handoff_audit_files> is whether the movement files
+# are written all the same. <handoff_wait> is how many seconds a long poll
+# waits for the environment before asking again. They can be overridden in
+# utils.py.
+# <frontend_server_url>是推送步骤数据的环境服务地址（例如
+# "http://localhost:8000"），为None时通过文件传递。<handoff_audit_files>表示是否
+# 仍然写入移动文件。<handoff_wait>是一次长轮询在再次请求之前等待环境的秒数。它们可以
+# 在utils.py中覆盖。
+frontend_server_url = getattr(utils, "frontend_server_url", None)
+handoff_audit_files = getattr(utils, "handoff_audit_files", True)
+handoff_wait = getattr(utils, "handoff_wait", 10)
+
+
+class FrontendChannel:
+  def __init__(self, sim_folder, sim_code, maze_name, poll_sleep=0.1):
+    # <poll_sleep> is how long receive_environment waits between checks for
+    # the environment file when the step data is handed over through files.
+    # <headless> is whether the steps are run without the environment
+    # server. <last_movement> is the last step and movements that were sent.
+    # <poll_sleep>是通过文件传递步骤数据时，receive_environment两次检查环境文件
+    # 之间等待的时间。<headless>表示是否在没有环境服务的情况下运行步骤。
+    # <last_movement>是最后发送的步数和移动。
+    self.sim_folder = sim_folder
+    self.sim_code = sim_code
+    self.maze_name = maze_name
+    self.poll_sleep = poll_sleep
+    self.push = bool(frontend_server_url)
+    self.headless = False
+    self.last_movement = None
+
+
+  def _post(self, view, data, timeout):
+    request = urllib.request.Request(
+      f"{frontend_server_url.rstrip('/')}/{view}/",
+      data=json.dumps(data).encode("utf-8"),
+      headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+      return response.read()
+
+
+  def receive_environment(self, step):
+    """
+    Waits a little while for the environment of <step> (the tile of each
+    persona after the frontend moved them), and returns it.
+
+    INPUT
+      step: The step of the environment.
+    OUTPUT
+      The environment, e.g., {"Isabella Rodriguez": {"maze": "the_ville",
+      "x": 72, "y": 14}, ...}, or None if it has not arrived yet.
+    """
+    """
+    等待一小段时间以获取<step>的环境（前端移动角色之后每个角色所在的地图块），并返回
+    它。
+
+    输入：
+      step：环境的步数。
+    输出：
+      环境，例如{"Isabella Rodriguez": {"maze": "the_ville", "x": 72,
+      "y": 14}, ...}，如果它还没有到达则返回None。
+    """
+    if self.headless:
+      # The frontend moves each persona onto the tile of their movement, 
+      # which is what the environment it sends back holds. 
+      # 前端将每个角色移动到其移动的地图块上，这就是它发回的环境的内容。
+      environment = self._environment_after_movement(step)
+      if environment is not None:
+        if handoff_audit_files:
+          self._write_environment(step, environment)
+        return environment
+
+    if self.push and not self.headless:
+      try:
+        response = json.loads(self._post("wait_environment",
+                                         {"sim_code": self.sim_code,
+                                          "step": step,
+                                          "wait": handoff_wait},
+                                         handoff_wait + 5))
+        if response["<step>"] == step:
+          return response["environment"]
+      except (urllib.error.URLError, OSError, ValueError) as error:
+        # The environment server is not up (yet); we ask again later.
+        # 环境服务（还）没有启动；稍后再次请求。
+        print (f"Waiting for the environment server: {error}")
+        time.sleep(self.poll_sleep * 10)
+      return None
+
+    env_file = f"{self.sim_folder}/environment/{step}.json"
+    if os.path.exists(env_file):
+      try:
+        with open(env_file) as json_file:
+          return json.load(json_file)
+      except (OSError, ValueError):
+        # The frontend may still be writing the file.
+        # 前端可能仍在写入该文件。
+        pass
+    time.sleep(self.poll_sleep)
+    return None
+
+
+  def send_movement(self, step, movements):
+    """
+    Hands the movements of <step> over to the frontend: pushes them to the
+    environment server, and (if <handoff_audit_files> is on, or the push
+    failed) writes them to movement/{step}.json.
+    """
+    """
+    将<step>的移动交给前端：把它们推送给环境服务，并且（如果<handoff_audit_files>
+    开启，或推送失败）写入movement/{step}.json。
+    """
+    self.last_movement = (step, movements)
+    write_file = handoff_audit_files or not self.push
+    if self.push and not self.headless:
+      try:
+        self._post("push_movement",
+                   {"sim_code": self.sim_code, "step": step,
+                    "movement": movements},
+                   handoff_wait)
+      except (urllib.error.URLError, OSError, ValueError) as error:
+        print (f"Could not push the movements of step {step}: {error}")
+        write_file = True
+    if write_file:
+      # A forked simulation starts without a movement folder.
+      # 分叉的仿真开始时没有movement文件夹。
+      os.makedirs(f"{self.sim_folder}/movement", exist_ok=True)
+      with open(f"{self.sim_folder}/movement/{step}.json", "w") as outfile:
+        outfile.write(json.dumps(movements, indent=2))
+
+
+  def save_resume_environment(self, step):
+    """
+    Makes sure the environment file of <step> exists, so that the simulation
+    can be resumed from it (and the frontend shows it) after it was saved.
+    Without audit files, it is written from the last movements that were
+    sent.
+    """
+    """
+    确保<step>的环境文件存在，使得仿真保存之后可以从它恢复（并且前端会显示它）。
+    没有审计文件时，它由最后发送的移动写入。
+    """
+    environment = self._environment_after_movement(step)
+    if environment is not None and not os.path.exists(
+        f"{self.sim_folder}/environment/{step}.json"):
+      self._write_environment(step, environment)
+
+
+  def _environment_after_movement(self, step):
+    if not self.last_movement or self.last_movement[0] != step - 1:
+      return None
+    environment = dict()
+    for persona_name, movement in self.last_movement[1]["persona"].items():
+      x, y = movement["movement"]
+      environment[persona_name] = {"maze": self.maze_name, "x": x, "y": y}
+    return environment
+
+
+  def _write_environment(self, step, environment):
+    with open(f"{self.sim_folder}/environment/{step}.json", "w") as outfile:
+      outfile.write(json.dumps(environment, indent=2))
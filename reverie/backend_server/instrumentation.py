@@ -0,0 +1,483 @@
+"""
+File: instrumentation.py
+Description: Defines the step profiler, which records where the time of each
+step goes: the wall time of each phase of each persona's cognitive sequence
+(perceive, retrieve, plan, reflect, execute) and of each run_gpt_prompt_*
+call, along with counts of the LLM requests and tokens, the embedding
+requests and the path finder calls. The LLM requests are also accounted per
+prompt function that sent them (tokens, cost, latency, retries and
+validation failures). Each step becomes one record, which can be appended to
+the simulation's trace file (reverie/trace.jsonl), and the records are
+summed up for the "print step profile" command.
+
+Usage: python instrumentation.py <sim_code>
+  prints the summary of the trace file and the LLM usage of a simulation.
+"""
+"""
+文件：instrumentation.py
+描述：定义步骤分析器，它记录每一步的时间花在哪里：每个角色认知序列中每个阶段（感知、
+检索、计划、反思、执行）以及每次run_gpt_prompt_*调用的耗时，以及LLM请求数和token数、
+嵌入请求数和寻路调用次数。每一步成为一条记录，它可以被追加到仿真的追踪文件
+（reverie/trace.jsonl）中，这些记录也会被累加起来供"print step profile"命令使用。
+LLM请求还会按发送它们的提示函数进行统计（token、费用、延迟、重试和验证失败）。
+
+用法：python instrumentation.py <sim_code>
+  打印一个仿真的追踪文件摘要和LLM使用情况。
+"""
+import contextlib
+import contextvars
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+import utils
+
+# <step_trace> is whether the record of each step is appended to
+# reverie/trace.jsonl of the simulation folder. It can be overridden in
+# utils.py.
+# <step_trace>表示是否将每一步的记录追加到仿真文件夹的reverie/trace.jsonl中。它可以
+# 在utils.py中覆盖。
+step_trace = getattr(utils, "step_trace", False)
+
+# <llm_token_prices> is the price in US dollars of 1,000 prompt tokens and of
+# 1,000 completion tokens of each model, which the cost of the LLM requests
+# is estimated with. It can be overridden in utils.py.
+# <llm_token_prices>是每个模型1000个提示token和1000个补全token的美元价格，用于
+# 估算LLM请求的费用。它可以在utils.py中覆盖。
+llm_token_prices = getattr(utils, "llm_token_prices", {
+  "gpt-3.5-turbo": (0.0015, 0.002),
+  "gpt-4": (0.03, 0.06),
+  "text-davinci-003": (0.02, 0.02),
+  "text-davinci-002": (0.02, 0.02),
+  "text-embedding-ada-002": (0.0001, 0)})
+
+# <current_persona> is the name of the persona whose cognitive sequence is
+# running (in this thread, or in the coroutines it waits on), or None.
+# <current_persona>是正在运行认知序列的角色名称（在这个线程中，或在它等待的协程
+# 中），或None。
+current_persona = contextvars.ContextVar("current_persona", default=None)
+# <current_prompt> is the name of the run_gpt_prompt_* function that is
+# running, or None. The LLM requests are accounted under it.
+# <current_prompt>是正在运行的run_gpt_prompt_*函数的名称，或None。LLM请求会记在
+# 它的名下。
+current_prompt = contextvars.ContextVar("current_prompt", default=None)
+
+
+def _add(total, part):
+  for key, val in part.items():
+    if isinstance(val, dict):
+      _add(total.setdefault(key, dict()), val)
+    else:
+      total[key] = total.get(key, 0) + val
+
+
+def _new_totals():
+  return {"steps": 0, "wall_time": 0, "counts": dict(), "personas": dict(),
+          "llm": dict()}
+
+
+def llm_cost(model, prompt_tokens, completion_tokens):
+  """
+  Returns the estimated cost in US dollars of a request to <model> (see
+  <llm_token_prices>), or 0 if the price of the model is not known.
+  """
+  """
+  返回对<model>的一次请求的估算美元费用（参见<llm_token_prices>），如果不知道这个
+  模型的价格则返回0。
+  """
+  prompt_price, completion_price = llm_token_prices.get(model, (0, 0))
+  return (prompt_tokens * prompt_price
+          + completion_tokens * completion_price) / 1000
+
+
+class StepProfiler:
+  def __init__(self):
+    # <record> is the record of the step that is running, or None between
+    # steps (what happens then is not recorded, apart from the LLM usage).
+    # <totals> is the sum of the records of the finished steps, and its
+    # "llm" holds all the LLM usage (see count_llm).
+    # <record>是正在运行的步骤的记录，步骤之间为None（此时发生的事情不会被记录，LLM
+    # 使用情况除外）。<totals>是已结束步骤的记录之和，其中的"llm"保存所有的LLM使用
+    # 情况（参见count_llm）。
+    self.record = None
+    self.totals = _new_totals()
+    self._start = None
+    self._lock = threading.Lock()
+
+
+  def reset(self):
+    """
+    Forgets the totals (e.g., when a new simulation starts in this process).
+    """
+    """
+    清空总计（例如在这个进程中开始一个新的仿真时）。
+    """
+    with self._lock:
+      self.record = None
+      self.totals = _new_totals()
+
+
+  def start_step(self, step, curr_time):
+    """
+    Starts the record of <step>, at game time <curr_time>.
+    """
+    """
+    开始记录<step>，其游戏时间为<curr_time>。
+    """
+    with self._lock:
+      self.record = {"step": step,
+                     "curr_time": curr_time.strftime("%B %d, %Y, %H:%M:%S"),
+                     "wall_time": 0,
+                     "counts": dict(),
+                     "personas": dict(),
+                     "llm": dict()}
+      self._start = time.perf_counter()
+
+
+  def end_step(self, trace_file=None):
+    """
+    Finishes the record of the running step, adds it to the totals and, if
+    <trace_file> is given, appends it to that JSONL file.
+
+    INPUT
+      trace_file: The path of the trace file, or None.
+    OUTPUT
+      The record of the step, e.g., {"step": 12, "curr_time": ...,
+      "wall_time": 3.1, "counts": {"llm_requests": 4, ...}, "personas":
+      {"Isabella Rodriguez": {"phases": {"perceive": 0.01, ...},
+      "prompts": {"run_gpt_prompt_wake_up_hour": {"calls": 1,
+      "time": 0.8}}, "counts": {"llm_requests": 1, ...}}, ...}, "llm":
+      {"run_gpt_prompt_wake_up_hour": {"calls": 1, "requests": 1,
+      "prompt_tokens": 812, ...}, ...}}
+    """
+    """
+    结束正在运行的步骤的记录，将它加入总计，如果给出了<trace_file>，就把它追加到
+    这个JSONL文件中。
+
+    输入：
+      trace_file：追踪文件的路径，或None。
+    输出：
+      这一步的记录，例如{"step": 12, "curr_time": ..., "wall_time": 3.1,
+      "counts": {"llm_requests": 4, ...}, "personas": {"Isabella Rodriguez":
+      {"phases": {"perceive": 0.01, ...}, "prompts":
+      {"run_gpt_prompt_wake_up_hour": {"calls": 1, "time": 0.8}},
+      "counts": {"llm_requests": 1, ...}}, ...}, "llm":
+      {"run_gpt_prompt_wake_up_hour": {"calls": 1, "requests": 1,
+      "prompt_tokens": 812, ...}, ...}}
+    """
+    with self._lock:
+      record = self.record
+      self.record = None
+      record["wall_time"] = time.perf_counter() - self._start
+      # The LLM usage of the step is already in the totals (see count_llm).
+      # 这一步的LLM使用情况已经在总计中（参见count_llm）。
+      _add(self.totals, {"steps": 1,
+                         "wall_time": record["wall_time"],
+                         "counts": record["counts"],
+                         "personas": record["personas"]})
+    if trace_file:
+      with open(trace_file, "a") as outfile:
+        outfile.write(json.dumps(record) + "\n")
+    return record
+
+
+  def _persona_record(self, persona_name):
+    return self.record["personas"].setdefault(
+      persona_name, {"phases": dict(), "prompts": dict(), "counts": dict()})
+
+
+  @contextlib.contextmanager
+  def persona(self, persona_name):
+    """
+    Attributes what happens inside the with block to <persona_name>.
+    """
+    """
+    将with代码块中发生的事情归于<persona_name>。
+    """
+    token = current_persona.set(persona_name)
+    try:
+      yield
+    finally:
+      current_persona.reset(token)
+
+
+  @contextlib.contextmanager
+  def phase(self, name):
+    """
+    Adds the wall time of the with block to the phase <name> (e.g.,
+    "perceive") of the current persona.
+    """
+    """
+    将with代码块的耗时加到当前角色的<name>阶段（例如"perceive"）上。
+    """
+    start = time.perf_counter()
+    try:
+      yield
+    finally:
+      elapsed = time.perf_counter() - start
+      persona_name = current_persona.get()
+      with self._lock:
+        if self.record is not None and persona_name is not None:
+          phases = self._persona_record(persona_name)["phases"]
+          phases[name] = phases.get(name, 0) + elapsed
+
+
+  def profiled_prompt(self, prompt_func):
+    """
+    Wraps a run_gpt_prompt_* function so that the number and the wall time
+    of its calls are recorded for the current persona.
+    """
+    """
+    包装一个run_gpt_prompt_*函数，使得它的调用次数和耗时被记录到当前角色上。
+    """
+    @functools.wraps(prompt_func)
+    def profiled(*args, **kwargs):
+      token = current_prompt.set(prompt_func.__name__)
+      start = time.perf_counter()
+      try:
+        return prompt_func(*args, **kwargs)
+      finally:
+        elapsed = time.perf_counter() - start
+        current_prompt.reset(token)
+        persona_name = current_persona.get()
+        with self._lock:
+          if self.record is not None and persona_name is not None:
+            prompts = self._persona_record(persona_name)["prompts"]
+            _add(prompts, {prompt_func.__name__: {"calls": 1,
+                                                  "time": elapsed}})
+    return profiled
+
+
+  def count(self, **counts):
+    """
+    Adds <counts> (e.g., llm_requests=1, llm_prompt_tokens=812) to the
+    counts of the step and of the current persona.
+    """
+    """
+    将<counts>（例如llm_requests=1, llm_prompt_tokens=812）加到这一步和当前角色
+    的计数上。
+    """
+    persona_name = current_persona.get()
+    with self._lock:
+      if self.record is None:
+        return
+      _add(self.record["counts"], counts)
+      if persona_name is not None:
+        _add(self._persona_record(persona_name)["counts"], counts)
+
+
+  def count_llm(self, **counts):
+    """
+    Adds <counts> to the LLM usage of the prompt function that is running
+    (see <current_prompt>), or of "(untagged)" for requests that were not
+    sent by a run_gpt_prompt_* function. The usage is added to the totals
+    even between steps (e.g., whispers and interviews), and to the record
+    of the running step if there is one. The counts are:
+      calls: requests that went through the LLM gateway (gpt_structure.py),
+             including the ones the LLM cache answered.
+      requests: requests that were sent to OpenAI.
+      prompt_tokens, completion_tokens, cost: the usage of the requests.
+      latency: the seconds the gateway took to answer the calls.
+      retries: attempts after the first one in the safe_generate loops.
+      validation_failures: responses the loops could not parse or validate.
+      fail_safes: loops that gave up and returned their fail safe.
+    """
+    """
+    将<counts>加到正在运行的提示函数（参见<current_prompt>）的LLM使用情况上，对于
+    不是由run_gpt_prompt_*函数发送的请求则加到"(untagged)"上。即使在步骤之间（例如
+    低语和访谈），使用情况也会加入总计；如果有正在运行的步骤，还会加入它的记录。
+    计数包括：
+      calls：经过LLM网关（gpt_structure.py）的请求，包括由LLM缓存应答的请求。
+      requests：发送给OpenAI的请求。
+      prompt_tokens、completion_tokens、cost：请求的用量。
+      latency：网关应答这些调用所用的秒数。
+      retries：safe_generate循环中第一次之后的尝试。
+      validation_failures：循环无法解析或验证的响应。
+      fail_safes：放弃并返回失败保护值的循环。
+    """
+    prompt_name = current_prompt.get() or "(untagged)"
+    with self._lock:
+      _add(self.totals["llm"], {prompt_name: counts})
+      if self.record is not None:
+        _add(self.record["llm"], {prompt_name: counts})
+
+
+def summarize_profile(totals, n_prompts=10):
+  """
+  Describes the summed up records of some steps: the wall time per step, the
+  time of each phase (overall and per persona), the run_gpt_prompt_*
+  functions that took the most time, and the counts.
+
+  INPUT
+    totals: The sum of the records (see StepProfiler.totals).
+    n_prompts: The number of prompt functions listed.
+  OUTPUT
+    A str summary.
+  """
+  """
+  描述若干步骤记录之和：每一步的耗时、每个阶段的耗时（总体以及每个角色）、耗时最多的
+  run_gpt_prompt_*函数，以及各项计数。
+
+  输入：
+    totals：记录之和（参见StepProfiler.totals）。
+    n_prompts：列出的提示函数的数量。
+  输出：
+    一个摘要字符串。
+  """
+  steps = totals["steps"]
+  if not steps:
+    return "No steps were profiled."
+  ret_str = (f"{steps} steps, {totals['wall_time']:.2f}s "
+             f"({totals['wall_time'] / steps * 1000:.1f} ms per step)\n")
+
+  phases = dict()
+  prompts = dict()
+  for persona_totals in totals["personas"].values():
+    _add(phases, persona_totals["phases"])
+    _add(prompts, persona_totals["prompts"])
+
+  ret_str += "\nms per step per phase (all personas):\n"
+  ret_str += "  " + ", ".join(f"{phase} {val / steps * 1000:.1f}"
+                              for phase, val in phases.items()) + "\n"
+  for persona_name, persona_totals in totals["personas"].items():
+    ret_str += f"  {persona_name}: "
+    ret_str += ", ".join(f"{phase} {val / steps * 1000:.1f}"
+                         for phase, val in persona_totals["phases"].items())
+    ret_str += "\n"
+
+  ret_str += f"\nTop {n_prompts} prompt functions by time:\n"
+  ranked = sorted(prompts.items(), key=lambda x: x[1]["time"], reverse=True)
+  for prompt_name, val in ranked[:n_prompts]:
+    ret_str += (f"  {prompt_name}: {val['calls']} calls, "
+                f"{val['time']:.2f}s "
+                f"({val['time'] / val['calls'] * 1000:.1f} ms per call)\n")
+
+  ret_str += "\nCounts (total / per step):\n"
+  for key, val in sorted(totals["counts"].items()):
+    ret_str += f"  {key}: {val} / {val / steps:.1f}\n"
+
+  ret_str += "\n" + summarize_llm_usage(totals["llm"], n_prompts)
+  return ret_str.rstrip("\n")
+
+
+def summarize_llm_usage(usage, n_prompts=None):
+  """
+  Describes the LLM usage of each prompt function (see
+  StepProfiler.count_llm), starting with the most costly ones.
+
+  INPUT
+    usage: A dictionary from prompt function names to their LLM counts.
+    n_prompts: The number of prompt functions listed, or None for all.
+  OUTPUT
+    A str summary.
+  """
+  """
+  描述每个提示函数的LLM使用情况（参见StepProfiler.count_llm），从费用最高的开始。
+
+  输入：
+    usage：一个从提示函数名称到其LLM计数的字典。
+    n_prompts：列出的提示函数的数量，为None时列出全部。
+  输出：
+    一个摘要字符串。
+  """
+  if not usage:
+    return "No LLM calls were recorded."
+  total = dict()
+  for prompt_usage in usage.values():
+    _add(total, prompt_usage)
+  ranked = sorted(usage.items(),
+                  key=lambda x: (x[1].get("cost", 0), x[1].get("latency", 0)),
+                  reverse=True)
+
+  ret_str = "LLM usage by prompt function (most costly first):\n"
+  for prompt_name, val in ranked[:n_prompts] + [("total", total)]:
+    calls = val.get("calls", 0)
+    ret_str += (f"  {prompt_name}: {calls} calls, "
+                f"{val.get('requests', 0)} requests, "
+                f"{val.get('prompt_tokens', 0)}+"
+                f"{val.get('completion_tokens', 0)} tokens, "
+                f"${val.get('cost', 0):.4f}, "
+                f"{val.get('latency', 0):.2f}s")
+    if calls:
+      ret_str += f" ({val.get('latency', 0) / calls * 1000:.1f} ms per call)"
+    ret_str += (f", {val.get('retries', 0)} retries, "
+                f"{val.get('validation_failures', 0)} validation failures, "
+                f"{val.get('fail_safes', 0)} fail safes\n")
+  return ret_str.rstrip("\n")
+
+
+def read_llm_usage(usage_file):
+  """
+  Returns the LLM usage saved in <usage_file>, or an empty one if the file
+  does not exist.
+  """
+  """
+  返回保存在<usage_file>中的LLM使用情况，如果文件不存在则返回空的使用情况。
+  """
+  if not os.path.exists(usage_file):
+    return dict()
+  with open(usage_file) as json_file:
+    return json.load(json_file)
+
+
+def total_llm_usage(base_usage):
+  """
+  Returns <base_usage> plus the LLM usage recorded so far.
+  """
+  """
+  返回<base_usage>加上到目前为止记录的LLM使用情况。
+  """
+  usage = json.loads(json.dumps(base_usage))
+  _add(usage, step_profiler.totals["llm"])
+  return usage
+
+
+def write_llm_usage(usage_file, base_usage):
+  """
+  Saves <base_usage> plus the LLM usage recorded so far to <usage_file>.
+  """
+  """
+  将<base_usage>加上到目前为止记录的LLM使用情况保存到<usage_file>。
+  """
+  usage = total_llm_usage(base_usage)
+  with open(usage_file, "w") as outfile:
+    outfile.write(json.dumps(usage, indent=2))
+  return usage
+
+
+def summarize_trace(trace_file):
+  """
+  Sums up the records of a trace file and describes them (see
+  summarize_profile).
+  """
+  """
+  累加一个追踪文件中的记录并描述它们（参见summarize_profile）。
+  """
+  totals = _new_totals()
+  with open(trace_file) as infile:
+    for line in infile:
+      record = json.loads(line)
+      _add(totals, {"steps": 1,
+                    "wall_time": record["wall_time"],
+                    "counts": record["counts"],
+                    "personas": record["personas"],
+                    "llm": record.get("llm", dict())})
+  return summarize_profile(totals)
+
+
+# <step_profiler> is the process-wide profiler shared by all personas.
+# <step_profiler>是所有角色共享的进程级分析器。
+step_profiler = StepProfiler()
+
+
+if __name__ == '__main__':
+  sim_folder = f"{utils.fs_storage}/{sys.argv[1]}"
+  if os.path.exists(f"{sim_folder}/reverie/trace.jsonl"):
+    print (summarize_trace(f"{sim_folder}/reverie/trace.jsonl"))
+    print ()
+  print ("Saved LLM usage (this simulation and the ones it was forked from):")
+  print (summarize_llm_usage(
+    read_llm_usage(f"{sim_folder}/reverie/llm_usage.json")))
@@ -16,9 +16,93 @@ import datetime
 import pickle
 import time
 import math
+import threading
+import collections
+import hashlib
+import os
+import tempfile
+import zipfile
 
+import utils
 from global_methods import *
 from utils import *
+from path_finder import *
+from instrumentation import step_profiler
+
+# <maze_distance_field_cache> is the number of address distance fields a Maze
+# keeps. Each one holds a value per tile of the map. It can be overridden in 
+# utils.py. 
+
+# <maze_distance_field_cache>是一个Maze保留的地址距离场数量。每个距离场为地图的
+# 每个地图块保存一个值。它可以在utils.py中覆盖。
+maze_distance_field_cache = getattr(utils, "maze_distance_field_cache", 256)
+# <maze_path_cache> is the number of (start, end) paths a Maze keeps. It can be
+# overridden in utils.py. 
+# <maze_path_cache>是一个Maze保留的(start, end)路径数量。它可以在utils.py中
+# 覆盖。
+maze_path_cache = getattr(utils, "maze_path_cache", 1024)
+# <maze_compiled_cache> makes a Maze load its layers from maze_compiled.npz
+# next to maze_meta_info.json, writing it first if it is missing or was 
+# compiled from older CSV files. It can be overridden in utils.py. 
+# <maze_compiled_cache>使Maze从maze_meta_info.json旁边的maze_compiled.npz中
+# 加载图层，如果它不存在或是由旧的CSV文件编译的，则先写入它。它可以在utils.py中
+# 覆盖。
+maze_compiled_cache = getattr(utils, "maze_compiled_cache", True)
+# <maze_hierarchical_paths> makes find_path plan on the portals between the 
+# map's regions (the arenas, cut into blocks of <maze_path_region_size> 
+# tiles) instead of searching the whole map, which pays off on large maps. 
+# They can be overridden in utils.py. 
+# <maze_hierarchical_paths>使find_path在地图区域（竞技场，再切分成
+# <maze_path_region_size>个地图块大小的块）之间的入口上规划，而不是搜索整个地图，
+# 这在大地图上是值得的。它们可以在utils.py中覆盖。
+maze_hierarchical_paths = getattr(utils, "maze_hierarchical_paths", False)
+maze_path_region_size = getattr(utils, "maze_path_region_size", 16)
+# <maze_path_reservations> makes the personas who set out on a path reserve 
+# the tiles along it, step by step, so that the personas who set out after 
+# them step aside or wait instead of walking into them. 
+# <maze_reservation_max_wait> is the number of steps a path may take longer 
+# than the shortest one because of that. They can be overridden in utils.py. 
+# <maze_path_reservations>使出发的角色逐步预留沿途的地图块，使得在他们之后出发的
+# 角色会让路或等待，而不是撞上他们。<maze_reservation_max_wait>是路径因此可以比
+# 最短路径多花费的步数。它们可以在utils.py中覆盖。
+maze_path_reservations = getattr(utils, "maze_path_reservations", False)
+maze_reservation_max_wait = getattr(utils, "maze_reservation_max_wait", 8)
+
+# The files a maze is read from, relative to its matrix folder. 
+# 读取迷宫所用的文件，相对于它的matrix文件夹。
+MAZE_SOURCE_FILES = ["maze_meta_info.json", 
+                     "special_blocks/world_blocks.csv", 
+                     "special_blocks/sector_blocks.csv", 
+                     "special_blocks/arena_blocks.csv", 
+                     "special_blocks/game_object_blocks.csv", 
+                     "special_blocks/spawning_location_blocks.csv", 
+                     "maze/collision_maze.csv", 
+                     "maze/sector_maze.csv", 
+                     "maze/arena_maze.csv", 
+                     "maze/game_object_maze.csv", 
+                     "maze/spawning_location_maze.csv"]
+# Changing what save_compiled writes requires bumping this version, so that 
+# older compiled mazes are not loaded. 
+# 修改save_compiled写入的内容需要增加这个版本号，使得旧的编译迷宫不会被加载。
+MAZE_COMPILED_VERSION = 1
+MAZE_COMPILED_FILE = "maze_compiled.npz"
+
+
+def maze_source_key(matrix_folder): 
+  """
+  Returns a hash of the size and modification time of each source file of 
+  the maze in <matrix_folder> (and of MAZE_COMPILED_VERSION). It changes 
+  whenever one of the CSV files does, without having to read them. 
+  """
+  """
+  返回<matrix_folder>中迷宫每个源文件的大小和修改时间（以及MAZE_COMPILED_VERSION）
+  的哈希值。只要其中一个CSV文件发生变化，它就会变化，而不需要读取这些文件。
+  """
+  key = [str(MAZE_COMPILED_VERSION)]
+  for source_file in MAZE_SOURCE_FILES: 
+    stat = os.stat(f"{matrix_folder}/{source_file}")
+    key += [f"{source_file}:{stat.st_size}:{stat.st_mtime_ns}"]
+  return hashlib.sha1("\n".join(key).encode("utf-8")).hexdigest()
 
 class Maze: 
   def __init__(self, maze_name): 
@@ -51,6 +135,168 @@ class Maze:
     # 例如，“计划整天呆在家里，不出门”
     self.special_constraint = meta_info["special_constraint"]
 
+    # READING IN THE MAP LAYERS
+    # The layers are loaded from the compiled maze (see save_compiled) if it 
+    # was compiled from the current CSV files. Otherwise they are read from 
+    # the CSV files and compiled for the next time. 
+
+    # 读取地图图层
+    # 如果编译好的迷宫（参见save_compiled）是由当前的CSV文件编译的，则从它加载图层。
+    # 否则从CSV文件中读取图层，并为下一次编译。
+    compiled_file = f"{env_matrix}/{MAZE_COMPILED_FILE}"
+    source_key = maze_source_key(env_matrix)
+    if not (maze_compiled_cache 
+            and self.load_compiled(compiled_file, source_key)): 
+      self.read_maze_csv(meta_info)
+      if maze_compiled_cache: 
+        self.save_compiled(compiled_file, source_key)
+    shape = (self.maze_height, self.maze_width)
+
+    # <arena_layer> gives each tile the id of its arena, i.e., of its 
+    # (world, sector, arena) combination, so that whether two tiles are in the
+    # same arena is an integer comparison. <arena_paths> gives the address of
+    # each arena id, the same as get_tile_path(tile, "arena"), and 
+    # <arena_ids> the other way around. 
+    # e.g., self.arena_paths[self.arena_id((58, 9))] 
+    #         == "double studio:double studio:bedroom 2"
+    # <arena_layer>为每个地图块给出它所在竞技场的id，即它的(world, sector, arena)
+    # 组合的id，使得判断两个地图块是否在同一竞技场只需要一次整数比较。<arena_paths>
+    # 给出每个竞技场id的地址，与get_tile_path(tile, "arena")相同，<arena_ids>则
+    # 反过来。
+    # 例子，self.arena_paths[self.arena_id((58, 9))] 
+    #         == "double studio:double studio:bedroom 2"
+    n_sectors = len(self.tile_names["sector"])
+    n_arenas = len(self.tile_names["arena"])
+    arena_keys = ((self.tile_layers["world"].astype(numpy.int64) * n_sectors
+                   + self.tile_layers["sector"]) * n_arenas 
+                  + self.tile_layers["arena"])
+    arena_keys, arena_layer = numpy.unique(arena_keys, return_inverse=True)
+    self.arena_layer = arena_layer.reshape(shape).astype(numpy.int32)
+    # Indexing nested lists is much faster than indexing an array one tile at
+    # a time, so arena_id looks the ids up here. 
+    # 索引嵌套列表比逐个地图块索引数组快得多，所以arena_id在这里查找id。
+    self._arena_rows = self.arena_layer.tolist()
+    self.arena_paths = []
+    for key in arena_keys.tolist(): 
+      self.arena_paths += [":".join([
+        self.tile_names["world"][key // (n_sectors * n_arenas)], 
+        self.tile_names["sector"][key // n_arenas % n_sectors], 
+        self.tile_names["arena"][key % n_arenas]])]
+    self.arena_ids = {path: i for i, path in enumerate(self.arena_paths)}
+    # The tiles of arena i are _arena_tiles[_arena_offsets[i]:
+    # _arena_offsets[i+1]], as y * width + x, in row-major order. 
+    # 竞技场i的地图块是_arena_tiles[_arena_offsets[i]:_arena_offsets[i+1]]，
+    # 以y * width + x表示，按行优先顺序排列。
+    self._arena_tiles = numpy.argsort(self.arena_layer.ravel(), kind="stable")
+    self._arena_offsets = numpy.searchsorted(
+      self.arena_layer.ravel()[self._arena_tiles], 
+      numpy.arange(len(self.arena_paths) + 1)).tolist()
+
+    # <event_lock> guards the tile event sets against concurrent writes when
+    # the personas of a step run on several threads. 
+    # <event_lock> 在一个步骤的角色在多个线程上运行时，保护地图块事件集合不被并发写入。
+    self.event_lock = threading.RLock()
+
+    # <arena_event_tiles> is a spatial index of the events: it maps each 
+    # arena id to the set of the arena's tiles that have events. 
+    # get_nearby_events only looks at those tiles. 
+    # <arena_event_tiles>是事件的空间索引：它将每个竞技场id映射到该竞技场中有事件的
+    # 地图块集合。get_nearby_events只查看这些地图块。
+    self.arena_event_tiles = dict()
+    for tile in self.tile_events: 
+      self.arena_event_tiles.setdefault(self.arena_id(tile), set()).add(tile)
+
+    # <subject_events> indexes the events by their subject: it maps a subject
+    # to {tile: set of the events of that subject on the tile}, so that the 
+    # events of a subject are removed without scanning the tile's events. 
+    # <subject_events>按主语索引事件：它将一个主语映射到{地图块: 该地图块上以它为
+    # 主语的事件集合}，使得删除一个主语的事件时不需要扫描地图块的事件。
+    self.subject_events = dict()
+    for tile, tile_events in self.tile_events.items(): 
+      for event in tile_events: 
+        (self.subject_events.setdefault(event[0], dict())
+                            .setdefault(tile, set()).add(event))
+
+    # <path_grid> is the walkability grid of the collision maze that 
+    # find_path searches. It is built once here. 
+    # <path_grid>是find_path搜索的碰撞迷宫可通行网格。它只在这里构建一次。
+    self.path_grid = PathGrid(self.collision_maze, collision_block_id)
+    # <path_planner> is what find_path searches with: the grid itself, or a 
+    # PathHierarchy over it. 
+    # <path_planner>是find_path用来搜索的对象：网格本身，或者在它之上的
+    # PathHierarchy。
+    self.path_planner = self.build_path_planner()
+
+    # <distance_fields> maps an address of <address_tiles> to its distance 
+    # field, in least recently used order. The fields are computed the first
+    # time an address is headed to. 
+    # <distance_fields>将<address_tiles>中的地址映射到它的距离场，按最近最少使用
+    # 的顺序排列。距离场在第一次前往某个地址时计算。
+    self.distance_fields = collections.OrderedDict()
+    self.distance_field_lock = threading.Lock()
+
+    # <path_cache> maps a (start, end) pair of tiles to the path find_path 
+    # returned for it, in least recently used order. <path_cache_index> maps 
+    # each tile on a cached path to {(start, end): position of the tile on 
+    # the path}, so that the paths between two tiles of a cached path can be 
+    # reused as well. <path_cache_stats> counts the "hits", "subpath_hits" 
+    # and "misses" of find_path. 
+    # <path_cache>将一对(start, end)地图块映射到find_path为它返回的路径，按最近
+    # 最少使用的顺序排列。<path_cache_index>将缓存路径上的每个地图块映射到
+    # {(start, end): 地图块在路径上的位置}，使得缓存路径上两个地图块之间的路径也可以
+    # 被重复使用。<path_cache_stats>统计find_path的"hits"、"subpath_hits"和
+    # "misses"。
+    self.path_cache = collections.OrderedDict()
+    self.path_cache_index = dict()
+    self.path_cache_stats = collections.Counter()
+    self.path_cache_lock = threading.Lock()
+    # While <path_cache_frozen> is True (see freeze_path_cache), the paths 
+    # found are kept in <path_cache_pending> and the cached paths that are 
+    # reused in <path_cache_used>, and the cache itself does not change. 
+    # 当<path_cache_frozen>为True时（参见freeze_path_cache），找到的路径保存在
+    # <path_cache_pending>中，被重复使用的缓存路径保存在<path_cache_used>中，缓存
+    # 本身不会改变。
+    self.path_cache_frozen = False
+    self.path_cache_pending = dict()
+    self.path_cache_used = set()
+
+    # <reservations> is the space-time reservation table of the personas' 
+    # paths: it maps (y * width + x, step) to the name of the persona who 
+    # will be on that tile at that step. <reserved_paths> maps the name of a 
+    # persona to their keys of <reservations>, in step order. 
+    # <reservation_step> is the step the personas are planning at. 
+    # <path_requests> maps the name of a persona who set out in this step to
+    # the path they want, until it is reserved (see reserve_requested_paths).
+    # <reservations>是角色路径的时空预留表：它将(y * width + x, 步数)映射到在那一步
+    # 将会位于该地图块上的角色的名字。<reserved_paths>将角色的名字映射到他们在
+    # <reservations>中的键，按步数排序。<reservation_step>是角色规划时所在的步数。
+    # <path_requests>将这一步出发的角色的名字映射到他们想走的路径，直到它被预留
+    # （参见reserve_requested_paths）。
+    self.reservations = dict()
+    self.reserved_paths = dict()
+    self.path_requests = dict()
+    self.reservation_step = 0
+    self.reservation_lock = threading.Lock()
+
+
+  def read_maze_csv(self, meta_info): 
+    """
+    Reads the tile layers, <address_tiles> and the default tile events from 
+    the CSV files exported from Tiled. 
+
+    INPUT
+      meta_info: The content of maze_meta_info.json. 
+    OUTPUT
+      None
+    """
+    """
+    从Tiled导出的CSV文件中读取地图块图层、<address_tiles>和默认的地图块事件。
+
+    输入：
+      meta_info：maze_meta_info.json的内容。
+    输出：
+      无
+    """
     # READING IN SPECIAL BLOCKS
     # Special blocks are those that are colored in the Tiled map. 
 
@@ -133,135 +379,770 @@ class Maze:
     # 示例： [['0', '0', ... '25309', '0',...], ['0',...]...]
     # 这里25309是碰撞块的编号。
     self.collision_maze = []
-    sector_maze = []
-    arena_maze = []
-    game_object_maze = []
-    spawning_location_maze = []
     for i in range(0, len(collision_maze_raw), meta_info["maze_width"]): 
       tw = meta_info["maze_width"]
       self.collision_maze += [collision_maze_raw[i:i+tw]]
-      sector_maze += [sector_maze_raw[i:i+tw]]
-      arena_maze += [arena_maze_raw[i:i+tw]]
-      game_object_maze += [game_object_maze_raw[i:i+tw]]
-      spawning_location_maze += [spawning_location_maze_raw[i:i+tw]]
-
-    # Once we are done loading in the maze, we now set up self.tiles. This is
-    # a matrix accessed by row:col where each access point is a dictionary
-    # that contains all the things that are taking place in that tile. 
-    # More specifically, it contains information about its "world," "sector,"
-    # "arena," "game_object," "spawning_location," as well as whether it is a
-    # collision block, and a set of all events taking place in it. 
-    # e.g., self.tiles[32][59] = {'world': 'double studio', 
-    #            'sector': '', 'arena': '', 'game_object': '', 
-    #            'spawning_location': '', 'collision': False, 'events': set()}
-    # e.g., self.tiles[9][58] = {'world': 'double studio', 
+
+    # Once we are done loading in the maze, we now set up the tile layers. 
+    # Instead of a dictionary per tile, each of "world," "sector," "arena," 
+    # "game_object," and "spawning_location" is a (height x width) integer 
+    # array accessed by [row, col], whose values index into the list of names 
+    # of that level in <self.tile_names> (0 is always ""). <collision_layer> 
+    # tells whether each tile is a collision block. 
+    # e.g., for the tile (58, 9), 
+    #   self.tile_names["arena"][self.tile_layers["arena"][9, 58]] 
+    #     == 'bedroom 2'
+    # access_tile puts a tile's values back together into the dictionary 
+    # form, e.g., access_tile((58, 9)) = {'world': 'double studio', 
     #         'sector': 'double studio', 'arena': 'bedroom 2', 
     #         'game_object': 'bed', 'spawning_location': 'bedroom-2-a', 
     #         'collision': False,
     #         'events': {('double studio:double studio:bedroom 2:bed',
     #                    None, None)}} 
 
-    # 迷宫中完成加载后，现在设置self.tiles。这是一个按行：列访问的矩阵，每个访问点
-    # 都是一个包含在该方块中发生的所有事情的字典。更具体地说，它包含有关其"世界"、
-    # "区域"、"竞技场"、"游戏"、"对象" 生成位置"的信息，以及它是否是碰撞方块。
-    # 以及在其中发生的所有事件的集合。
-    # 例子， self.tiles[32][59] = {'world': 'double studio', 
-    #            'sector': '', 'arena': '', 'game_object': '', 
-    #            'spawning_location': '', 'collision': False, 'events': set()}
-    # 例子， self.tiles[9][58] = {'world': 'double studio', 
+    # 迷宫中完成加载后，现在设置地图块图层。这里没有为每个地图块保存一个字典，而是将
+    # "世界"、"区域"、"竞技场"、"游戏对象"和"生成位置"各自保存为一个按[行, 列]访问的
+    # (高 x 宽)整数数组，它的值是<self.tile_names>中该级别名称列表的下标（0总是""）。
+    # <collision_layer>表示每个地图块是否是碰撞块。
+    # 例子，对于地图块(58, 9)，
+    #   self.tile_names["arena"][self.tile_layers["arena"][9, 58]] 
+    #     == 'bedroom 2'
+    # access_tile将一个地图块的值重新组合成字典形式，例如 
+    #   access_tile((58, 9)) = {'world': 'double studio', 
     #         'sector': 'double studio', 'arena': 'bedroom 2', 
     #         'game_object': 'bed', 'spawning_location': 'bedroom-2-a', 
     #         'collision': False,
     #         'events': {('double studio:double studio:bedroom 2:bed',
     #                    None, None)}} 
-    self.tiles = []
-    for i in range(self.maze_height): 
-      row = []
-      for j in range(self.maze_width):
-        tile_details = dict()
-        tile_details["world"] = wb
-        
-        tile_details["sector"] = ""
-        if sector_maze[i][j] in sb_dict: 
-          tile_details["sector"] = sb_dict[sector_maze[i][j]]
-        
-        tile_details["arena"] = ""
-        if arena_maze[i][j] in ab_dict: 
-          tile_details["arena"] = ab_dict[arena_maze[i][j]]
-        
-        tile_details["game_object"] = ""
-        if game_object_maze[i][j] in gob_dict: 
-          tile_details["game_object"] = gob_dict[game_object_maze[i][j]]
-        
-        tile_details["spawning_location"] = ""
-        if spawning_location_maze[i][j] in slb_dict: 
-          tile_details["spawning_location"] = slb_dict[spawning_location_maze[i][j]]
-        
-        tile_details["collision"] = False
-        if self.collision_maze[i][j] != "0": 
-          tile_details["collision"] = True
-
-        tile_details["events"] = set()
-        
-        row += [tile_details]
-      self.tiles += [row]
-    # Each game object occupies an event in the tile. We are setting up the 
-    # default event value here. 
-    # 每个游戏对象都占了图块的一个事件，这里设置默认事件值。
-    for i in range(self.maze_height):
-      for j in range(self.maze_width): 
-        if self.tiles[i][j]["game_object"]:
-          object_name = ":".join([self.tiles[i][j]["world"], 
-                                  self.tiles[i][j]["sector"], 
-                                  self.tiles[i][j]["arena"], 
-                                  self.tiles[i][j]["game_object"]])
-          go_event = (object_name, None, None, None)
-          self.tiles[i][j]["events"].add(go_event)
+    shape = (self.maze_height, self.maze_width)
+    self.tile_names = dict()
+    self.tile_layers = dict()
+    self.tile_names["world"] = ["", wb]
+    self.tile_layers["world"] = numpy.ones(shape, dtype=numpy.int32)
+    for level, maze_raw, block_dict in [
+        ("sector", sector_maze_raw, sb_dict), 
+        ("arena", arena_maze_raw, ab_dict), 
+        ("game_object", game_object_maze_raw, gob_dict), 
+        ("spawning_location", spawning_location_maze_raw, slb_dict)]: 
+      names = [""]
+      name_ids = {"": 0}
+      # Each distinct color block of the layer is looked up only once. 
+      # 图层中每个不同的颜色块只查找一次。
+      blocks, block_index = numpy.unique(numpy.array(maze_raw), 
+                                         return_inverse=True)
+      block_ids = []
+      for block in blocks.tolist(): 
+        name = block_dict.get(block, "")
+        if name not in name_ids: 
+          name_ids[name] = len(names)
+          names += [name]
+        block_ids += [name_ids[name]]
+      self.tile_names[level] = names
+      self.tile_layers[level] = (numpy.array(block_ids, dtype=numpy.int32)
+                                 [block_index].reshape(shape))
+    self.collision_layer = (numpy.array(collision_maze_raw) != "0"
+                            ).reshape(shape)
 
     # Reverse tile access. 
     # <self.address_tiles> -- given a string address, we return a set of all 
     # tile coordinates belonging to that address (this is opposite of  
-    # self.tiles that give you the string address given a coordinate). This is
-    # an optimization component for finding paths for the personas' movement. 
+    # access_tile that give you the string address given a coordinate). This 
+    # is an optimization component for finding paths for the personas' 
+    # movement. 
     # self.address_tiles['<spawn_loc>bedroom-2-a'] == {(58, 9)}
     # self.address_tiles['double studio:recreation:pool table'] 
     #   == {(29, 14), (31, 11), (30, 14), (32, 11), ...}, 
     
     # <self.address_tiles> -- 给定一个字符串地址，返回属于该地址的所有地图块坐标的集合
-    # （这与self.tiles相反，它是给出一个坐标，返回坐标所属的一个字符串地址）。
+    # （这与access_tile相反，它是给出一个坐标，返回坐标所属的一个字符串地址）。
     # 这是一个用于查找角色移动路径的优化组件。
     # self.address_tiles['<spawn_loc>bedroom-2-a'] == {(58, 9)}
     # self.address_tiles['double studio:recreation:pool table'] 
     #   == {(29, 14), (31, 11), (30, 14), (32, 11), ...}, 
-    
     self.address_tiles = dict()
-    for i in range(self.maze_height):
-      for j in range(self.maze_width): 
-        addresses = []
-        if self.tiles[i][j]["sector"]: 
-          add = f'{self.tiles[i][j]["world"]}:'
-          add += f'{self.tiles[i][j]["sector"]}'
-          addresses += [add]
-        if self.tiles[i][j]["arena"]: 
-          add = f'{self.tiles[i][j]["world"]}:'
-          add += f'{self.tiles[i][j]["sector"]}:'
-          add += f'{self.tiles[i][j]["arena"]}'
-          addresses += [add]
-        if self.tiles[i][j]["game_object"]: 
-          add = f'{self.tiles[i][j]["world"]}:'
-          add += f'{self.tiles[i][j]["sector"]}:'
-          add += f'{self.tiles[i][j]["arena"]}:'
-          add += f'{self.tiles[i][j]["game_object"]}'
-          addresses += [add]
-        if self.tiles[i][j]["spawning_location"]: 
-          add = f'<spawn_loc>{self.tiles[i][j]["spawning_location"]}'
-          addresses += [add]
-
-        for add in addresses: 
-          if add in self.address_tiles: 
-            self.address_tiles[add].add((j, i))
-          else: 
-            self.address_tiles[add] = set([(j, i)])
+    levels = ["world", "sector", "arena", "game_object"]
+    for depth in range(1, len(levels)): 
+      for address_ids, tiles in self._group_tiles(levels[:depth+1]): 
+        address = ":".join(self.tile_names[level][i] 
+                           for level, i in zip(levels, address_ids))
+        self.address_tiles[address] = tiles
+    for address_ids, tiles in self._group_tiles(["spawning_location"]): 
+      address = f'<spawn_loc>{self.tile_names["spawning_location"][address_ids[0]]}'
+      self.address_tiles[address] = tiles
+
+    # <tile_events> maps the (x, y) tiles that have events to the set of 
+    # events taking place in them. Tiles without events are not kept. Each 
+    # game object occupies an event in the tile. We are setting up the 
+    # default event value here. 
+    # <tile_events>将有事件的(x, y)地图块映射到在其中发生的事件集合。没有事件的
+    # 地图块不会被保存。每个游戏对象都占了图块的一个事件，这里设置默认事件值。
+    self.tile_events = dict()
+    for address_ids, tiles in self._group_tiles(levels): 
+      object_name = ":".join(self.tile_names[level][i] 
+                             for level, i in zip(levels, address_ids))
+      go_event = (object_name, None, None, None)
+      for tile in tiles: 
+        self.tile_events[tile] = set([go_event])
+
+
+  def save_compiled(self, compiled_file, source_key): 
+    """
+    Writes the tile layers, <address_tiles> and the default tile events to 
+    a single .npz file, so that the next Maze can load them instead of 
+    reading the CSV files. The file is skipped if it cannot be written 
+    (e.g., the map folder is read-only). 
+
+    INPUT
+      compiled_file: The path of the .npz file. 
+      source_key: The maze_source_key of the CSV files the maze was read 
+                  from. 
+    OUTPUT
+      None
+    """
+    """
+    将地图块图层、<address_tiles>和默认的地图块事件写入单个.npz文件，使得下一个
+    Maze可以加载它们而不用读取CSV文件。如果文件无法写入（例如地图文件夹是只读的），
+    则跳过。
+
+    输入：
+      compiled_file：.npz文件的路径。
+      source_key：读取迷宫所用CSV文件的maze_source_key。
+    输出：
+      无
+    """
+    columns = dict()
+    columns["source_key"] = numpy.array(source_key)
+    for level, layer in self.tile_layers.items(): 
+      columns[f"layer_{level}"] = layer
+    columns["collision_layer"] = self.collision_layer
+    columns["collision_maze"] = numpy.array(self.collision_maze)
+    columns["tile_names"] = numpy.array(json.dumps(self.tile_names))
+
+    # The tiles of address i are address_x/address_y[offsets[i]:offsets[i+1]]
+    # in row-major order, which is the order read_maze_csv adds them to the 
+    # set in, so that the loaded sets iterate in the same order. 
+    # 地址i的地图块是address_x/address_y[offsets[i]:offsets[i+1]]，按行优先
+    # 顺序排列，这是read_maze_csv将它们加入集合的顺序，使得加载后的集合以相同的
+    # 顺序迭代。
+    addresses = list(self.address_tiles.keys())
+    address_ids = {address: i for i, address in enumerate(addresses)}
+    tiles = [tile for address in addresses 
+             for tile in sorted(self.address_tiles[address], 
+                                key=lambda tile: (tile[1], tile[0]))]
+    columns["addresses"] = numpy.array(json.dumps(addresses))
+    columns["address_offsets"] = numpy.cumsum(
+      [0] + [len(self.address_tiles[address]) for address in addresses])
+    columns["address_x"] = numpy.array([i[0] for i in tiles], dtype=numpy.int32)
+    columns["address_y"] = numpy.array([i[1] for i in tiles], dtype=numpy.int32)
+
+    # Only the game object events that every tile starts with are kept. 
+    # 只保存每个地图块初始的游戏对象事件。
+    events = [(tile, address_ids[event[0]]) 
+              for tile, tile_events in self.tile_events.items() 
+              for event in tile_events]
+    columns["event_x"] = numpy.array([i[0][0] for i in events], 
+                                     dtype=numpy.int32)
+    columns["event_y"] = numpy.array([i[0][1] for i in events], 
+                                     dtype=numpy.int32)
+    columns["event_address"] = numpy.array([i[1] for i in events], 
+                                           dtype=numpy.int32)
+
+    # Several processes may compile the maze at the same time (e.g., the 
+    # workers of run_simulations.py), so each writes its own temporary file
+    # and moves it into place whole. 
+    # 多个进程可能同时编译迷宫（例如run_simulations.py的工作进程），所以每个进程
+    # 写入自己的临时文件，并将它整个移动到位。
+    tmp_file = None
+    try: 
+      fd, tmp_file = tempfile.mkstemp(
+        dir=os.path.dirname(compiled_file) or ".", 
+        prefix=f"{os.path.basename(compiled_file)}.", suffix=".tmp")
+      with os.fdopen(fd, "wb") as outfile: 
+        numpy.savez(outfile, **columns)
+      # mkstemp makes the file readable by its owner only. 
+      # mkstemp创建的文件只有其所有者可读。
+      os.chmod(tmp_file, 0o644)
+      os.replace(tmp_file, compiled_file)
+    except OSError: 
+      if tmp_file and os.path.exists(tmp_file): 
+        os.remove(tmp_file)
+
+
+  def load_compiled(self, compiled_file, source_key): 
+    """
+    Loads what save_compiled wrote, if <compiled_file> exists and was 
+    compiled from the current CSV files. A file that cannot be read (e.g., 
+    a truncated one) is not loaded, so that the CSV files are read instead. 
+
+    INPUT
+      compiled_file: The path of the .npz file. 
+      source_key: The maze_source_key of the current CSV files. 
+    OUTPUT
+      True if the compiled maze was loaded, False otherwise. 
+    """
+    """
+    如果<compiled_file>存在并且是由当前的CSV文件编译的，则加载save_compiled写入的
+    内容。无法读取的文件（例如被截断的文件）不会被加载，此时改为读取CSV文件。
+
+    输入：
+      compiled_file：.npz文件的路径。
+      source_key：当前CSV文件的maze_source_key。
+    输出：
+      如果加载了编译好的迷宫则返回True，否则返回False。
+    """
+    if not os.path.exists(compiled_file): 
+      return False
+    try: 
+      with numpy.load(compiled_file) as data: 
+        if ("source_key" not in data.files 
+            or str(data["source_key"]) != source_key): 
+          return False
+        columns = {key: data[key] for key in data.files}
+
+      tile_names = json.loads(str(columns["tile_names"]))
+      tile_layers = dict()
+      for level in tile_names: 
+        tile_layers[level] = columns[f"layer_{level}"]
+      collision_layer = columns["collision_layer"]
+      collision_maze = columns["collision_maze"].tolist()
+
+      addresses = json.loads(str(columns["addresses"]))
+      offsets = columns["address_offsets"].tolist()
+      address_x = columns["address_x"].tolist()
+      address_y = columns["address_y"].tolist()
+      address_tiles = dict()
+      for i, address in enumerate(addresses): 
+        start, end = offsets[i], offsets[i + 1]
+        address_tiles[address] = set(zip(address_x[start:end], 
+                                         address_y[start:end]))
+
+      tile_events = dict()
+      for x, y, i in zip(columns["event_x"].tolist(), 
+                         columns["event_y"].tolist(), 
+                         columns["event_address"].tolist()): 
+        tile_events.setdefault((x, y), set()).add(
+          (addresses[i], None, None, None))
+    except (OSError, ValueError, KeyError, IndexError, 
+            zipfile.BadZipFile): 
+      return False
+
+    self.tile_names = tile_names
+    self.tile_layers = tile_layers
+    self.collision_layer = collision_layer
+    self.collision_maze = collision_maze
+    self.address_tiles = address_tiles
+    self.tile_events = tile_events
+    return True
+
+
+  def _group_tiles(self, levels): 
+    """
+    Groups the tiles whose value in the last of <levels> is not "" by their
+    values in all of <levels>. 
+
+    INPUT
+      levels: A list of tile layer names, e.g., ["world", "sector", "arena"]
+    OUTPUT
+      A list of (tuple of name ids, one per level; set of (x, y) tiles). 
+    """
+    """
+    按地图块在所有<levels>中的值，对在<levels>最后一个级别中的值不为""的地图块进行
+    分组。
+
+    输入：
+      levels：地图块图层名称的列表，例如["world", "sector", "arena"]
+    输出：
+      一个(名称id的元组，每个级别一个；(x, y)地图块的集合)的列表。
+    """
+    ys, xs = numpy.nonzero(self.tile_layers[levels[-1]])
+    if len(ys) == 0: 
+      return []
+    keys = numpy.stack([self.tile_layers[level][ys, xs] for level in levels], 
+                       axis=1)
+    groups, group_index = numpy.unique(keys, axis=0, return_inverse=True)
+    group_index = group_index.reshape(-1)
+    order = numpy.argsort(group_index, kind="stable")
+    bounds = numpy.searchsorted(group_index[order], 
+                                numpy.arange(len(groups) + 1))
+    xs = xs[order].tolist()
+    ys = ys[order].tolist()
+    ret = []
+    for count, group in enumerate(groups.tolist()): 
+      start, end = bounds[count], bounds[count + 1]
+      ret += [(tuple(group), set(zip(xs[start:end], ys[start:end])))]
+    return ret
+
+
+  def find_path(self, start, end): 
+    """
+    Finds a shortest path between two tiles (see PathGrid.find_path). Paths 
+    are cached: a path that was found before, or a part of one, is reused 
+    instead of being searched again. Any part of a shortest path is itself a
+    shortest path, and so is its reverse. 
+
+    INPUT
+      start: The (x, y) tile to start from. 
+      end: The (x, y) tile to go to. 
+    OUTPUT
+      The list of (x, y) tiles from <start> to <end>, both included, or an 
+      empty list if <end> cannot be reached. 
+    """
+    """
+    查找两个地图块之间的最短路径（参见PathGrid.find_path）。路径会被缓存：之前找到
+    过的路径或它的一部分会被重复使用，而不会再次搜索。最短路径的任何一部分本身也是最短
+    路径，它的反向也是。
+
+    输入：
+      start：出发的(x, y)地图块。
+      end：要到达的(x, y)地图块。
+    输出：
+      从<start>到<end>（包括两者）的(x, y)地图块列表，如果无法到达<end>则返回空
+      列表。
+    """
+    start = tuple(start)
+    end = tuple(end)
+    key = (start, end)
+    with self.path_cache_lock: 
+      if key in self.path_cache: 
+        self._use_cached_path(key)
+        self.path_cache_stats["hits"] += 1
+        return list(self.path_cache[key])
+      if key in self.path_cache_pending: 
+        self.path_cache_stats["hits"] += 1
+        return list(self.path_cache_pending[key])
+
+      # Looks for a cached path that goes through both tiles. 
+      # 查找经过这两个地图块的缓存路径。
+      start_index = self.path_cache_index.get(start, dict())
+      end_index = self.path_cache_index.get(end, dict())
+      for path_key in min(start_index, end_index, key=len): 
+        if path_key in start_index and path_key in end_index: 
+          i = start_index[path_key]
+          j = end_index[path_key]
+          self._use_cached_path(path_key)
+          self.path_cache_stats["subpath_hits"] += 1
+          if i <= j: 
+            return list(self.path_cache[path_key][i:j+1])
+          return list(reversed(self.path_cache[path_key][j:i+1]))
+      self.path_cache_stats["misses"] += 1
+
+    step_profiler.count(path_finder_paths=1)
+    path = self.path_planner.find_path(start, end)
+
+    with self.path_cache_lock: 
+      if self.path_cache_frozen: 
+        self.path_cache_pending.setdefault(key, tuple(path))
+      else: 
+        self._cache_path(key, path)
+    return path
+
+
+  def _use_cached_path(self, key): 
+    if self.path_cache_frozen: 
+      self.path_cache_used.add(key)
+    else: 
+      self.path_cache.move_to_end(key)
+
+
+  def _cache_path(self, key, path): 
+    if key in self.path_cache: 
+      return
+    self.path_cache[key] = tuple(path)
+    for position, tile in enumerate(path): 
+      self.path_cache_index.setdefault(tile, dict())[key] = position
+    while len(self.path_cache) > maze_path_cache: 
+      old_key, old_path = self.path_cache.popitem(last=False)
+      for tile in old_path: 
+        del self.path_cache_index[tile][old_key]
+        if not self.path_cache_index[tile]: 
+          del self.path_cache_index[tile]
+
+
+  def freeze_path_cache(self): 
+    """
+    Keeps the path cache as it is until commit_path_cache: find_path still 
+    reuses the cached paths, and the paths it finds in the meantime (only 
+    whole), but does not add them to the cache or reorder it. A path that 
+    is reused from part of a cached one then does not depend on which 
+    paths were found first (e.g., by personas moving in parallel). 
+    """
+    """
+    在commit_path_cache之前保持路径缓存不变：find_path仍然重复使用缓存的路径，以及
+    在此期间找到的路径（只用完整的），但不会把它们加入缓存或重新排列缓存。这样从缓存
+    路径的一部分重复使用的路径就不取决于哪些路径先被找到（例如由并行移动的角色）。
+    """
+    with self.path_cache_lock: 
+      self.path_cache_frozen = True
+
+
+  def commit_path_cache(self): 
+    """
+    Adds the paths found since freeze_path_cache to the path cache, and 
+    marks the reused ones as recently used, in a fixed order. 
+    """
+    """
+    按固定的顺序将freeze_path_cache之后找到的路径加入路径缓存，并将被重复使用的路径
+    标记为最近使用。
+    """
+    with self.path_cache_lock: 
+      self.path_cache_frozen = False
+      for key in sorted(self.path_cache_used): 
+        if key in self.path_cache: 
+          self.path_cache.move_to_end(key)
+      for key in sorted(self.path_cache_pending): 
+        self._cache_path(key, self.path_cache_pending[key])
+      self.path_cache_pending = dict()
+      self.path_cache_used = set()
+
+
+  def path_cache_hit_rate(self): 
+    """
+    Returns the share of find_path calls that were answered from the path 
+    cache (whole or partial paths), or 0 if find_path was not called yet. 
+    """
+    """
+    返回由路径缓存（完整或部分路径）回答的find_path调用所占的比例，如果还没有调用过
+    find_path则返回0。
+    """
+    stats = self.path_cache_stats
+    hits = stats["hits"] + stats["subpath_hits"]
+    if hits + stats["misses"] == 0: 
+      return 0
+    return hits / (hits + stats["misses"])
+
+
+  def set_collision(self, tile, collision): 
+    """
+    Makes <tile> a collision block or a walkable tile. The cached paths and
+    distance fields no longer hold after this, so they are cleared. 
+
+    INPUT
+      tile: The (x, y) tile to change. 
+      collision: True to make the tile a collision block, False to make it 
+                 walkable. 
+    OUTPUT
+      None
+    """
+    """
+    将<tile>设置为碰撞块或可通行的地图块。此后缓存的路径和距离场不再成立，所以会被
+    清空。
+
+    输入：
+      tile：要修改的(x, y)地图块。
+      collision：True表示将地图块设置为碰撞块，False表示设置为可通行。
+    输出：
+      无
+    """
+    x = tile[0]
+    y = tile[1]
+    self.collision_maze[y][x] = collision_block_id if collision else "0"
+    self.collision_layer[y, x] = collision
+    self.path_grid.walkable[y * self.path_grid.width + x] = not collision
+    with self.path_cache_lock: 
+      self.path_cache.clear()
+      self.path_cache_index.clear()
+      self.path_cache_pending.clear()
+      self.path_cache_used.clear()
+    with self.distance_field_lock: 
+      self.distance_fields.clear()
+    self.path_planner = self.build_path_planner()
+
+
+  def build_path_planner(self): 
+    """
+    Returns the path planner of find_path: the PathGrid, or, if 
+    <maze_hierarchical_paths> is on, a PathHierarchy over the regions of 
+    path_regions. 
+    """
+    """
+    返回find_path的路径规划器：PathGrid，或者当<maze_hierarchical_paths>开启时，
+    返回一个在path_regions的区域之上的PathHierarchy。
+    """
+    if not maze_hierarchical_paths: 
+      return self.path_grid
+    return PathHierarchy(self.path_grid, self.path_regions().ravel().tolist())
+
+
+  def path_regions(self): 
+    """
+    Returns the (maze_height x maze_width) array of the region of each tile 
+    for PathHierarchy: the arenas cut into blocks of <maze_path_region_size> 
+    x <maze_path_region_size> tiles. 
+    """
+    """
+    返回PathHierarchy所用的、每个地图块所属区域的(maze_height x maze_width)
+    数组：切分成<maze_path_region_size> x <maze_path_region_size>个地图块大小
+    的块的竞技场。
+    """
+    ys, xs = numpy.indices(self.arena_layer.shape)
+    n_block_xs = self.maze_width // maze_path_region_size + 1
+    n_block_ys = self.maze_height // maze_path_region_size + 1
+    return ((self.arena_layer.astype(numpy.int64) * n_block_xs 
+             + xs // maze_path_region_size) * n_block_ys 
+            + ys // maze_path_region_size)
+
+
+  def address_distance_field(self, address): 
+    """
+    Returns the distance field of the tiles of <address>, computing it if it
+    is not cached. When the cache is full, the least recently used field is 
+    dropped. 
+
+    INPUT
+      address: An address of <address_tiles>, e.g., 
+               "the Ville:Isabella Rodriguez's apartment:main room:bed"
+    OUTPUT
+      The distance field (see PathGrid.distance_field). 
+    """
+    """
+    返回<address>地图块的距离场，如果它没有被缓存则计算它。当缓存满时，会丢弃最近
+    最少使用的距离场。
+
+    输入：
+      address：<address_tiles>中的一个地址，例如
+               "the Ville:Isabella Rodriguez's apartment:main room:bed"
+    输出：
+      距离场（参见PathGrid.distance_field）。
+    """
+    return self._cached_distance_field(address, self.address_tiles[address])
+
+
+  def tile_distance_field(self, tile): 
+    """
+    Returns the distance field of a single (x, y) tile, which is cached along
+    with the fields of the addresses. 
+    """
+    """
+    返回单个(x, y)地图块的距离场，它与地址的距离场一起被缓存。
+    """
+    tile = tuple(tile)
+    return self._cached_distance_field(tile, [tile])
+
+
+  def _cached_distance_field(self, key, sources): 
+    with self.distance_field_lock: 
+      if key in self.distance_fields: 
+        self.distance_fields.move_to_end(key)
+        return self.distance_fields[key]
+
+    step_profiler.count(path_finder_fields=1)
+    field = self.path_grid.distance_field(sources)
+    with self.distance_field_lock: 
+      self.distance_fields[key] = field
+      while len(self.distance_fields) > maze_distance_field_cache: 
+        self.distance_fields.popitem(last=False)
+    return field
+
+
+  def find_path_to_address(self, start, address, avoid=()): 
+    """
+    Finds a shortest path from <start> to the nearest reachable tile of 
+    <address> by descending the address's distance field. If that tile is in
+    <avoid> (e.g., another persona stands on it), the nearest of the other 
+    tiles of the address is gone to instead, if one can be reached. 
+
+    INPUT
+      start: The (x, y) tile to start from. 
+      address: An address of <address_tiles>. 
+      avoid: The (x, y) tiles that should not end the path if possible. 
+    OUTPUT
+      The list of (x, y) tiles from <start> to a tile of <address>, both 
+      included, or an empty list if no tile of <address> can be reached. 
+    """
+    """
+    通过沿地址的距离场向下走，查找从<start>到<address>最近的可到达地图块的最短
+    路径。如果该地图块在<avoid>中（例如另一个角色站在上面），并且可以到达地址的其他
+    地图块，则改为前往其中最近的一个。
+
+    输入：
+      start：出发的(x, y)地图块。
+      address：<address_tiles>中的一个地址。
+      avoid：尽可能不作为路径终点的(x, y)地图块。
+    输出：
+      从<start>到<address>的一个地图块（包括两者）的(x, y)地图块列表，如果无法到达
+      <address>的任何地图块则返回空列表。
+    """
+    if tuple(start) in self.address_tiles[address]: 
+      return [tuple(start)]
+    path = self.path_grid.descend(self.address_distance_field(address), start)
+    if path and path[-1] in avoid: 
+      # This field depends on <avoid>, so it is not cached. 
+      # 这个距离场取决于<avoid>，所以不会被缓存。
+      free_tiles = [i for i in self.address_tiles[address] if i not in avoid]
+      if free_tiles: 
+        step_profiler.count(path_finder_fields=1)
+        free_path = self.path_grid.descend(
+          self.path_grid.distance_field(free_tiles), start)
+        if free_path: 
+          path = free_path
+    return path
+
+
+  def advance_reservations(self, step): 
+    """
+    Moves the reservation table to <step>: the paths planned from now on 
+    start at <step>, and the reservations of the earlier steps are dropped. 
+    """
+    """
+    将预留表推进到<step>：从现在开始规划的路径从<step>出发，之前步数的预留会被
+    丢弃。
+    """
+    with self.reservation_lock: 
+      self.reservation_step = step
+      for walker, keys in self.reserved_paths.items(): 
+        count = 0
+        while count < len(keys) and keys[count][1] < step: 
+          del self.reservations[keys[count]]
+          count += 1
+        del keys[:count]
+
+
+  def release_path(self, walker): 
+    """
+    Drops the reservations of <walker> (e.g., when they set out on a new 
+    path). 
+    """
+    """
+    丢弃<walker>的预留（例如当他们踏上新的路径时）。
+    """
+    with self.reservation_lock: 
+      self._release_path(walker)
+
+
+  def _release_path(self, walker): 
+    for key in self.reserved_paths.pop(walker, []): 
+      del self.reservations[key]
+
+
+  def _path_conflicts(self, walker, path): 
+    width = self.maze_width
+    step = self.reservation_step
+    for count in range(1, len(path)): 
+      curr = path[count - 1][1] * width + path[count - 1][0]
+      tile = path[count][1] * width + path[count][0]
+      other = self.reservations.get((tile, step + count), walker)
+      if other != walker: 
+        return True
+      other = self.reservations.get((tile, step + count - 1), walker)
+      if (other != walker and tile != curr 
+          and self.reservations.get((curr, step + count)) == other): 
+        return True
+    return False
+
+
+  def reserve_path(self, walker, path): 
+    """
+    Re-plans <path> against the paths the other personas have reserved, and
+    reserves the result for <walker>. The new path ends on the same tile. It
+    goes around or waits for the personas it would otherwise walk into, 
+    taking at most <maze_reservation_max_wait> steps more. If there is no 
+    such path, <path> is kept and reserved where it is free. The personas 
+    who set out earlier keep their paths, so no one has to plan again when 
+    someone else sets out. With <maze_path_reservations> off, <path> is 
+    returned as is. 
+
+    INPUT
+      walker: The name of the persona who is setting out. 
+      path: The path from their current tile (at the current step), e.g., 
+            from find_path. 
+    OUTPUT
+      The list of (x, y) tiles <walker> is on at the current step and the 
+      steps after it. 
+    """
+    """
+    根据其他角色已预留的路径重新规划<path>，并为<walker>预留结果。新路径结束于同一
+    地图块。它会绕开或等待原本会撞上的角色，最多多花费<maze_reservation_max_wait>
+    步。如果没有这样的路径，则保留<path>，并在空闲的位置预留。先出发的角色保留他们
+    的路径，所以有人出发时其他人不需要重新规划。当<maze_path_reservations>关闭时，
+    原样返回<path>。
+
+    输入：
+      walker：出发的角色的名字。
+      path：从他们当前所在地图块（当前步数）出发的路径，例如来自find_path。
+    输出：
+      <walker>在当前步数及之后各步所在的(x, y)地图块列表。
+    """
+    if not maze_path_reservations or not path: 
+      return path
+    width = self.maze_width
+
+    with self.reservation_lock: 
+      self._release_path(walker)
+      conflicts = self._path_conflicts(walker, path)
+    # The distance field may have to be computed, which takes a while, so it
+    # is not done while holding the lock. 
+    # 距离场可能需要计算，这需要一些时间，所以不会在持有锁时进行。
+    field = self.tile_distance_field(path[-1]) if conflicts else None
+
+    with self.reservation_lock: 
+      step = self.reservation_step
+      if conflicts: 
+        # Only a path that runs into someone is searched for again. 
+        # 只有会撞上别人的路径才会重新搜索。
+        step_profiler.count(path_finder_timed_paths=1)
+        timed_path = self.path_grid.find_timed_path(
+          path[0], step, field, self.reservations, walker, 
+          len(path) - 1 + maze_reservation_max_wait)
+        if timed_path: 
+          path = timed_path
+
+      keys = []
+      for count, (x, y) in enumerate(path): 
+        key = (y * width + x, step + count)
+        if self.reservations.setdefault(key, walker) == walker: 
+          keys += [key]
+      self.reserved_paths[walker] = keys
+    return path
+
+
+  def request_path(self, walker, path): 
+    """
+    Asks for <path> to be reserved for <walker> once every persona has moved
+    in this step (see reserve_requested_paths). With <maze_path_reservations>
+    off, nothing is asked for. 
+    """
+    """
+    请求在这一步所有角色都移动之后为<walker>预留<path>（参见
+    reserve_requested_paths）。当<maze_path_reservations>关闭时，不会发出任何请求。
+    """
+    if not maze_path_reservations or not path: 
+      return
+    with self.reservation_lock: 
+      self.path_requests[walker] = path
+
+
+  def reserve_requested_paths(self, walkers): 
+    """
+    Reserves the paths requested in this step (see request_path) one after 
+    another, in the order of <walkers>, so that who gives way to whom does 
+    not depend on the order in which the personas happened to move (e.g., 
+    in parallel mode). 
+
+    INPUT
+      walkers: The names of the personas, in the order their paths are 
+               reserved in. 
+    OUTPUT
+      A dictionary that takes the name of each persona who requested a path
+      as its keys, and their reserved path (see reserve_path) as its values.
+    """
+    """
+    按<walkers>的顺序依次预留这一步请求的路径（参见request_path），使得谁给谁让路
+    不取决于角色碰巧移动的顺序（例如在并行模式下）。
+
+    输入：
+      walkers：角色的名字，按预留他们路径的顺序排列。
+    输出：
+      一个以每个请求了路径的角色名字为键，其预留的路径（参见reserve_path）为值的
+      字典。
+    """
+    with self.reservation_lock: 
+      path_requests = self.path_requests
+      self.path_requests = dict()
+    reserved = dict()
+    for walker in walkers: 
+      if walker in path_requests: 
+        reserved[walker] = self.reserve_path(walker, path_requests[walker])
+    return reserved
 
 
   def turn_coordinate_to_tile(self, px_coordinate): 
@@ -294,8 +1175,10 @@ class Maze:
 
   def access_tile(self, tile): 
     """
-    Returns the tiles details dictionary that is stored in self.tiles of the 
-    designated x, y location. 
+    Returns the tiles details dictionary of the designated x, y location, 
+    assembled from the tile layers. The "events" set is the one stored in 
+    <tile_events> (or a new empty set if the tile has no events), so events 
+    should be changed through add_event_from_tile and the like. 
 
     INPUT
       tile: The tile coordinate of our interest in (x, y) form.
@@ -303,7 +1186,7 @@ class Maze:
       The tile detail dictionary for the designated tile. 
     EXAMPLE OUTPUT
       Given (58, 9), 
-      self.tiles[9][58] = {'world': 'double studio', 
+      {'world': 'double studio', 
             'sector': 'double studio', 'arena': 'bedroom 2', 
             'game_object': 'bed', 'spawning_location': 'bedroom-2-a', 
             'collision': False,
@@ -311,14 +1194,16 @@ class Maze:
                        None, None)}} 
     """
     """
-    给定x, y位置，返回存储在self.tiles相应的地图块的详细信息字典
+    给定x, y位置，返回由地图块图层组合而成的相应地图块的详细信息字典。"events"集合
+    是保存在<tile_events>中的那个（如果地图块没有事件则是一个新的空集合），所以应该
+    通过add_event_from_tile等方法修改事件。
     输入：
       (x, y)格式的地图坐标
     输出：
       指定地图块的详细信息字典
     示例输出：
       给定(58, 9),
-      返回self.tiles[9][58] = {'world': 'double studio', 
+      返回{'world': 'double studio', 
             'sector': 'double studio', 'arena': 'bedroom 2', 
             'game_object': 'bed', 'spawning_location': 'bedroom-2-a', 
             'collision': False,
@@ -328,7 +1213,13 @@ class Maze:
 
     x = tile[0]
     y = tile[1]
-    return self.tiles[y][x]
+    tile_details = dict()
+    for level in ["world", "sector", "arena", "game_object", 
+                  "spawning_location"]: 
+      tile_details[level] = self.tile_names[level][self.tile_layers[level][y, x]]
+    tile_details["collision"] = bool(self.collision_layer[y, x])
+    tile_details["events"] = self.tile_events.get((x, y), set())
+    return tile_details
 
 
   def get_tile_path(self, tile, level): 
@@ -359,25 +1250,13 @@ class Maze:
     """
     x = tile[0]
     y = tile[1]
-    tile = self.tiles[y][x]
-
-    path = f"{tile['world']}"
-    if level == "world": 
-      return path
-    else: 
-      path += f":{tile['sector']}"
-    
-    if level == "sector": 
-      return path
-    else: 
-      path += f":{tile['arena']}"
-
-    if level == "arena": 
-      return path
-    else: 
-      path += f":{tile['game_object']}"
-
-    return path
+    path = []
+    for curr_level in ["world", "sector", "arena", "game_object"]: 
+      path += [self.tile_names[curr_level]
+               [self.tile_layers[curr_level][y, x]]]
+      if curr_level == level: 
+        break
+    return ":".join(path)
 
 
   def get_nearby_tiles(self, tile, vision_r): 
@@ -414,6 +1293,19 @@ class Maze:
     输出：
       nearby_tiles: 在半径范围内的地图块列表
     """
+    left_end, right_end, top_end, bottom_end = self._nearby_bounds(tile, 
+                                                                   vision_r)
+    nearby_tiles = []
+    for i in range(left_end, right_end): 
+      for j in range(top_end, bottom_end): 
+        nearby_tiles += [(i, j)]
+    return nearby_tiles
+
+
+  def _nearby_bounds(self, tile, vision_r): 
+    # The x range [left_end, right_end) and the y range [top_end, bottom_end)
+    # of get_nearby_tiles. 
+    # get_nearby_tiles的x范围[left_end, right_end)和y范围[top_end, bottom_end)。
     left_end = 0
     if tile[0] - vision_r > left_end: 
       left_end = tile[0] - vision_r
@@ -429,12 +1321,142 @@ class Maze:
     top_end = 0
     if tile[1] - vision_r > top_end: 
       top_end = tile[1] - vision_r 
+    return left_end, right_end, top_end, bottom_end
 
-    nearby_tiles = []
-    for i in range(left_end, right_end): 
-      for j in range(top_end, bottom_end): 
-        nearby_tiles += [(i, j)]
-    return nearby_tiles
+
+  def get_nearby_addresses(self, tile, vision_r): 
+    """
+    Returns the distinct world, sector, arena and game object combinations 
+    of the tiles of get_nearby_tiles(tile, vision_r), in the order they first
+    appear in it. They are found on the tile layers, without going through 
+    the tiles one by one. 
+
+    INPUT: 
+      tile: The tile coordinate of our interest in (x, y) form.
+      vision_r: The radius of the persona's vision. 
+    OUTPUT: 
+      A list of {"world": ..., "sector": ..., "arena": ..., "game_object": ...}
+      dictionaries. 
+    """
+    """
+    返回get_nearby_tiles(tile, vision_r)中地图块的不同世界、区域、竞技场和游戏对象
+    组合，按它们在其中第一次出现的顺序排列。它们是在地图块图层上找到的，而不需要逐个
+    遍历地图块。
+
+    输入：
+      tile: (x, y)格式的地图块坐标。
+      vision_r: 虚拟代理的可视范围半径。
+    输出：
+      一个{"world": ..., "sector": ..., "arena": ..., "game_object": ...}字典的
+      列表。
+    """
+    left_end, right_end, top_end, bottom_end = self._nearby_bounds(tile, 
+                                                                   vision_r)
+    if left_end >= right_end or top_end >= bottom_end: 
+      return []
+    levels = ["world", "sector", "arena", "game_object"]
+    # The window is transposed so that its tiles are in the same x-major 
+    # order as get_nearby_tiles. 
+    # 窗口被转置，使得其中的地图块与get_nearby_tiles的顺序相同（x优先）。
+    ids = numpy.stack([self.tile_layers[level][top_end:bottom_end, 
+                                               left_end:right_end].T.ravel() 
+                       for level in levels], axis=1)
+    combinations, first_index = numpy.unique(ids, axis=0, return_index=True)
+    ret = []
+    for combination in combinations[numpy.argsort(first_index)].tolist(): 
+      ret += [{level: self.tile_names[level][i] 
+               for level, i in zip(levels, combination)}]
+    return ret
+
+
+  def get_nearby_events(self, tile, vision_r): 
+    """
+    Returns the events on the tiles of get_nearby_tiles(tile, vision_r) that
+    are in the same arena as <tile>, closest first, each with its distance 
+    to <tile>. An event on several tiles (e.g., an object that stretches 
+    over several tiles) is returned once, with the distance of the first of 
+    them in the order of get_nearby_tiles. Only the tiles of the arena that 
+    have events are looked at (see <arena_event_tiles>). 
+
+    INPUT: 
+      tile: The tile coordinate of our interest in (x, y) form.
+      vision_r: The radius of the persona's vision. 
+    OUTPUT: 
+      A list of (distance, event) tuples sorted by distance. 
+    """
+    """
+    返回get_nearby_tiles(tile, vision_r)中与<tile>在同一竞技场的地图块上的事件，
+    最近的排在前面，每个事件都带有它到<tile>的距离。位于多个地图块上的事件（例如跨越
+    多个地图块的对象）只返回一次，距离取按get_nearby_tiles顺序的第一个地图块。只会
+    查看竞技场中有事件的地图块（参见<arena_event_tiles>）。
+
+    输入：
+      tile: (x, y)格式的地图块坐标。
+      vision_r: 虚拟代理的可视范围半径。
+    输出：
+      一个按距离排序的(distance, event)元组列表。
+    """
+    left_end, right_end, top_end, bottom_end = self._nearby_bounds(tile, 
+                                                                   vision_r)
+    ret = []
+    with self.event_lock: 
+      event_tiles = sorted(
+        i for i in self.arena_event_tiles.get(self.arena_id(tile), ()) 
+        if left_end <= i[0] < right_end and top_end <= i[1] < bottom_end)
+      events_set = set()
+      for i in event_tiles: 
+        dist = math.dist([i[0], i[1]], [tile[0], tile[1]])
+        for event in self.tile_events[i]: 
+          if event not in events_set: 
+            ret += [(dist, event)]
+            events_set.add(event)
+    ret.sort(key=lambda i: i[0])
+    return ret
+
+
+  def arena_id(self, tile): 
+    """
+    Returns the id of the arena of <tile> (see <arena_layer>). Two tiles are
+    in the same arena if and only if their arena ids are equal. 
+
+    INPUT: 
+      tile: The tile coordinate of our interest in (x, y) form.
+    OUTPUT: 
+      The integer arena id. 
+    """
+    """
+    返回<tile>所在竞技场的id（参见<arena_layer>）。两个地图块在同一竞技场当且仅当
+    它们的竞技场id相等。
+
+    输入：
+      tile: (x, y)格式的地图块坐标。
+    输出：
+      整数的竞技场id。
+    """
+    return self._arena_rows[tile[1]][tile[0]]
+
+
+  def tiles_in_arena(self, arena_id): 
+    """
+    Returns the tiles of the arena <arena_id>. 
+
+    INPUT: 
+      arena_id: An arena id, e.g., from arena_id(tile) or <arena_ids>. 
+    OUTPUT: 
+      The list of (x, y) tiles of the arena, in row-major order. 
+    """
+    """
+    返回竞技场<arena_id>的地图块。
+
+    输入：
+      arena_id：一个竞技场id，例如来自arena_id(tile)或<arena_ids>。
+    输出：
+      竞技场的(x, y)地图块列表，按行优先顺序排列。
+    """
+    start = self._arena_offsets[arena_id]
+    end = self._arena_offsets[arena_id + 1]
+    return [(i % self.maze_width, i // self.maze_width) 
+            for i in self._arena_tiles[start:end].tolist()]
 
 
   def add_event_from_tile(self, curr_event, tile): 
@@ -459,7 +1481,7 @@ class Maze:
     输出：
       无
     """
-    self.tiles[tile[1]][tile[0]]["events"].add(curr_event)
+    self.apply_event_updates([("add", curr_event, tile)])
 
 
   def remove_event_from_tile(self, curr_event, tile):
@@ -484,19 +1506,11 @@ class Maze:
     输出：
     示例输出：
     """
-    curr_tile_ev_cp = self.tiles[tile[1]][tile[0]]["events"].copy()
-    for event in curr_tile_ev_cp: 
-      if event == curr_event:  
-        self.tiles[tile[1]][tile[0]]["events"].remove(event)
+    self.apply_event_updates([("remove", curr_event, tile)])
 
 
   def turn_event_from_tile_idle(self, curr_event, tile):
-    curr_tile_ev_cp = self.tiles[tile[1]][tile[0]]["events"].copy()
-    for event in curr_tile_ev_cp: 
-      if event == curr_event:  
-        self.tiles[tile[1]][tile[0]]["events"].remove(event)
-        new_event = (event[0], None, None, None)
-        self.tiles[tile[1]][tile[0]]["events"].add(new_event)
+    self.apply_event_updates([("idle", curr_event, tile)])
 
 
   def remove_subject_events_from_tile(self, subject, tile):
@@ -518,7 +1532,196 @@ class Maze:
     输出：
       无
     """
-    curr_tile_ev_cp = self.tiles[tile[1]][tile[0]]["events"].copy()
-    for event in curr_tile_ev_cp: 
-      if event[0] == subject:  
-        self.tiles[tile[1]][tile[0]]["events"].remove(event)
+    self.apply_event_updates([("remove_subject", subject, tile)])
+
+
+  def apply_event_updates(self, updates): 
+    """
+    Applies a batch of event updates to the tiles as one transaction: no 
+    other thread sees the events halfway through the batch, and nothing is 
+    applied if one of the updates is not valid (an unknown operation, a 
+    tile off the maze, or a target that is not an event, or not a subject 
+    for "remove_subject"); a ValueError is raised instead. Returns what the 
+    batch changed as a whole, so that consumers (e.g., the frontend) can 
+    update incrementally instead of rescanning the tiles. 
+
+    INPUT: 
+      updates: A list of (operation, target, tile) updates, applied in order.
+        ("add", event, tile): Adds the event to the tile. 
+        ("remove", event, tile): Removes the event from the tile. 
+        ("idle", event, tile): Turns the event on the tile into its blank 
+                               form (subject, None, None, None). 
+        ("remove_subject", subject, tile): Removes the events of the 
+                                           subject from the tile. 
+    OUTPUT: 
+      The diff of the batch, {"added": [(tile, event), ...], 
+                              "removed": [(tile, event), ...]}. An event 
+      that was added and then removed again (or the other way around) 
+      within the batch is in neither list. 
+    EXAMPLE OUTPUT: 
+      {"added": [((72, 14), ("Isabella Rodriguez", "is", "sleeping", 
+                             "sleeping"))], 
+       "removed": [((72, 15), ("Isabella Rodriguez", "is", "sleeping", 
+                               "sleeping"))]}
+    """
+    """
+    将一批事件更新作为一个事务应用到地图块上：其他线程不会看到应用到一半的事件，并且
+    如果其中一个更新无效（未知的操作、地图之外的地图块，或者目标不是事件，对于
+    "remove_subject"则不是主语），则不会应用任何更新，而是抛出ValueError。返回这一批更新整体上的变化，使得消费者
+    （例如前端）可以增量更新，而不需要重新扫描地图块。
+
+    输入：
+      updates：一个(operation, target, tile)更新的列表，按顺序应用。
+        ("add", event, tile)：将事件添加到地图块。
+        ("remove", event, tile)：从地图块中删除事件。
+        ("idle", event, tile)：将地图块上的事件变为空形式
+                               (subject, None, None, None)。
+        ("remove_subject", subject, tile)：从地图块中删除该主语的事件。
+    输出：
+      这一批更新的差异，{"added": [(tile, event), ...], 
+                         "removed": [(tile, event), ...]}。在一批更新中先被
+      添加又被删除（或者相反）的事件不在任何一个列表中。
+    示例输出：
+      {"added": [((72, 14), ("Isabella Rodriguez", "is", "sleeping", 
+                             "sleeping"))], 
+       "removed": [((72, 15), ("Isabella Rodriguez", "is", "sleeping", 
+                               "sleeping"))]}
+    """
+    operations = {"add": self._add_event, 
+                  "remove": self._remove_event, 
+                  "idle": self._idle_event, 
+                  "remove_subject": self._remove_subject_events}
+    # The whole batch is checked before anything is applied. 
+    # 在应用任何更新之前先检查整批更新。
+    for operation, target, tile in updates: 
+      if operation not in operations: 
+        raise ValueError(f"Unknown event update: {operation}")
+      if (len(tile) != 2 
+          or not 0 <= tile[0] < self.maze_width 
+          or not 0 <= tile[1] < self.maze_height): 
+        raise ValueError(f"Event update off the maze: {operation} {tile}")
+      if operation == "remove_subject": 
+        valid_target = isinstance(target, str)
+      else: 
+        valid_target = isinstance(target, tuple) and len(target) == 4
+      if not valid_target: 
+        raise ValueError(f"Invalid event update target: {operation} "
+                         f"{target}")
+
+    # <changes> maps each (tile, event) the batch touched to whether the 
+    # event was on the tile before the batch. 
+    # <changes>将这一批更新涉及的每个(tile, event)映射到该事件在这一批更新之前是否
+    # 在地图块上。
+    changes = dict()
+    diff = {"added": [], "removed": []}
+    with self.event_lock: 
+      for operation, target, tile in updates: 
+        operations[operation](target, (tile[0], tile[1]), changes)
+      for (tile, event), before in changes.items(): 
+        after = event in self.tile_events.get(tile, ())
+        if after and not before: 
+          diff["added"] += [(tile, event)]
+        elif before and not after: 
+          diff["removed"] += [(tile, event)]
+    return diff
+
+
+  def _add_event(self, event, tile, changes): 
+    if tile not in self.tile_events: 
+      self.tile_events[tile] = set()
+      self.arena_event_tiles.setdefault(self.arena_id(tile), set()).add(tile)
+    if event in self.tile_events[tile]: 
+      return
+    changes.setdefault((tile, event), False)
+    self.tile_events[tile].add(event)
+    (self.subject_events.setdefault(event[0], dict())
+                        .setdefault(tile, set()).add(event))
+
+
+  def _remove_event(self, event, tile, changes): 
+    if event not in self.tile_events.get(tile, ()): 
+      return
+    changes.setdefault((tile, event), True)
+    self.tile_events[tile].remove(event)
+    subject_tiles = self.subject_events[event[0]]
+    subject_tiles[tile].remove(event)
+    if not subject_tiles[tile]: 
+      del subject_tiles[tile]
+      if not subject_tiles: 
+        del self.subject_events[event[0]]
+    # Keeps <tile_events> and <arena_event_tiles> sparse. 
+    # 保持<tile_events>和<arena_event_tiles>稀疏。
+    if not self.tile_events[tile]: 
+      del self.tile_events[tile]
+      self.arena_event_tiles[self.arena_id(tile)].discard(tile)
+
+
+  def _idle_event(self, event, tile, changes): 
+    if event in self.tile_events.get(tile, ()): 
+      self._remove_event(event, tile, changes)
+      self._add_event((event[0], None, None, None), tile, changes)
+
+
+  def _remove_subject_events(self, subject, tile, changes): 
+    for event in list(self.subject_events.get(subject, dict()).get(tile, ())): 
+      self._remove_event(event, tile, changes)
+
+
+if __name__ == '__main__':
+  # A microbenchmark of the same-arena check on the_ville: comparing the 
+  # arena addresses of two tiles against comparing their arena ids. 
+  # 在the_ville上对同一竞技场判断的微基准测试：比较两个地图块的竞技场地址与比较它们
+  # 的竞技场id。
+  import random
+  maze = Maze("the_ville")
+  tiles = [(random.randrange(maze.maze_width), 
+            random.randrange(maze.maze_height)) for i in range(200000)]
+  pairs = list(zip(tiles, reversed(tiles)))
+
+  start = time.time()
+  same_path = [maze.get_tile_path(a, "arena") == maze.get_tile_path(b, "arena")
+               for a, b in pairs]
+  path_time = time.time() - start
+
+  start = time.time()
+  same_id = [maze.arena_id(a) == maze.arena_id(b) for a, b in pairs]
+  id_time = time.time() - start
+
+  assert same_path == same_id
+  print (f"{len(pairs)} same-arena checks: get_tile_path {path_time:.3f}s, "
+         f"arena_id {id_time:.3f}s ({path_time / id_time:.1f}x)")
+  for arena_id in range(len(maze.arena_paths)): 
+    for tile in maze.tiles_in_arena(arena_id): 
+      assert maze.get_tile_path(tile, "arena") == maze.arena_paths[arena_id]
+
+  # A benchmark of the hierarchical planner against the grid search on a map
+  # of 3 x 3 copies of the_ville. 
+  # 在由3 x 3个the_ville副本组成的地图上，对分层规划器与网格搜索进行基准测试。
+  copies = 3
+  big_grid = PathGrid(numpy.tile(numpy.array(maze.collision_maze), 
+                                 (copies, copies)).tolist(), 
+                      collision_block_id)
+  regions = maze.path_regions()
+  n_regions = int(regions.max()) + 1
+  regions = numpy.block([[regions + (i * copies + j) * n_regions 
+                          for j in range(copies)] for i in range(copies)])
+  start = time.time()
+  big_planner = PathHierarchy(big_grid, regions.ravel().tolist())
+  build_time = time.time() - start
+
+  walkable = [i for i, walkable in enumerate(big_grid.walkable) if walkable]
+  pairs = [tuple((i % big_grid.width, i // big_grid.width) 
+                 for i in random.sample(walkable, 2)) for i in range(100)]
+  start = time.time()
+  grid_paths = [big_grid.find_path(a, b) for a, b in pairs]
+  grid_time = time.time() - start
+  start = time.time()
+  planner_paths = [big_planner.find_path(a, b) for a, b in pairs]
+  planner_time = time.time() - start
+
+  assert [bool(i) for i in grid_paths] == [bool(i) for i in planner_paths]
+  lengths = [len(b) / len(a) for a, b in zip(grid_paths, planner_paths) if a]
+  print (f"{len(pairs)} paths on a {big_grid.width}x{big_grid.height} map: "
+         f"PathGrid {grid_time:.3f}s, PathHierarchy {planner_time:.3f}s "
+         f"(built in {build_time:.3f}s), "
+         f"{sum(lengths) / len(lengths):.3f}x the shortest length")
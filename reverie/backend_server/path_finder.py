@@ -10,6 +10,9 @@ Some of the functions are defunct.
 文件：path_finder.py
 描述：各种路径查找的函数。部分函数已失效。
 """
+import collections
+import heapq
+
 import numpy as np
 
 def print_maze(maze):
@@ -175,21 +178,586 @@ def path_finder_v2(a, start, end, collision_block_char, verbose=False):
   return the_path
 
 
+class PathGrid: 
+  def __init__(self, maze, collision_block_char): 
+    """
+    Builds the walkability grid of a collision maze once, so that paths can 
+    be searched without converting the maze on every call. 
+
+    INPUT
+      maze: The collision maze, a list of rows of tile values. 
+      collision_block_char: The tile value of collision blocks. 
+    """
+    """
+    一次性构建碰撞迷宫的可通行网格，使得查找路径时不需要每次调用都转换迷宫。
+
+    输入：
+      maze：碰撞迷宫，由地图块值的行组成的列表。
+      collision_block_char：碰撞块的地图块值。
+    """
+    self.height = len(maze)
+    self.width = len(maze[0])
+    # <walkable> is indexed by y * width + x. 
+    # <walkable>的下标为y * width + x。
+    self.walkable = [j != collision_block_char for row in maze for j in row]
+
+
+  def find_path(self, start, end): 
+    """
+    Finds a shortest path with a breadth-first search that stops as soon as
+    <end> is reached. Among the shortest paths, it returns the same one as 
+    path_finder_v2 (the path is traced back from <end>, trying the tiles 
+    above, to the left, below and to the right, in that order). 
+
+    INPUT
+      start: The (x, y) tile to start from. 
+      end: The (x, y) tile to go to. 
+    OUTPUT
+      The list of (x, y) tiles from <start> to <end>, both included, or an 
+      empty list if <end> cannot be reached. 
+    """
+    """
+    使用广度优先搜索查找一条最短路径，一旦到达<end>就停止。在所有最短路径中，它返回
+    与path_finder_v2相同的那条（路径从<end>回溯，依次尝试上方、左方、下方和右方的
+    地图块）。
+
+    输入：
+      start：出发的(x, y)地图块。
+      end：要到达的(x, y)地图块。
+    输出：
+      从<start>到<end>（包括两者）的(x, y)地图块列表，如果无法到达<end>则返回空
+      列表。
+    """
+    width = self.width
+    height = self.height
+    walkable = self.walkable
+    if not (0 <= end[0] < width and 0 <= end[1] < height): 
+      return []
+    source = start[1] * width + start[0]
+    target = end[1] * width + end[0]
+
+    dist = {source: 0}
+    queue = collections.deque([source])
+    while queue and target not in dist: 
+      curr = queue.popleft()
+      x = curr % width
+      next_dist = dist[curr] + 1
+      for neighbor, inside in ((curr - width, curr >= width), 
+                               (curr - 1, x > 0), 
+                               (curr + width, curr < (height - 1) * width), 
+                               (curr + 1, x < width - 1)): 
+        if inside and walkable[neighbor] and neighbor not in dist: 
+          dist[neighbor] = next_dist
+          queue.append(neighbor)
+
+    if target not in dist: 
+      return []
+
+    curr = target
+    path = [curr]
+    while dist[curr] > 0: 
+      x = curr % width
+      for neighbor, inside in ((curr - width, curr >= width), 
+                               (curr - 1, x > 0), 
+                               (curr + width, curr < (height - 1) * width), 
+                               (curr + 1, x < width - 1)): 
+        if inside and dist.get(neighbor) == dist[curr] - 1: 
+          curr = neighbor
+          break
+      path += [curr]
+    path.reverse()
+    return [(i % width, i // width) for i in path]
+
+
+  def distance_field(self, sources): 
+    """
+    Computes, with one breadth-first search from all of <sources> at once, 
+    the number of steps from every tile to the nearest of <sources>. 
+
+    INPUT
+      sources: The (x, y) tiles the distances are measured to. Those that are
+               collision blocks are skipped. 
+    OUTPUT
+      A list indexed by y * width + x with the distance of each tile, or -1 
+      for the tiles from which none of <sources> can be reached. 
+    """
+    """
+    通过一次同时从所有<sources>出发的广度优先搜索，计算每个地图块到最近的<sources>
+    的步数。
+
+    输入：
+      sources：测量距离所到达的(x, y)地图块。其中的碰撞块会被跳过。
+    输出：
+      一个下标为y * width + x的列表，包含每个地图块的距离，无法到达任何<sources>
+      的地图块为-1。
+    """
+    width = self.width
+    height = self.height
+    walkable = self.walkable
+    field = [-1] * (width * height)
+    queue = collections.deque()
+    for x, y in sources: 
+      # Like find_path, collision blocks cannot be gone to. 
+      # 与find_path一样，碰撞块无法前往。
+      if not (0 <= x < width and 0 <= y < height): 
+        continue
+      source = y * width + x
+      if walkable[source] and field[source] == -1: 
+        field[source] = 0
+        queue.append(source)
+
+    while queue: 
+      curr = queue.popleft()
+      x = curr % width
+      next_dist = field[curr] + 1
+      for neighbor, inside in ((curr - width, curr >= width), 
+                               (curr - 1, x > 0), 
+                               (curr + width, curr < (height - 1) * width), 
+                               (curr + 1, x < width - 1)): 
+        if inside and walkable[neighbor] and field[neighbor] == -1: 
+          field[neighbor] = next_dist
+          queue.append(neighbor)
+    return field
+
+
+  def descend(self, field, start): 
+    """
+    Follows a distance field downhill from <start>, which gives a shortest 
+    path to the nearest of the field's sources without any search. At each 
+    step, the tiles above, to the left, below and to the right are tried in 
+    that order. 
+
+    INPUT
+      field: A distance field returned by distance_field. 
+      start: The (x, y) tile to start from. 
+    OUTPUT
+      The list of (x, y) tiles from <start> to a source, both included, or an
+      empty list if no source can be reached from <start>. 
+    """
+    """
+    从<start>沿距离场向下走，无需任何搜索即可得到一条到距离场最近源点的最短路径。
+    每一步依次尝试上方、左方、下方和右方的地图块。
+
+    输入：
+      field：distance_field返回的距离场。
+      start：出发的(x, y)地图块。
+    输出：
+      从<start>到一个源点（包括两者）的(x, y)地图块列表，如果从<start>无法到达任何
+      源点则返回空列表。
+    """
+    width = self.width
+    height = self.height
+    if not (0 <= start[0] < width and 0 <= start[1] < height): 
+      return []
+    curr = start[1] * width + start[0]
+    path = [curr]
+    if field[curr] == -1: 
+      # <start> may be a collision block (which the field does not enter), 
+      # in which case the path leaves it through its nearest neighbor. 
+      # <start>可能是碰撞块（距离场不会进入它），此时路径经由距离最近的相邻地图块
+      # 离开它。
+      x = curr % width
+      neighbors = [neighbor for neighbor, inside in (
+                     (curr - width, curr >= width), 
+                     (curr - 1, x > 0), 
+                     (curr + width, curr < (height - 1) * width), 
+                     (curr + 1, x < width - 1)) 
+                   if inside and field[neighbor] != -1]
+      if not neighbors: 
+        return []
+      curr = min(neighbors, key=lambda neighbor: field[neighbor])
+      path += [curr]
+
+    while field[curr] > 0: 
+      x = curr % width
+      for neighbor, inside in ((curr - width, curr >= width), 
+                               (curr - 1, x > 0), 
+                               (curr + width, curr < (height - 1) * width), 
+                               (curr + 1, x < width - 1)): 
+        if inside and field[neighbor] == field[curr] - 1: 
+          curr = neighbor
+          break
+      path += [curr]
+    return [(i % width, i // width) for i in path]
+
+
+  def find_timed_path(self, start, start_step, field, reserved, walker, 
+                      max_steps): 
+    """
+    Finds a path from <start> to the nearest source of a distance field that 
+    keeps out of the way of other walkers, with an A* search over (tile, 
+    time) pairs (i.e., cooperative A*). At each time step the walker either 
+    moves to a neighboring tile or waits where they are. A move is not 
+    allowed onto a tile another walker has reserved for the same time, nor 
+    across a tile another walker is crossing the other way. The distance 
+    field is the exact remaining distance when nobody is in the way, so the 
+    search goes straight to the source unless it has to step aside. 
+
+    INPUT
+      start: The (x, y) tile to start from. 
+      start_step: The time step the walker is on <start> at. 
+      field: A distance field returned by distance_field. 
+      reserved: A dictionary mapping (y * width + x, time) to the walker who 
+                reserved that tile at that time. 
+      walker: The name of the walker the path is for. Their own reservations 
+              are not in the way. 
+      max_steps: The number of time steps the path may take at most. 
+    OUTPUT
+      The list of (x, y) tiles the walker is on at <start_step> and the 
+      steps after it (a tile is repeated while they wait), or an empty list if no such path 
+      reaches a source within <max_steps>. 
+    """
+    """
+    通过在(地图块, 时间)对上进行A*搜索（即协作式A*），查找一条从<start>到距离场最近
+    源点、并避开其他行走者的路径。在每个时间步，行走者要么移动到相邻的地图块，要么
+    原地等待。不允许移动到其他行走者在同一时间预留的地图块上，也不允许与反方向经过的
+    其他行走者交换位置。当没有人挡路时，距离场就是准确的剩余距离，所以除非需要让路，
+    搜索会直接走向源点。
+
+    输入：
+      start：出发的(x, y)地图块。
+      start_step：行走者位于<start>时的时间步。
+      field：distance_field返回的距离场。
+      reserved：一个字典，将(y * width + x, 时间)映射到在那个时间预留该地图块的
+                行走者。
+      walker：路径所属行走者的名字。他们自己的预留不会挡路。
+      max_steps：路径最多可以花费的时间步数。
+    输出：
+      行走者在<start_step>及之后各步所在的(x, y)地图块列表（等待时地图块会
+      重复），如果在<max_steps>内没有这样的路径到达源点，则返回空列表。
+    """
+    width = self.width
+    height = self.height
+    walkable = self.walkable
+    if not (0 <= start[0] < width and 0 <= start[1] < height): 
+      return []
+    source = start[1] * width + start[0]
+
+    # The heap holds (estimated length, -time, tile, time), so that among 
+    # equally long paths the ones further along are expanded first. 
+    # 堆中保存(估计长度, -时间, 地图块, 时间)，使得在同样长的路径中，走得更远的
+    # 路径先被展开。
+    came_from = {(source, 0): None}
+    heap = [(max(field[source], 0), 0, source, 0)]
+    goal = None
+    while heap: 
+      _, _, curr, time = heapq.heappop(heap)
+      if field[curr] == 0: 
+        goal = (curr, time)
+        break
+      if time == max_steps: 
+        continue
+      x = curr % width
+      for neighbor, inside in ((curr - width, curr >= width), 
+                               (curr - 1, x > 0), 
+                               (curr + width, curr < (height - 1) * width), 
+                               (curr + 1, x < width - 1), 
+                               (curr, True)): 
+        if not inside or (neighbor, time + 1) in came_from: 
+          continue
+        if neighbor != curr and (not walkable[neighbor] 
+                                 or field[neighbor] == -1): 
+          continue
+        step = start_step + time
+        other = reserved.get((neighbor, step + 1), walker)
+        if other != walker: 
+          continue
+        other = reserved.get((neighbor, step), walker)
+        if (neighbor != curr and other != walker 
+            and reserved.get((curr, step + 1)) == other): 
+          continue
+        came_from[(neighbor, time + 1)] = (curr, time)
+        estimate = time + 1 + max(field[neighbor], 0)
+        heapq.heappush(heap, (estimate, -(time + 1), neighbor, time + 1))
+    if goal is None: 
+      return []
+
+    path = []
+    while goal: 
+      path += [goal[0]]
+      goal = came_from[goal]
+    path.reverse()
+    return [(i % width, i // width) for i in path]
+
+
+class PathHierarchy: 
+  def __init__(self, path_grid, regions): 
+    """
+    Builds the abstract graph of a hierarchical path planner on top of a 
+    PathGrid. The map is split into regions (e.g., the arenas of the map, 
+    cut into blocks). Where two regions touch, each straight run of 
+    walkable tiles along their border gets a pair of portal tiles in its 
+    middle, one on each side. A path is first planned on the graph of the 
+    portals, and then refined with searches that stay inside one region, so
+    a search never looks at more than a region's tiles at a time. The paths
+    are not always the shortest ones, but they are close. 
+
+    INPUT
+      path_grid: The PathGrid of the map. 
+      regions: A list indexed by y * width + x with the region id of each 
+               walkable tile (and anything for collision blocks). 
+    """
+    """
+    在PathGrid之上构建分层路径规划器的抽象图。地图被划分为区域（例如地图的竞技场，
+    再切分成块）。在两个区域接触的地方，沿着它们边界的每一段连续可通行地图块都会在
+    中间得到一对入口地图块，两侧各一个。路径先在入口图上规划，然后通过只在一个区域
+    内部进行的搜索细化，所以一次搜索最多只会查看一个区域的地图块。路径不一定是最短的，
+    但很接近。
+
+    输入：
+      path_grid：地图的PathGrid。
+      regions：一个下标为y * width + x的列表，包含每个可通行地图块的区域id（碰撞块
+               的值任意）。
+    """
+    self.path_grid = path_grid
+    self.regions = regions
+    width = path_grid.width
+    height = path_grid.height
+    walkable = path_grid.walkable
+
+    # <runs> maps (the first tile's region, the second tile's region, the 
+    # direction, the line) to the positions along the line where a tile and
+    # the one to its right (or below it) are in these two regions. 
+    # <runs>将(第一个地图块的区域, 第二个地图块的区域, 方向, 所在的线)映射到沿着该
+    # 线的位置，在这些位置上一个地图块与它右侧（或下方）的地图块分别在这两个区域中。
+    runs = collections.defaultdict(list)
+    for curr in range(width * height): 
+      if not walkable[curr]: 
+        continue
+      x = curr % width
+      y = curr // width
+      if x < width - 1 and walkable[curr + 1] and (
+          regions[curr] != regions[curr + 1]): 
+        runs[(regions[curr], regions[curr + 1], 1, x)] += [y]
+      if y < height - 1 and walkable[curr + width] and (
+          regions[curr] != regions[curr + width]): 
+        runs[(regions[curr], regions[curr + width], width, y)] += [x]
+
+    # <portals> maps a region to its portal tiles, and <crossings> maps a 
+    # portal tile to the portal tiles across the border from it. 
+    # <portals>将一个区域映射到它的入口地图块，<crossings>将一个入口地图块映射到
+    # 边界另一侧的入口地图块。
+    self.portals = collections.defaultdict(set)
+    self.crossings = collections.defaultdict(set)
+    for (region_a, region_b, step, line), positions in runs.items(): 
+      run = [positions[0]]
+      for position in positions[1:] + [None]: 
+        if position is not None and position == run[-1] + 1: 
+          run += [position]
+          continue
+        middle = run[len(run) // 2]
+        if step == 1: 
+          tile_a = middle * width + line
+        else: 
+          tile_a = line * width + middle
+        tile_b = tile_a + step
+        self.portals[region_a].add(tile_a)
+        self.portals[region_b].add(tile_b)
+        self.crossings[tile_a].add(tile_b)
+        self.crossings[tile_b].add(tile_a)
+        run = [position]
+
+    # <portal_distances> maps a portal tile to {portal tile of the same 
+    # region: distance inside the region}. It is filled in one region at a 
+    # time, the first time a path goes through the region. 
+    # <portal_distances>将一个入口地图块映射到{同一区域的入口地图块: 区域内的
+    # 距离}。它在路径第一次经过某个区域时按区域填充。
+    self.portal_distances = dict()
+
+
+  def _region_search(self, source, targets=None): 
+    """
+    Runs a breadth-first search from <source> that stays inside its region,
+    and stops once all of <targets> (if given) are reached. Returns the 
+    distance of each reached tile. 
+    """
+    """
+    从<source>进行一次留在其区域内的广度优先搜索，如果给定了<targets>，则在到达所有
+    <targets>后停止。返回每个到达的地图块的距离。
+    """
+    width = self.path_grid.width
+    height = self.path_grid.height
+    walkable = self.path_grid.walkable
+    regions = self.regions
+    region = regions[source]
+    remaining = len(targets) if targets else -1
+
+    dist = {source: 0}
+    queue = collections.deque([source])
+    while queue and remaining != 0: 
+      curr = queue.popleft()
+      x = curr % width
+      next_dist = dist[curr] + 1
+      for neighbor, inside in ((curr - width, curr >= width), 
+                               (curr - 1, x > 0), 
+                               (curr + width, curr < (height - 1) * width), 
+                               (curr + 1, x < width - 1)): 
+        if (inside and walkable[neighbor] and neighbor not in dist 
+            and regions[neighbor] == region): 
+          dist[neighbor] = next_dist
+          queue.append(neighbor)
+          if targets and neighbor in targets: 
+            remaining -= 1
+    return dist
+
+
+  def _region_path(self, source, target): 
+    """
+    Returns the shortest path from <source> to <target> inside their region,
+    as a list of y * width + x tiles, or None if there is none. 
+    """
+    """
+    返回区域内从<source>到<target>的最短路径，以y * width + x地图块列表表示，如果
+    不存在则返回None。
+    """
+    dist = self._region_search(source, set([target]))
+    if target not in dist: 
+      return None
+    width = self.path_grid.width
+    height = self.path_grid.height
+    curr = target
+    path = [curr]
+    while dist[curr] > 0: 
+      x = curr % width
+      for neighbor, inside in ((curr - width, curr >= width), 
+                               (curr - 1, x > 0), 
+                               (curr + width, curr < (height - 1) * width), 
+                               (curr + 1, x < width - 1)): 
+        if inside and dist.get(neighbor) == dist[curr] - 1: 
+          curr = neighbor
+          break
+      path += [curr]
+    path.reverse()
+    return path
+
+
+  def _portal_edges(self, portal): 
+    if portal not in self.portal_distances: 
+      region_portals = self.portals[self.regions[portal]]
+      for source in region_portals: 
+        dist = self._region_search(source, region_portals)
+        self.portal_distances[source] = {
+          target: dist[target] for target in region_portals 
+          if target in dist and target != source}
+    return self.portal_distances[portal]
+
+
+  def find_path(self, start, end): 
+    """
+    Finds a path between two tiles: inside their region if they share one,
+    and through the portal graph (with A*) otherwise. 
+
+    INPUT
+      start: The (x, y) tile to start from. 
+      end: The (x, y) tile to go to. 
+    OUTPUT
+      The list of (x, y) tiles from <start> to <end>, both included, or an 
+      empty list if <end> cannot be reached. 
+    """
+    """
+    查找两个地图块之间的路径：如果它们在同一区域，则在区域内查找，否则通过入口图
+    （使用A*）查找。
+
+    输入：
+      start：出发的(x, y)地图块。
+      end：要到达的(x, y)地图块。
+    输出：
+      从<start>到<end>（包括两者）的(x, y)地图块列表，如果无法到达<end>则返回空
+      列表。
+    """
+    width = self.path_grid.width
+    height = self.path_grid.height
+    walkable = self.path_grid.walkable
+    if not (0 <= end[0] < width and 0 <= end[1] < height): 
+      return []
+    source = start[1] * width + start[0]
+    target = end[1] * width + end[0]
+    if not walkable[source] or not walkable[target]: 
+      # The planner only knows walkable tiles. 
+      # 规划器只知道可通行的地图块。
+      return self.path_grid.find_path(start, end)
+
+    path = None
+    if self.regions[source] == self.regions[target]: 
+      path = self._region_path(source, target)
+    if path is None: 
+      path = self._portal_path(source, target)
+    return [(i % width, i // width) for i in path]
+
+
+  def _portal_path(self, source, target): 
+    width = self.path_grid.width
+    start_portals = self.portals[self.regions[source]]
+    end_portals = self.portals[self.regions[target]]
+    start_dist = self._region_search(source, start_portals)
+    end_dist = self._region_search(target, end_portals)
+
+    def heuristic(tile): 
+      return (abs(tile % width - target % width) 
+              + abs(tile // width - target // width))
+
+    # A* over the portals, from <source> to <target>. <came_from> maps each 
+    # reached node to the node it was reached from. 
+    # 在入口上从<source>到<target>进行A*搜索。<came_from>将每个到达的节点映射到
+    # 到达它之前的节点。
+    best = {source: 0}
+    came_from = dict()
+    heap = [(heuristic(source), 0, source)]
+    while heap: 
+      _, cost, curr = heapq.heappop(heap)
+      if curr == target: 
+        break
+      if cost > best[curr]: 
+        continue
+      edges = dict()
+      if curr == source: 
+        edges.update({portal: start_dist[portal] for portal in start_portals 
+                      if portal in start_dist})
+      if curr in self.crossings: 
+        edges.update(self._portal_edges(curr))
+        for portal in self.crossings[curr]: 
+          edges[portal] = 1
+      if curr in end_dist: 
+        edges[target] = end_dist[curr]
+      for node, edge_cost in edges.items(): 
+        if cost + edge_cost < best.get(node, cost + edge_cost + 1): 
+          best[node] = cost + edge_cost
+          came_from[node] = curr
+          heapq.heappush(heap, (cost + edge_cost + heuristic(node), 
+                                cost + edge_cost, node))
+    if target not in came_from: 
+      return []
+
+    nodes = [target]
+    while nodes[-1] != source: 
+      nodes += [came_from[nodes[-1]]]
+    nodes.reverse()
+
+    # Refining: the nodes are joined by searches inside one region, or are
+    # neighbors across a border. 
+    # 细化：节点之间通过区域内的搜索连接，或者是跨越边界的相邻节点。
+    path = [source]
+    for curr, next_node in zip(nodes, nodes[1:]): 
+      if self.regions[curr] == self.regions[next_node]: 
+        path += self._region_path(curr, next_node)[1:]
+      else: 
+        path += [next_node]
+    return path
+
+
 def path_finder(maze, start, end, collision_block_char, verbose=False):
-  # EMERGENCY PATCH
-  # 紧急补丁
-  start = (start[1], start[0])
-  end = (end[1], end[0])
-  # END EMERGENCY PATCH
-
-  path = path_finder_v2(maze, start, end, collision_block_char, verbose)
-
-  new_path = []
-  for i in path: 
-    new_path += [(i[1], i[0])]
-  path = new_path
-  
-  return path
+  """
+  Finds a shortest path from <start> to <end> (both (x, y) tiles) on a 
+  collision maze. The grid is built on every call; use Maze.find_path, which
+  keeps its grid, when the maze is a <Maze>. Returns an empty list if <end> 
+  cannot be reached. 
+  """
+  """
+  在碰撞迷宫上查找从<start>到<end>（都是(x, y)地图块）的最短路径。每次调用都会构建
+  网格；当迷宫是<Maze>时，请使用保留了网格的Maze.find_path。如果无法到达<end>，返回
+  空列表。
+  """
+  return PathGrid(maze, collision_block_char).find_path(start, end)
 
 
 def closest_coordinate(curr_coordinate, target_coordinates): 
@@ -18,7 +18,7 @@ from global_methods import *
 from path_finder import *
 from utils import *
 
-def execute(persona, maze, personas, plan): 
+def execute(persona, maze, personas, plan, personas_tile): 
   """
   Given a plan (action's string address), we execute the plan (actually 
   outputs the tile coordinate path and the next coordinate for the 
@@ -34,6 +34,8 @@ def execute(persona, maze, personas, plan):
        indexing (e.g., [-1]) because the latter address elements may not be 
        present in some cases. 
        e.g., "dolores double studio:double studio:bedroom 1:bed"
+    personas_tile: A dictionary of the tile of every persona at the start 
+       of the step. 
     
   OUTPUT: 
     execution
@@ -49,6 +51,7 @@ def execute(persona, maze, personas, plan):
     plan：存储需要执行的动作字符串地址。它的格式是： "{world}:{sector}:{arena}:
     {game_objects}". 注意在操作时不能输入负数索引(e.g., [-1])因为在一些情况下
     后面的地址元素可能没有被初始化。
+    personas_tile：存储每个角色在这一步开始时所在地图块的字典。
   输出：
   """
   if "<random>" in plan and persona.scratch.planned_path == []: 
@@ -64,6 +67,11 @@ def execute(persona, maze, personas, plan):
     # <target_tiles>是一个角色为了执行当前行动可能到达的地图块坐标列表。作用是用于
     # 选择其中一个坐标执行。
     target_tiles = None
+    # <target_address> is set instead when the persona heads to an address,
+    # whose tiles are reached through the maze's distance fields. 
+    # 当角色前往一个地址时，改为设置<target_address>，通过迷宫的距离场到达它的
+    # 地图块。
+    target_address = None
 
     print ('aldhfoaf/????')
     print (plan)
@@ -71,27 +79,27 @@ def execute(persona, maze, personas, plan):
     if "<persona>" in plan: 
       # Executing persona-persona interaction.
       # 执行角色到角色的交互
-      target_p_tile = (personas[plan.split("<persona>")[-1].strip()]
-                       .scratch.curr_tile)
-      potential_path = path_finder(maze.collision_maze, 
-                                   persona.scratch.curr_tile, 
-                                   target_p_tile, 
-                                   collision_block_id)
-      if len(potential_path) <= 2: 
+      # The other persona's tile is read from the start of the step, as 
+      # they may be moving at the same time. 
+      # 另一个角色的地图块从这一步开始时读取，因为他们可能正在同时移动。
+      target_p_tile = personas_tile[plan.split("<persona>")[-1].strip()]
+      potential_path = maze.find_path(persona.scratch.curr_tile, 
+                                      target_p_tile)
+      if not potential_path: 
+        # The other persona cannot be reached. 
+        # 无法到达另一个角色。
+        target_tiles = [target_p_tile]
+      elif len(potential_path) <= 2: 
         target_tiles = [potential_path[0]]
       else: 
-        potential_1 = path_finder(maze.collision_maze, 
-                                persona.scratch.curr_tile, 
-                                potential_path[int(len(potential_path)/2)], 
-                                collision_block_id)
-        potential_2 = path_finder(maze.collision_maze, 
-                                persona.scratch.curr_tile, 
-                                potential_path[int(len(potential_path)/2)+1], 
-                                collision_block_id)
-        if len(potential_1) <= len(potential_2): 
-          target_tiles = [potential_path[int(len(potential_path)/2)]]
-        else: 
-          target_tiles = [potential_path[int(len(potential_path)/2+1)]]
+        # The persona meets the other halfway. Any part of a shortest path is
+        # itself a shortest path, so the middle tile of <potential_path> is 
+        # the closer of the two middle tiles without searching for either, 
+        # and the path to it is the first half of <potential_path>. 
+        # 角色在半路与另一个角色会合。最短路径的任何一部分本身也是最短路径，所以
+        # <potential_path>的中间地图块无需搜索就是两个中间地图块中较近的一个，到它
+        # 的路径就是<potential_path>的前半部分。
+        target_tiles = [potential_path[int(len(potential_path)/2)]]
     
     elif "<waiting>" in plan: 
       # Executing interaction where the persona has decided to wait before
@@ -107,7 +115,7 @@ def execute(persona, maze, personas, plan):
       # 执行一个随机位置的行动。
       plan = ":".join(plan.split(":")[:-1])
       target_tiles = maze.address_tiles[plan]
-      target_tiles = random.sample(list(target_tiles), 1)
+      target_tiles = persona.rng.sample(list(target_tiles), 1)
 
     else: 
       # This is our default execution. We simply take the persona to the
@@ -122,72 +130,98 @@ def execute(persona, maze, personas, plan):
       if plan not in maze.address_tiles: 
         maze.address_tiles["Johnson Park:park:park garden"] #ERRORRRRRRR
       else: 
-        target_tiles = maze.address_tiles[plan]
-
-    # There are sometimes more than one tile returned from this (e.g., a table
-    # may stretch many coordinates). So, we sample a few here. And from that 
-    # random sample, we will take the closest ones. 
-
-    # 有时这里不止返回一个地图块（例如，一个表可能延伸很多坐标）。所以，这里采样一部分。
-    # 并且从那些随机样本从获取最近的一个。
-    if len(target_tiles) < 4: 
-      target_tiles = random.sample(list(target_tiles), len(target_tiles))
-    else:
-      target_tiles = random.sample(list(target_tiles), 4)
-    # If possible, we want personas to occupy different tiles when they are 
-    # headed to the same location on the maze. It is ok if they end up on the 
-    # same time, but we try to lower that probability. 
-    # We take care of that overlap here.  
-
-    # 如果可能的话，我们希望角色在前往迷宫上的同一位置时占据不同的方格。如果他们最后
-    # 在同一个方格上，那也没关系，但我们尽量降低这种可能性。在这里处理重叠情况。
-    persona_name_set = set(personas.keys())
-    new_target_tiles = []
-    for i in target_tiles: 
-      curr_event_set = maze.access_tile(i)["events"]
-      pass_curr_tile = False
-      for j in curr_event_set: 
-        if j[0] in persona_name_set: 
-          pass_curr_tile = True
-      if not pass_curr_tile: 
-        new_target_tiles += [i]
-    if len(new_target_tiles) == 0: 
-      new_target_tiles = target_tiles
-    target_tiles = new_target_tiles
-
-    # Now that we've identified the target tile, we find the shortest path to
-    # one of the target tiles. 
-
-    # 到这里程序已经识别了目标的地图块，并且找到去往其中一个目标地图块的最短路径。
+        target_address = plan
+
     curr_tile = persona.scratch.curr_tile
-    collision_maze = maze.collision_maze
-    closest_target_tile = None
-    path = None
-    for i in target_tiles: 
-      # path_finder takes a collision_mze and the curr_tile coordinate as 
-      # an input, and returns a list of coordinate tuples that becomes the
-      # path. 
-      # e.g., [(0, 1), (1, 1), (1, 2), (1, 3), (1, 4)...]
-
-      # path_finder函数接收collision_mze和curr_tile坐标作为输入，并且返回变成
-      # 路径的坐标元组列表。
-      # e.g., [(0, 1), (1, 1), (1, 2), (1, 3), (1, 4)...]
-      curr_path = path_finder(maze.collision_maze, 
-                              curr_tile, 
-                              i, 
-                              collision_block_id)
-      if not closest_target_tile: 
-        closest_target_tile = i
-        path = curr_path
-      elif len(curr_path) < len(path): 
-        closest_target_tile = i
-        path = curr_path
+    if target_address: 
+      # The path to the nearest tile of the address is read off the 
+      # address's distance field. If possible, we want personas to occupy 
+      # different tiles when they are headed to the same location, so tiles
+      # where other personas are standing are avoided. Where they stand is 
+      # read from the tiles at the start of the step, which do not change 
+      # while the others move. 
+      # 到地址最近地图块的路径从地址的距离场中读出。如果可能的话，我们希望角色在
+      # 前往同一位置时占据不同的地图块，所以会避开其他角色所在的地图块。他们所在的
+      # 位置从这一步开始时的地图块读取，它们在其他角色移动时不会改变。
+      occupied_tiles = set(tuple(tile) 
+                           for name, tile in personas_tile.items() 
+                           if name != persona.name)
+      path = maze.find_path_to_address(curr_tile, target_address, 
+                                       occupied_tiles)
+    else: 
+      # There are sometimes more than one tile returned from this (e.g., a table
+      # may stretch many coordinates). So, we sample a few here. And from that 
+      # random sample, we will take the closest ones. 
+
+      # 有时这里不止返回一个地图块（例如，一个表可能延伸很多坐标）。所以，这里采样一部分。
+      # 并且从那些随机样本从获取最近的一个。
+      if len(target_tiles) < 4: 
+        target_tiles = persona.rng.sample(list(target_tiles), 
+                                          len(target_tiles))
+      else:
+        target_tiles = persona.rng.sample(list(target_tiles), 4)
+      # If possible, we want personas to occupy different tiles when they are 
+      # headed to the same location on the maze. It is ok if they end up on the 
+      # same time, but we try to lower that probability. 
+      # We take care of that overlap here.  
+
+      # 如果可能的话，我们希望角色在前往迷宫上的同一位置时占据不同的方格。如果他们最后
+      # 在同一个方格上，那也没关系，但我们尽量降低这种可能性。在这里处理重叠情况。
+      persona_name_set = set(personas.keys())
+      new_target_tiles = []
+      for i in target_tiles: 
+        curr_event_set = maze.access_tile(i)["events"]
+        pass_curr_tile = False
+        for j in curr_event_set: 
+          if j[0] in persona_name_set: 
+            pass_curr_tile = True
+        if not pass_curr_tile: 
+          new_target_tiles += [i]
+      if len(new_target_tiles) == 0: 
+        new_target_tiles = target_tiles
+      target_tiles = new_target_tiles
+
+      # Now that we've identified the target tile, we find the shortest path to
+      # one of the target tiles. 
+
+      # 到这里程序已经识别了目标的地图块，并且找到去往其中一个目标地图块的最短路径。
+      closest_target_tile = None
+      path = None
+      for i in target_tiles: 
+        # find_path takes the curr_tile coordinate and a target tile as an 
+        # input, and returns a list of coordinate tuples that becomes the path,
+        # or an empty list if the target cannot be reached. 
+        # e.g., [(0, 1), (1, 1), (1, 2), (1, 3), (1, 4)...]
+
+        # find_path函数接收curr_tile坐标和目标地图块作为输入，并且返回变成路径的
+        # 坐标元组列表，如果无法到达目标则返回空列表。
+        # e.g., [(0, 1), (1, 1), (1, 2), (1, 3), (1, 4)...]
+        curr_path = maze.find_path(curr_tile, i)
+        if not curr_path: 
+          continue
+        if not closest_target_tile: 
+          closest_target_tile = i
+          path = curr_path
+        elif len(curr_path) < len(path): 
+          closest_target_tile = i
+          path = curr_path
 
     # Actually setting the <planned_path> and <act_path_set>. We cut the 
     # first element in the planned_path because it includes the curr_tile. 
 
     # 真正设置<planned_path>和<act_path_set>的地方。这里删除了在planned_path的
     # 第一个元素是因为它包括了当前的tile
+    # If none of the target tiles can be reached, the persona stays where 
+    # they are. 
+    # 如果所有目标地图块都无法到达，角色留在原地。
+    if not path: 
+      path = [curr_tile]
+    # Once every persona has moved, the path is reserved against the paths 
+    # of the personas who set out before, and goes around them if it has to 
+    # (see Maze.reserve_requested_paths). 
+    # 所有角色都移动之后，路径会根据先出发的角色的路径进行预留，必要时绕开他们
+    # （参见Maze.reserve_requested_paths）。
+    maze.request_path(persona.name, path)
     persona.scratch.planned_path = path[1:]
     persona.scratch.act_path_set = True
   
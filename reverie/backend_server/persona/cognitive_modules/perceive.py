@@ -58,20 +58,19 @@ def perceive(persona, maze):
     ret_events：被感知并且是新的<ConceptNode>列表
   """
   # PERCEIVE SPACE
-  # We get the nearby tiles given our current tile and the persona's vision
-  # radius. 
+  # We get the distinct addresses of the nearby tiles given our current tile 
+  # and the persona's vision radius. 
 
   # 感知空间
-  # 给定的当前地图块和角色的可视范围，返回周围的地图块。
-  nearby_tiles = maze.get_nearby_tiles(persona.scratch.curr_tile, 
-                                       persona.scratch.vision_r)
+  # 给定的当前地图块和角色的可视范围，返回周围地图块的不同地址。
+  nearby_addresses = maze.get_nearby_addresses(persona.scratch.curr_tile, 
+                                               persona.scratch.vision_r)
 
   # We then store the perceived space. Note that the s_mem of the persona is
   # in the form of a tree constructed using dictionaries. 
 
   # 存储感知空间。注意角色的s_mem是将字典构造为树的格式。
-  for i in nearby_tiles: 
-    i = maze.access_tile(i)
+  for i in nearby_addresses: 
     if i["world"]: 
       if (i["world"] not in persona.s_mem.tree): 
         persona.s_mem.tree[i["world"]] = {}
@@ -91,50 +90,24 @@ def perceive(persona, maze):
 
   # PERCEIVE EVENTS. 
   # We will perceive events that take place in the same arena as the
-  # persona's current arena. 
+  # persona's current arena, ordered by their distance, with the closest ones
+  # getting priorities. We do not perceive the same event twice (this can 
+  # happen if an object is extended across multiple tiles). The maze looks 
+  # these up in its spatial index of the events. 
 
   # 感知事件。
-  # 感知与角色当前所在场地相同的事件。
-  curr_arena_path = maze.get_tile_path(persona.scratch.curr_tile, "arena")
-  # We do not perceive the same event twice (this can happen if an object is
-  # extended across multiple tiles).
-
-  # 不会多次感知相同的事件（如果一个对象跨越多个方格的情况下可能发生）。
-  percept_events_set = set()
-  # We will order our percept based on the distance, with the closest ones
-  # getting priorities. 
-
-  # 程序将根据距离来排序感知，最近的一个获得最高优先级。
-  percept_events_list = []
-  # First, we put all events that are occuring in the nearby tiles into the
-  # percept_events_list
-
-  # 首先，把周围地图块正在发生的所有事件放入percept_events_list
-  for tile in nearby_tiles: 
-    tile_details = maze.access_tile(tile)
-    if tile_details["events"]: 
-      if maze.get_tile_path(tile, "arena") == curr_arena_path:  
-        # This calculates the distance between the persona's current tile, 
-        # and the target tile.
-
-        # 这里计算了角色所在地图块到目标地图块的距离。
-        dist = math.dist([tile[0], tile[1]], 
-                         [persona.scratch.curr_tile[0], 
-                          persona.scratch.curr_tile[1]])
-        # Add any relevant events to our temp set/list with the distant info. 
-        # 将任何相关事件和远程信息添加到临时集合/列表中。
-        for event in tile_details["events"]: 
-          if event not in percept_events_set: 
-            percept_events_list += [[dist, event]]
-            percept_events_set.add(event)
-
-  # We sort, and perceive only persona.scratch.att_bandwidth of the closest
-  # events. If the bandwidth is larger, then it means the persona can perceive
-  # more elements within a small area. 
-
-  # 分类并感知最近事件的persona.scratch.att_bandwidth。如果带宽更大，表示角色可以
+  # 感知与角色当前所在场地相同的事件，按距离排序，最近的获得最高优先级。不会多次
+  # 感知相同的事件（如果一个对象跨越多个方格的情况下可能发生）。迷宫在它的事件空间
+  # 索引中查找这些事件。
+  percept_events_list = maze.get_nearby_events(persona.scratch.curr_tile, 
+                                               persona.scratch.vision_r)
+
+  # We perceive only persona.scratch.att_bandwidth of the closest events. If 
+  # the bandwidth is larger, then it means the persona can perceive more 
+  # elements within a small area. 
+
+  # 只感知最近事件的persona.scratch.att_bandwidth。如果带宽更大，表示角色可以
   # 在小场地内感知更多的元素。
-  percept_events_list = sorted(percept_events_list, key=itemgetter(0))
   perceived_events = []
   for dist, event in percept_events_list[:persona.scratch.att_bandwidth]: 
     perceived_events += [event]
@@ -146,6 +119,17 @@ def perceive(persona, maze):
   # 保存事件。
   # <ret_events>是一个角色联想记忆的<ConceptNode>实例列表。
   ret_events = []
+
+  # We first pick the events that are new to the persona. We retrieve the 
+  # latest persona.scratch.retention events. If there is something new that
+  # is happening (that is, p_event not in latest_events), then we add that 
+  # event to the a_mem and return it. The events picked earlier in this loop
+  # count as the latest ones, just as if they were already in the a_mem. 
+
+  # 首先挑选出对角色来说是新的事件。获取最新的persona.scratch.retention事件。如果
+  # 有新事件发生（即p_event不在latest_events中），则将该事件添加到a_mem中并返回。
+  # 在这个循环中先挑选出的事件被视为最新的事件，就像它们已经在a_mem中一样。
+  new_events = []
   for p_event in perceived_events: 
     s, p, o, desc = p_event
     if not p: 
@@ -157,14 +141,10 @@ def perceive(persona, maze):
     desc = f"{s.split(':')[-1]} is {desc}"
     p_event = (s, p, o)
 
-    # We retrieve the latest persona.scratch.retention events. If there is  
-    # something new that is happening (that is, p_event not in latest_events),
-    # then we add that event to the a_mem and return it. 
-
-    # 获取最新的persona.scratch.retention事件。如果有新事件发生（即p_event不在
-    # latest_events中），则将该事件添加到a_mem中并返回。
-    latest_events = persona.a_mem.get_summarized_latest_events(
-                                    persona.scratch.retention)
+    latest_events = ([i[0] for i in reversed(new_events)] 
+                     + [i.spo_summary() for i in persona.a_mem.seq_event[
+                                                 :persona.scratch.retention]])
+    latest_events = set(latest_events[:persona.scratch.retention])
     if p_event not in latest_events:
       # We start by managing keywords. 
 
@@ -178,56 +158,72 @@ def perceive(persona, maze):
         obj = p_event[2].split(":")[-1]
       keywords.update([sub, obj])
 
-      # Get event embedding
-      # 获取事件嵌入
       desc_embedding_in = desc
       if "(" in desc: 
         desc_embedding_in = (desc_embedding_in.split("(")[1]
                                               .split(")")[0]
                                               .strip())
-      if desc_embedding_in in persona.a_mem.embeddings: 
-        event_embedding = persona.a_mem.embeddings[desc_embedding_in]
-      else: 
-        event_embedding = get_embedding(desc_embedding_in)
-      event_embedding_pair = (desc_embedding_in, event_embedding)
-      
-      # Get event poignancy. 
-      # 获取事件的犀利行。
-      event_poignancy = generate_poig_score(persona, 
-                                            "event", 
-                                            desc_embedding_in)
-
-      # If we observe the persona's self chat, we include that in the memory
-      # of the persona here.
-
-      # 如果观察到角色的自聊天，将它包含到角色记忆中。
-      chat_node_ids = []
-      if p_event[0] == f"{persona.name}" and p_event[1] == "chat with": 
-        curr_event = persona.scratch.act_event
-        if persona.scratch.act_description in persona.a_mem.embeddings: 
-          chat_embedding = persona.a_mem.embeddings[
-                             persona.scratch.act_description]
-        else: 
-          chat_embedding = get_embedding(persona.scratch
-                                                .act_description)
-        chat_embedding_pair = (persona.scratch.act_description, 
-                               chat_embedding)
-        chat_poignancy = generate_poig_score(persona, "chat", 
-                                             persona.scratch.act_description)
-        chat_node = persona.a_mem.add_chat(persona.scratch.curr_time, None,
-                      curr_event[0], curr_event[1], curr_event[2], 
-                      persona.scratch.act_description, keywords, 
-                      chat_poignancy, chat_embedding_pair, 
-                      persona.scratch.chat)
-        chat_node_ids = [chat_node.node_id]
-
-      # Finally, we add the current event to the agent's memory. 
-      # 最后，把当前事件加入到代理的记忆中。
-      ret_events += [persona.a_mem.add_event(persona.scratch.curr_time, None,
-                           s, p, o, desc, keywords, event_poignancy, 
-                           event_embedding_pair, chat_node_ids)]
-      persona.scratch.importance_trigger_curr -= event_poignancy
-      persona.scratch.importance_ele_n += 1
+      new_events += [(p_event, desc, keywords, desc_embedding_in)]
+
+  # If we observe the persona's self chat, we include that in the memory
+  # of the persona here.
+
+  # 如果观察到角色的自聊天，将它包含到角色记忆中。
+  chat_events = [i[0] for i in new_events 
+                 if i[0][0] == f"{persona.name}" and i[0][1] == "chat with"]
+
+  # Then we get the embeddings and the poignancy of all new events at once. 
+  # The embeddings that are not known yet are resolved in a single batched
+  # request, which is sent together with the poignancy requests. 
+
+  # 然后一次性获取所有新事件的嵌入和重要性。尚未知道的嵌入通过一次批量请求解析，它
+  # 与重要性请求一起发送。
+  embedding_texts = [i[3] for i in new_events]
+  if chat_events: 
+    embedding_texts += [persona.scratch.act_description]
+  unknown_texts = [i for i in embedding_texts 
+                   if i not in persona.a_mem.embeddings]
+  results = run_concurrently(
+    lambda: get_embeddings(unknown_texts) if unknown_texts else [], 
+    *[lambda i=i: generate_poig_score(persona, "event", i[3]) 
+      for i in new_events],
+    *[lambda: generate_poig_score(persona, "chat", 
+                                  persona.scratch.act_description) 
+      for i in chat_events])
+  embeddings = dict(zip(unknown_texts, results[0]))
+  event_poignancies = results[1:len(new_events)+1]
+  chat_poignancies = results[len(new_events)+1:]
+
+  # Finally, we add the new events to the agent's memory. 
+  # 最后，把新事件加入到代理的记忆中。
+  for (p_event, desc, keywords, desc_embedding_in), event_poignancy in zip(
+                                                new_events, event_poignancies):
+    s, p, o = p_event
+    event_embedding = persona.a_mem.embeddings.get(
+                        desc_embedding_in, embeddings.get(desc_embedding_in))
+    event_embedding_pair = (desc_embedding_in, event_embedding)
+
+    chat_node_ids = []
+    if p_event in chat_events: 
+      curr_event = persona.scratch.act_event
+      chat_embedding = persona.a_mem.embeddings.get(
+                         persona.scratch.act_description, 
+                         embeddings.get(persona.scratch.act_description))
+      chat_embedding_pair = (persona.scratch.act_description, 
+                             chat_embedding)
+      chat_poignancy = chat_poignancies[chat_events.index(p_event)]
+      chat_node = persona.a_mem.add_chat(persona.scratch.curr_time, None,
+                    curr_event[0], curr_event[1], curr_event[2], 
+                    persona.scratch.act_description, keywords, 
+                    chat_poignancy, chat_embedding_pair, 
+                    persona.scratch.chat)
+      chat_node_ids = [chat_node.node_id]
+
+    ret_events += [persona.a_mem.add_event(persona.scratch.curr_time, None,
+                         s, p, o, desc, keywords, event_poignancy, 
+                         event_embedding_pair, chat_node_ids)]
+    persona.scratch.importance_trigger_curr -= event_poignancy
+    persona.scratch.importance_ele_n += 1
 
   return ret_events
 
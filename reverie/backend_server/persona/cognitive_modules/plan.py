@@ -810,13 +810,6 @@ def _determine_action(persona, maze):
 
   # 从行为描述和持续时间生成一个<Action>类实例。至此，我们假设所有相关的操作都在
   # f_daily_schedule中分解并准备好了。
-  print ("DEBUG LJSDLFSKJF")
-  for i in persona.scratch.f_daily_schedule: print (i)
-  print (curr_index)
-  print (len(persona.scratch.f_daily_schedule))
-  print (persona.scratch.name)
-  print ("------")
-
   # 1440
   x_emergency = 0
   for i in persona.scratch.f_daily_schedule: 
@@ -916,7 +909,7 @@ def _choose_retrieved(persona, retrieved):
         and curr_event.subject != persona.name): 
       priority += [rel_ctx]
   if priority: 
-    return random.choice(priority)
+    return persona.rng.choice(priority)
 
   # Skip idle. 
   # 跳过空闲状态。
@@ -925,7 +918,7 @@ def _choose_retrieved(persona, retrieved):
     if "is idle" not in event_desc: 
       priority += [rel_ctx]
   if priority: 
-    return random.choice(priority)
+    return persona.rng.choice(priority)
   return None
 
 
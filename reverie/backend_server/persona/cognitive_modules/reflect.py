@@ -138,26 +138,46 @@ def run_reflect(persona):
   # <retrieved>的键是关注点，值是相关节点。
   retrieved = new_retrieve(persona, focal_points)
 
-  # For each of the focal points, generate thoughts and save it in the 
-  # agent's memory. 
+  # For each of the focal points, generate thoughts. 
 
-  # 对每个关注点，生成想法并保存到代理的记忆中。
+  # 对每个关注点，生成想法。
+  all_thoughts = []
   for focal_pt, nodes in retrieved.items(): 
     xx = [i.embedding_key for i in nodes]
     for xxx in xx: print (xxx)
 
     thoughts = generate_insights_and_evidence(persona, nodes, 5)
-    for thought, evidence in thoughts.items(): 
-      created = persona.scratch.curr_time
-      expiration = persona.scratch.curr_time + datetime.timedelta(days=30)
-      s, p, o = generate_action_event_triple(thought, persona)
-      keywords = set([s, p, o])
-      thought_poignancy = generate_poig_score(persona, "thought", thought)
-      thought_embedding_pair = (thought, get_embedding(thought))
-
-      persona.a_mem.add_thought(created, expiration, s, p, o, 
-                                thought, keywords, thought_poignancy, 
-                                thought_embedding_pair, evidence)
+    all_thoughts += list(thoughts.items())
+
+  # The triples and the poignancy of the thoughts do not depend on each 
+  # other, so their requests are sent together, along with one batched 
+  # request for the embeddings of all thoughts. 
+
+  # 想法的三元组和重要性互不依赖，所以它们的请求会一起发送，同时还会发送一个包含所有
+  # 想法嵌入的批量请求。
+  results = run_concurrently(
+    lambda: get_embeddings([thought for thought, _ in all_thoughts]), 
+    *[lambda thought=thought: generate_action_event_triple(thought, persona)
+      for thought, _ in all_thoughts], 
+    *[lambda thought=thought: generate_poig_score(persona, "thought", thought)
+      for thought, _ in all_thoughts])
+  thought_embeddings = results[0]
+  triples = results[1:len(all_thoughts)+1]
+  poignancies = results[len(all_thoughts)+1:]
+
+  # Save the thoughts in the agent's memory. 
+  # 把想法保存到代理的记忆中。
+  for count, (thought, evidence) in enumerate(all_thoughts): 
+    created = persona.scratch.curr_time
+    expiration = persona.scratch.curr_time + datetime.timedelta(days=30)
+    s, p, o = triples[count]
+    keywords = set([s, p, o])
+    thought_poignancy = poignancies[count]
+    thought_embedding_pair = (thought, thought_embeddings[count])
+
+    persona.a_mem.add_thought(created, expiration, s, p, o, 
+                              thought, keywords, thought_poignancy, 
+                              thought_embedding_pair, evidence)
 
 
 def reflection_trigger(persona): 
@@ -268,15 +288,29 @@ def reflect(persona):
 
       evidence = [persona.a_mem.get_last_chat(persona.scratch.chatting_with).node_id]
 
-      planning_thought = generate_planning_thought_on_convo(persona, all_utt)
+      # The planning thought and the memo are both generated from the 
+      # conversation alone, so their requests are sent together. 
+      # 计划想法和备忘录都只由对话生成，所以它们的请求会一起发送。
+      planning_thought, memo_thought = run_concurrently(
+        lambda: generate_planning_thought_on_convo(persona, all_utt),
+        lambda: generate_memo_on_convo(persona, all_utt))
       planning_thought = f"For {persona.scratch.name}'s planning: {planning_thought}"
+      memo_thought = f"{persona.scratch.name} {memo_thought}"
+
+      (planning_s_p_o, planning_poignancy, memo_s_p_o, memo_poignancy, 
+       thought_embeddings) = run_concurrently(
+        lambda: generate_action_event_triple(planning_thought, persona),
+        lambda: generate_poig_score(persona, "thought", planning_thought),
+        lambda: generate_action_event_triple(memo_thought, persona),
+        lambda: generate_poig_score(persona, "thought", memo_thought),
+        lambda: get_embeddings([planning_thought, memo_thought]))
 
       created = persona.scratch.curr_time
       expiration = persona.scratch.curr_time + datetime.timedelta(days=30)
-      s, p, o = generate_action_event_triple(planning_thought, persona)
+      s, p, o = planning_s_p_o
       keywords = set([s, p, o])
-      thought_poignancy = generate_poig_score(persona, "thought", planning_thought)
-      thought_embedding_pair = (planning_thought, get_embedding(planning_thought))
+      thought_poignancy = planning_poignancy
+      thought_embedding_pair = (planning_thought, thought_embeddings[0])
 
       persona.a_mem.add_thought(created, expiration, s, p, o, 
                                 planning_thought, keywords, thought_poignancy, 
@@ -284,15 +318,12 @@ def reflect(persona):
 
 
 
-      memo_thought = generate_memo_on_convo(persona, all_utt)
-      memo_thought = f"{persona.scratch.name} {memo_thought}"
-
       created = persona.scratch.curr_time
       expiration = persona.scratch.curr_time + datetime.timedelta(days=30)
-      s, p, o = generate_action_event_triple(memo_thought, persona)
+      s, p, o = memo_s_p_o
       keywords = set([s, p, o])
-      thought_poignancy = generate_poig_score(persona, "thought", memo_thought)
-      thought_embedding_pair = (memo_thought, get_embedding(memo_thought))
+      thought_poignancy = memo_poignancy
+      thought_embedding_pair = (memo_thought, thought_embeddings[1])
 
       persona.a_mem.add_thought(created, expiration, s, p, o, 
                                 memo_thought, keywords, thought_poignancy, 
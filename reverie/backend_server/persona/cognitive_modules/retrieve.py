@@ -16,6 +16,8 @@ sys.path.append('../../')
 from global_methods import *
 from persona.prompt_template.gpt_structure import *
 
+import numpy
+
 from numpy import dot
 from numpy.linalg import norm
 
@@ -188,6 +190,46 @@ def top_highest_x_values(d, x):
   return top_v
 
 
+def normalize_array_floats(a, target_min, target_max): 
+  """
+  The NumPy version of normalize_dict_floats. It returns a new array with the
+  values of 'a' scaled between target_min and target_max. 
+  """
+  """
+  normalize_dict_floats的NumPy版本。它返回一个新数组，其中'a'的值被缩放到
+  target_min和target_max之间。
+  """
+  min_val = a.min()
+  max_val = a.max()
+  range_val = max_val - min_val
+
+  if range_val == 0: 
+    return numpy.full(len(a), (target_max - target_min)/2)
+  return (a - min_val) * (target_max - target_min) / range_val + target_min
+
+
+def top_highest_x_indices(a, x): 
+  """
+  The NumPy version of top_highest_x_values. It returns the indices of the 
+  'x' highest values of 'a', from the highest down. Equal values keep their
+  order in 'a', just like the stable sort in top_highest_x_values. 
+  """
+  """
+  top_highest_x_values的NumPy版本。它返回'a'中'x'个最高值的索引，从高到低排列。
+  相等的值保持它们在'a'中的顺序，就像top_highest_x_values中的稳定排序一样。
+  """
+  if x < len(a): 
+    # Only the values at or above the x-th highest one can make the cut, so
+    # only those are sorted. 
+    # 只有大于等于第x高的值才能入选，所以只对它们排序。
+    threshold = -numpy.partition(-a, x - 1)[x - 1]
+    candidates = numpy.nonzero(a >= threshold)[0]
+  else: 
+    candidates = numpy.arange(len(a))
+  order = numpy.argsort(-a[candidates], kind="stable")
+  return candidates[order][:x]
+
+
 def extract_recency(persona, nodes):
   """
   Gets the current Persona object and a list of nodes that are in a 
@@ -276,11 +318,12 @@ def extract_relevance(persona, nodes, focal_pt):
     relevance_out：一个字典，键为node.node_id，值为代表相关性分数的浮点数。
   """
   focal_embedding = get_embedding(focal_pt)
+  relevance_rows = persona.a_mem.embeddings.cos_sim([focal_embedding])[:, 0]
 
   relevance_out = dict()
   for count, node in enumerate(nodes): 
-    node_embedding = persona.a_mem.embeddings[node.embedding_key]
-    relevance_out[node.node_id] = cos_sim(node_embedding, focal_embedding)
+    row = persona.a_mem.embeddings.row(node.embedding_key)
+    relevance_out[node.node_id] = relevance_rows[row]
 
   return relevance_out
 
@@ -320,27 +363,62 @@ def new_retrieve(persona, focal_points, n_count=30):
   # <retrieved> is the main dictionary that we are returning
   # <retrieved>是正在返回的主要字典。
   retrieved = dict() 
-  for focal_pt in focal_points: 
-    # Getting all nodes from the agent's memory (both thoughts and events) and
-    # sorting them by the datetime of creation.
-    # You could also imagine getting he raw conversation, but for now. 
-
-    # 从代理的记忆（包括想法和事件）中获取所有节点，然后将他们按照创建日期进行分类。
-    # 你也可以想象得到他的原始对话。
-    nodes = [[i.last_accessed, i]
-              for i in persona.a_mem.seq_event + persona.a_mem.seq_thought
-              if "idle" not in i.embedding_key]
-    nodes = sorted(nodes, key=lambda x: x[0])
-    nodes = [i for created, i in nodes]
-
-    # Calculating the component dictionaries and normalizing them.
-    # 计算组件字典并将他们标准化。
-    recency_out = extract_recency(persona, nodes)
-    recency_out = normalize_dict_floats(recency_out, 0, 1)
-    importance_out = extract_importance(persona, nodes)
-    importance_out = normalize_dict_floats(importance_out, 0, 1)  
-    relevance_out = extract_relevance(persona, nodes, focal_pt)
-    relevance_out = normalize_dict_floats(relevance_out, 0, 1)
+
+  # Getting all nodes from the agent's memory (both thoughts and events) as 
+  # arrays. You could also imagine getting he raw conversation, but for now. 
+
+  # 以数组形式从代理的记忆（包括想法和事件）中获取所有节点。
+  # 你也可以想象得到他的原始对话。
+  nodes, rows, poignancy, last_accessed, seq_position = (persona.a_mem
+                                                         .get_scoring_arrays())
+  if not nodes or not focal_points: 
+    return {focal_pt: [] for focal_pt in focal_points}
+
+  # The relevance of every node to every focal point is computed with a 
+  # single matrix multiply. If the memory has a trained ANN index, only the
+  # candidates it returns for a focal point are scored, and the other nodes
+  # are left out of that focal point's ranking. 
+
+  # 每个节点与每个关注点的相关性通过一次矩阵乘法计算。如果记忆有一个训练好的ANN
+  # 索引，则只给它为关注点返回的候选评分，其他节点不参与该关注点的排序。
+  focal_embeddings = get_embeddings(focal_points)
+  ann_index = persona.a_mem.ann_index
+  if ann_index and ann_index.is_trained(): 
+    relevance_all = numpy.full((len(nodes), len(focal_points)), numpy.nan)
+    for count, (cand_rows, cand_sims) in enumerate(
+                                  ann_index.search(focal_embeddings)): 
+      cand_order = numpy.argsort(cand_rows)
+      pos = numpy.searchsorted(cand_rows[cand_order], rows)
+      pos = numpy.minimum(pos, len(cand_rows) - 1)
+      hit = cand_rows[cand_order][pos] == rows
+      relevance_all[hit, count] = cand_sims[cand_order][pos[hit]]
+  else: 
+    relevance_all = persona.a_mem.embeddings.cos_sim(focal_embeddings)[rows]
+
+  importance_out = normalize_array_floats(poignancy, 0, 1)
+  recency_vals = persona.scratch.recency_decay ** numpy.arange(1, 
+                                                               len(nodes) + 1)
+
+  for count, focal_pt in enumerate(focal_points): 
+    # Sorting the nodes by the datetime of their last access (and then by 
+    # their position in seq_event + seq_thought). This is done for every 
+    # focal point, since the nodes retrieved for a focal point are accessed 
+    # before the next one is scored. 
+
+    # 将节点按照最近访问的日期排序（然后按它们在seq_event + seq_thought中的
+    # 位置排序）。每个关注点都要重新排序，因为为一个关注点检索到的节点在下一个关注点
+    # 评分之前就被访问了。
+    order = numpy.lexsort((seq_position, last_accessed))
+
+    # Calculating the component arrays and normalizing them.
+    # 计算组件数组并将他们标准化。
+    recency_out = numpy.empty(len(nodes))
+    recency_out[order] = recency_vals
+    recency_out = normalize_array_floats(recency_out, 0, 1)
+    relevance_out = relevance_all[:, count]
+    candidates = ~numpy.isnan(relevance_out)
+    relevance_out[candidates] = normalize_array_floats(
+                                  relevance_out[candidates], 0, 1)
 
     # Computing the final scores that combines the component values. 
     # Note to self: test out different weights. [1, 1, 1] tends to work
@@ -352,33 +430,28 @@ def new_retrieve(persona, focal_points, n_count=30):
     # gw = [1, 1, 1]
     # gw = [1, 2, 1]
     gw = [0.5, 3, 2]
-    master_out = dict()
-    for key in recency_out.keys(): 
-      master_out[key] = (persona.scratch.recency_w*recency_out[key]*gw[0] 
-                     + persona.scratch.relevance_w*relevance_out[key]*gw[1] 
-                     + persona.scratch.importance_w*importance_out[key]*gw[2])
-
-    master_out = top_highest_x_values(master_out, len(master_out.keys()))
-    for key, val in master_out.items(): 
-      print (persona.a_mem.id_to_node[key].embedding_key, val)
-      print (persona.scratch.recency_w*recency_out[key]*1, 
-             persona.scratch.relevance_w*relevance_out[key]*1, 
-             persona.scratch.importance_w*importance_out[key]*1)
-
-    # Extracting the highest x values.
-    # <master_out> has the key of node.id and value of float. Once we get the 
-    # highest x values, we want to translate the node.id into nodes and return
-    # the list of nodes.
-
-    # 导出最高的x值。
-    # <master_out>具有键为node.id以及浮点数值。一旦拿到了最高的x值，我们想要将node.id
-    # 翻译到节点中然后返回节点列表。
-    master_out = top_highest_x_values(master_out, n_count)
-    master_nodes = [persona.a_mem.id_to_node[key] 
-                    for key in list(master_out.keys())]
+    master_out = (persona.scratch.recency_w*recency_out*gw[0] 
+                  + persona.scratch.relevance_w*relevance_out*gw[1] 
+                  + persona.scratch.importance_w*importance_out*gw[2])
+
+    # Extracting the highest x values. Ties are broken by the last access 
+    # order of the nodes. 
+    # 导出最高的x值。分数相同时按节点的最近访问顺序排列。
+    master_out[numpy.isnan(master_out)] = -numpy.inf
+    top = order[top_highest_x_indices(master_out[order], n_count)]
+    top = top[master_out[top] > -numpy.inf]
+    master_nodes = [nodes[i] for i in top]
+
+    if debug: 
+      for i in top: 
+        print (nodes[i].embedding_key, master_out[i])
+        print (persona.scratch.recency_w*recency_out[i]*1, 
+               persona.scratch.relevance_w*relevance_out[i]*1, 
+               persona.scratch.importance_w*importance_out[i]*1)
 
     for n in master_nodes: 
       n.last_accessed = persona.scratch.curr_time
+    last_accessed[top] = numpy.datetime64(persona.scratch.curr_time, "us")
       
     retrieved[focal_pt] = master_nodes
 
@@ -0,0 +1,228 @@
+"""
+File: ann_index.py
+Description: Defines an approximate nearest-neighbour index (an inverted file
+index, IVF) over the rows of a persona's EmbeddingMatrix. It lets
+new_retrieve score only the memories that are likely to be relevant to a
+focal point instead of every memory, which matters for simulations that run
+for many simulated days. It is pure NumPy and needs no external service.
+"""
+"""
+文件：ann_index.py
+描述：定义一个基于角色EmbeddingMatrix各行的近似最近邻索引（倒排文件索引，IVF）。它让
+new_retrieve只需给可能与关注点相关的记忆评分，而不是给所有记忆评分，这对于运行多个
+仿真日的仿真很重要。它只使用NumPy，不需要任何外部服务。
+"""
+import sys
+sys.path.append('../../')
+
+import time
+
+import numpy
+
+import utils
+
+# <memory_ann_index> turns the index on. <memory_ann_min_size> is the number
+# of memories below which exact scoring is used (and the index is not
+# trained yet). <memory_ann_n_probe> is the number of clusters searched per
+# query, and <memory_ann_candidates> is the number of candidates a query
+# returns. They can all be overridden in utils.py.
+
+# <memory_ann_index>开启索引。<memory_ann_min_size>是记忆数量的下限，低于它时使用
+# 精确评分（并且索引尚未训练）。<memory_ann_n_probe>是每次查询搜索的簇的数量，
+# <memory_ann_candidates>是一次查询返回的候选数量。它们都可以在utils.py中覆盖。
+memory_ann_index = getattr(utils, "memory_ann_index", False)
+memory_ann_min_size = getattr(utils, "memory_ann_min_size", 2048)
+memory_ann_n_probe = getattr(utils, "memory_ann_n_probe", 8)
+memory_ann_candidates = getattr(utils, "memory_ann_candidates", 256)
+
+
+class IVFIndex:
+  def __init__(self, embeddings, min_size=memory_ann_min_size,
+                     n_probe=memory_ann_n_probe):
+    # <embeddings> is the EmbeddingMatrix whose rows are indexed. The index
+    # only stores row numbers; the vectors are always read from the matrix.
+
+    # <embeddings>是被索引的EmbeddingMatrix。索引只保存行号；向量总是从矩阵中
+    # 读取。
+    self.embeddings = embeddings
+    self.min_size = min_size
+    self.n_probe = n_probe
+
+    # <centroids> is the (n_lists x d) matrix of unit-length cluster centres,
+    # or None until the index is trained. <lists> holds the rows assigned to
+    # each cluster. <rows> is every indexed row, and <trained_size> is the
+    # number of rows the index was last trained on.
+
+    # <centroids>是(n_lists x d)的单位长度簇中心矩阵，训练之前为None。<lists>保存
+    # 分配到每个簇的行。<rows>是所有被索引的行，<trained_size>是索引上次训练时的
+    # 行数。
+    self.centroids = None
+    self.lists = []
+    self.rows = []
+    self.indexed = set()
+    self.trained_size = 0
+
+
+  def is_trained(self):
+    return self.centroids is not None
+
+
+  def _unit_rows(self, rows):
+    vectors = self.embeddings.data[rows]
+    norms = self.embeddings.norms[rows]
+    return vectors / numpy.where(norms == 0, 1, norms)[:, None]
+
+
+  def add(self, row):
+    """
+    Adds a row of the embedding matrix to the index. Before the index is
+    trained, rows are only collected. The index is trained once there are
+    <min_size> rows, and trained again whenever the number of rows has
+    quadrupled since, so that the clusters keep up with the memory.
+    """
+    """
+    将嵌入矩阵的一行添加到索引中。索引训练之前，只会收集行。当有<min_size>行时索引
+    会被训练，此后每当行数增长到四倍时会重新训练，使簇跟上记忆的增长。
+    """
+    if row in self.indexed:
+      return
+    self.indexed.add(row)
+    self.rows += [row]
+
+    if not self.is_trained():
+      if len(self.rows) >= self.min_size:
+        self.train()
+    elif len(self.rows) >= 4 * self.trained_size:
+      self.train()
+    else:
+      vector = self._unit_rows([row])[0]
+      self.lists[int(numpy.argmax(self.centroids @ vector))] += [row]
+
+
+  def train(self, n_iter=10):
+    """
+    Clusters the indexed rows with spherical k-means (about sqrt(N)
+    clusters) and rebuilds the inverted lists. The initialization is seeded,
+    so the same memory always gives the same index.
+    """
+    """
+    用球面k-means将被索引的行聚类（大约sqrt(N)个簇），并重建倒排列表。初始化使用
+    固定的种子，因此相同的记忆总是得到相同的索引。
+    """
+    rows = numpy.array(self.rows)
+    vectors = self._unit_rows(rows)
+    n_lists = max(1, int(numpy.sqrt(len(rows))))
+
+    rng = numpy.random.default_rng(0)
+    centroids = vectors[rng.choice(len(rows), n_lists, replace=False)]
+    for i in range(n_iter):
+      assignment = numpy.argmax(vectors @ centroids.T, axis=1)
+      sums = numpy.zeros_like(centroids)
+      numpy.add.at(sums, assignment, vectors)
+      counts = numpy.bincount(assignment, minlength=n_lists)
+      # Empty clusters are restarted at a random row.
+      # 空的簇会从一个随机的行重新开始。
+      empty = counts == 0
+      sums[empty] = vectors[rng.choice(len(rows), empty.sum())]
+      norms = numpy.linalg.norm(sums, axis=1, keepdims=True)
+      centroids = sums / numpy.where(norms == 0, 1, norms)
+
+    assignment = numpy.argmax(vectors @ centroids.T, axis=1)
+    self.centroids = centroids
+    self.lists = [[] for i in range(n_lists)]
+    for row, cluster in zip(rows.tolist(), assignment.tolist()):
+      self.lists[cluster] += [row]
+    self.trained_size = len(rows)
+
+
+  def search(self, queries, k=memory_ann_candidates):
+    """
+    Finds the rows that are most similar to each query, searching only the
+    <n_probe> clusters whose centres are closest to the query.
+
+    INPUT
+      queries: A list of Q query embeddings.
+      k: The maximum number of rows returned per query.
+    OUTPUT
+      A list of Q (rows, similarities) pairs, where <rows> is an int array
+      of matrix rows and <similarities> their cosine similarity to the
+      query, from the most similar down.
+    """
+    """
+    找出与每个查询最相似的行，只搜索中心最接近查询的<n_probe>个簇。
+
+    输入：
+      queries：Q个查询嵌入的列表。
+      k：每个查询返回的最大行数。
+    输出：
+      Q个（行，相似度）对的列表，其中<rows>是矩阵行的整数数组，<similarities>是
+      它们与查询的余弦相似度，从最相似的开始排列。
+    """
+    queries = numpy.asarray(queries, dtype=numpy.float32)
+    norms = numpy.linalg.norm(queries, axis=1, keepdims=True)
+    queries = queries / numpy.where(norms == 0, 1, norms)
+
+    ret = []
+    n_probe = min(self.n_probe, len(self.lists))
+    for query in queries:
+      centre_sims = self.centroids @ query
+      probe = numpy.argpartition(-centre_sims, n_probe - 1)[:n_probe]
+      rows = numpy.array([row for cluster in probe
+                              for row in self.lists[cluster]], dtype=int)
+      sims = self._unit_rows(rows) @ query
+      if len(rows) > k:
+        top = numpy.argpartition(-sims, k - 1)[:k]
+        rows, sims = rows[top], sims[top]
+      order = numpy.argsort(-sims, kind="stable")
+      ret += [(rows[order], sims[order].astype(float))]
+    return ret
+
+
+if __name__ == '__main__':
+  # Recall vs. latency of the index against exact scoring, on synthetic
+  # memories that form topical clusters like real ones do.
+  # 在像真实记忆一样形成主题簇的合成记忆上，比较索引与精确评分的召回率和延迟。
+  from persona.memory_structures.embedding_matrix import EmbeddingMatrix
+
+  rng = numpy.random.default_rng(1)
+  d = 1536
+  n_topics = 200
+  k = 30
+  topics = rng.normal(size=(n_topics, d))
+
+  for n in [10000, 50000]:
+    embeddings = EmbeddingMatrix(capacity=n)
+    vectors = (topics[rng.integers(n_topics, size=n)]
+               + rng.normal(size=(n, d)))
+    for i in range(n):
+      embeddings[f"memory {i}"] = vectors[i]
+    queries = (topics[rng.integers(n_topics, size=50)]
+               + rng.normal(size=(50, d)))
+
+    # new_retrieve scores a handful of focal points at a time, so both are 
+    # timed one query at a time. 
+    # new_retrieve一次只给少数几个关注点评分，所以两者都按每次一个查询计时。
+    start = time.time()
+    exact_top = []
+    for query in queries:
+      exact = embeddings.cos_sim([query])[:, 0]
+      exact_top += [set(numpy.argsort(-exact)[:k].tolist())]
+    exact_ms = (time.time() - start) * 1000 / len(queries)
+
+    index = IVFIndex(embeddings, min_size=n)
+    start = time.time()
+    for row in range(n):
+      index.add(row)
+    build_s = time.time() - start
+    print (f"N={n}: exact {exact_ms:.2f} ms/query, "
+           f"index built in {build_s:.1f} s ({len(index.lists)} lists)")
+
+    for n_probe in [1, 4, 8, 16, 32]:
+      index.n_probe = n_probe
+      start = time.time()
+      results = [index.search([query], k)[0] for query in queries]
+      ann_ms = (time.time() - start) * 1000 / len(queries)
+      recall = numpy.mean([len(exact_top[j] & set(results[j][0].tolist())) / k
+                           for j in range(len(queries))])
+      print (f"  n_probe={n_probe:2d}: recall@{k} {recall:.3f}, "
+             f"{ann_ms:.2f} ms/query")
@@ -20,8 +20,34 @@ sys.path.append('../../')
 
 import json
 import datetime
+import numpy
 
+import utils
 from global_methods import *
+from persona.prompt_template.embedding_store import embedding_store
+from persona.prompt_template.gpt_structure import get_embeddings
+from persona.memory_structures.embedding_matrix import EmbeddingMatrix
+from persona.memory_structures.ann_index import *
+from persona.memory_structures.memory_columns import *
+
+# <memory_storage_format> is the layout the associative memory is saved in: 
+# "json" (nodes.json, kw_strength.json and embeddings.json) or "binary" 
+# (nodes.npz and embeddings.npy, see memory_columns.py). Either layout can be
+# loaded regardless of this setting. It can be overridden in utils.py. 
+# <memory_storage_format>是联想记忆保存时的布局："json"（nodes.json、
+# kw_strength.json和embeddings.json）或"binary"（nodes.npz和embeddings.npy，
+# 参见memory_columns.py）。无论这个设置是什么，两种布局都可以被加载。它可以在
+# utils.py中覆盖。
+memory_storage_format = getattr(utils, "memory_storage_format", "json")
+# <embeddings_keys_only> makes embeddings.json (and the save journal) keep 
+# only the embedding keys, with null vectors, while the vectors are kept in 
+# the shared embedding store only. This makes the saves smaller, but a 
+# simulation folder then depends on the store it was saved with. It can be 
+# overridden in utils.py. 
+# <embeddings_keys_only>使embeddings.json（以及保存日志）只保留嵌入键（向量为
+# null），而向量只保存在共享嵌入存储中。这会让保存的文件更小，但仿真文件夹会依赖于
+# 保存它时所用的存储。它可以在utils.py中覆盖。
+embeddings_keys_only = getattr(utils, "embeddings_keys_only", False)
 
 
 class ConceptNode: 
@@ -55,6 +81,18 @@ class ConceptNode:
     return (self.subject, self.predicate, self.object)
 
 
+# <SCORING_DTYPE> is the per-node record of AssociativeMemory.scoring_data. 
+# <row> is the node's row in the embedding matrix, <is_thought> tells thoughts
+# from events, and <type_count> is the node's type_count. 
+# <SCORING_DTYPE>是AssociativeMemory.scoring_data中每个节点的记录。<row>是节点
+# 在嵌入矩阵中的行，<is_thought>区分想法和事件，<type_count>是节点的type_count。
+SCORING_DTYPE = numpy.dtype([("row", numpy.int64), 
+                             ("poignancy", numpy.float64), 
+                             ("last_accessed", "datetime64[us]"), 
+                             ("is_thought", numpy.bool_), 
+                             ("type_count", numpy.int64)])
+
+
 class AssociativeMemory: 
   def __init__(self, f_saved): 
     self.id_to_node = dict()
@@ -70,80 +108,193 @@ class AssociativeMemory:
     self.kw_strength_event = dict()
     self.kw_strength_thought = dict()
 
-    self.embeddings = json.load(open(f_saved + "/embeddings.json"))
+    # <scoring_nodes> are the event and thought nodes that new_retrieve can
+    # retrieve (i.e., the non-idle ones) in the order they were added, and
+    # <scoring_data> holds the per-node values it scores them with, one 
+    # entry per node. See get_scoring_arrays. 
+
+    # <scoring_nodes>是new_retrieve可以检索的事件和想法节点（即非空闲的节点），
+    # 按添加的顺序排列，<scoring_data>保存它为这些节点评分所用的值，每个节点一项。
+    # 参见get_scoring_arrays。
+    self.scoring_nodes = []
+    self.scoring_data = numpy.zeros(64, dtype=SCORING_DTYPE)
+
+    if is_binary_memory(f_saved): 
+      saved = read_memory_columns(f_saved)
+      self.embeddings = EmbeddingMatrix.from_array(saved["embedding_keys"], 
+                                                   saved["embeddings"], 
+                                                   saved["embedding_norms"])
+      nodes_load = saved["nodes"]
+      kw_strength_load = {"kw_strength_event": saved["kw_strength_event"], 
+                          "kw_strength_thought": saved["kw_strength_thought"]}
+    else: 
+      self.embeddings = json.load(open(f_saved + "/embeddings.json"))
+      self.load_embeddings()
+      nodes_load = self.read_nodes_json(f_saved)
+      kw_strength_load = json.load(open(f_saved + "/kw_strength.json"))
+
+    # <ann_index> is the optional approximate nearest-neighbour index over
+    # the embeddings of the retrievable nodes (see ann_index.py). 
+    # <ann_index>是可选的基于可检索节点嵌入的近似最近邻索引（参见ann_index.py）。
+    self.ann_index = None
+    if memory_ann_index: 
+      self.ann_index = IVFIndex(self.embeddings)
+
+    for node_details in nodes_load: 
+      self.load_node(node_details)
 
-    nodes_load = json.load(open(f_saved + "/nodes.json"))
-    for count in range(len(nodes_load.keys())): 
-      node_id = f"node_{str(count+1)}"
-      node_details = nodes_load[node_id]
-
-      node_count = node_details["node_count"]
-      type_count = node_details["type_count"]
-      node_type = node_details["type"]
-      depth = node_details["depth"]
-
-      created = datetime.datetime.strptime(node_details["created"], 
-                                           '%Y-%m-%d %H:%M:%S')
-      expiration = None
-      if node_details["expiration"]: 
-        expiration = datetime.datetime.strptime(node_details["expiration"],
-                                                '%Y-%m-%d %H:%M:%S')
-
-      s = node_details["subject"]
-      p = node_details["predicate"]
-      o = node_details["object"]
-
-      description = node_details["description"]
-      embedding_pair = (node_details["embedding_key"], 
-                        self.embeddings[node_details["embedding_key"]])
-      poignancy =node_details["poignancy"]
-      keywords = set(node_details["keywords"])
-      filling = node_details["filling"]
-      
-      if node_type == "event": 
-        self.add_event(created, expiration, s, p, o, 
-                   description, keywords, poignancy, embedding_pair, filling)
-      elif node_type == "chat": 
-        self.add_chat(created, expiration, s, p, o, 
-                   description, keywords, poignancy, embedding_pair, filling)
-      elif node_type == "thought": 
-        self.add_thought(created, expiration, s, p, o, 
-                   description, keywords, poignancy, embedding_pair, filling)
-
-    kw_strength_load = json.load(open(f_saved + "/kw_strength.json"))
     if kw_strength_load["kw_strength_event"]: 
       self.kw_strength_event = kw_strength_load["kw_strength_event"]
     if kw_strength_load["kw_strength_thought"]: 
       self.kw_strength_thought = kw_strength_load["kw_strength_thought"]
 
+
+  def load_node(self, node_details): 
+    """
+    Adds a saved node back to the memory. Its embedding must already be in 
+    <self.embeddings>. 
+
+    INPUT: 
+      node_details: A (type, depth, created, expiration, s, p, o, 
+                    description, embedding_key, poignancy, keywords, filling)
+                    tuple. 
+    OUTPUT: 
+      The ConceptNode that was added. 
+    """
+    """
+    将一个已保存的节点重新添加到记忆中。它的嵌入必须已经在<self.embeddings>中。
+
+    输入：
+      node_details：一个(type, depth, created, expiration, s, p, o, 
+                    description, embedding_key, poignancy, keywords, filling)
+                    元组。
+    输出：
+      被添加的ConceptNode。
+    """
+    (node_type, depth, created, expiration, s, p, o, 
+     description, embedding_key, poignancy, keywords, filling) = node_details
+    embedding_pair = (embedding_key, self.embeddings[embedding_key])
+    keywords = set(keywords)
     
-  def save(self, out_json): 
+    if node_type == "event": 
+      return self.add_event(created, expiration, s, p, o, 
+                 description, keywords, poignancy, embedding_pair, filling)
+    elif node_type == "chat": 
+      return self.add_chat(created, expiration, s, p, o, 
+                 description, keywords, poignancy, embedding_pair, filling)
+    elif node_type == "thought": 
+      return self.add_thought(created, expiration, s, p, o, 
+                 description, keywords, poignancy, embedding_pair, filling)
+
+
+  def read_nodes_json(self, f_saved): 
+    """
+    Reads nodes.json into the same (type, depth, created, expiration, s, p, 
+    o, description, embedding_key, poignancy, keywords, filling) tuples that
+    read_memory_columns returns, from node_1 up. 
+    """
+    """
+    将nodes.json读取为与read_memory_columns返回的相同的(type, depth, created, 
+    expiration, s, p, o, description, embedding_key, poignancy, keywords, 
+    filling)元组，从node_1开始。
+    """
+    ret = []
+    nodes_load = json.load(open(f_saved + "/nodes.json"))
+    for count in range(len(nodes_load.keys())): 
+      node_id = f"node_{str(count+1)}"
+      ret += [self.parse_node_details(nodes_load[node_id])]
+    return ret
+
+
+  def parse_node_details(self, node_details): 
+    """
+    Turns one entry of nodes.json into a tuple for load_node. 
+    """
+    """
+    将nodes.json中的一项转换为load_node所用的元组。
+    """
+    created = datetime.datetime.strptime(node_details["created"], 
+                                         '%Y-%m-%d %H:%M:%S')
+    expiration = None
+    if node_details["expiration"]: 
+      expiration = datetime.datetime.strptime(node_details["expiration"],
+                                              '%Y-%m-%d %H:%M:%S')
+
+    return (node_details["type"], node_details["depth"], 
+            created, expiration, 
+            node_details["subject"], 
+            node_details["predicate"], 
+            node_details["object"], 
+            node_details["description"], 
+            node_details["embedding_key"], 
+            node_details["poignancy"], 
+            node_details["keywords"], 
+            node_details["filling"])
+
+
+  def get_node_details(self, node): 
+    """
+    Returns <node> as an entry of nodes.json. 
+    """
+    """
+    以nodes.json中一项的形式返回<node>。
+    """
+    r = dict()
+    r["node_count"] = node.node_count
+    r["type_count"] = node.type_count
+    r["type"] = node.type
+    r["depth"] = node.depth
+
+    r["created"] = node.created.strftime('%Y-%m-%d %H:%M:%S')
+    r["expiration"] = None
+    if node.expiration: 
+      r["expiration"] = node.expiration.strftime('%Y-%m-%d %H:%M:%S')
+
+    r["subject"] = node.subject
+    r["predicate"] = node.predicate
+    r["object"] = node.object
+
+    r["description"] = node.description
+    r["embedding_key"] = node.embedding_key
+    r["poignancy"] = node.poignancy
+    r["keywords"] = list(node.keywords)
+    r["filling"] = node.filling
+    return r
+
+
+  def save(self, out_json, storage_format=memory_storage_format): 
+    """
+    Saves the memory in <storage_format> ("json" or "binary"), and removes 
+    the files of the other layout from <out_json>. 
+    """
+    """
+    以<storage_format>（"json"或"binary"）保存记忆，并从<out_json>中删除另一种
+    布局的文件。
+    """
+    if storage_format == "binary": 
+      self.save_binary(out_json)
+      stale_files = JSON_MEMORY_FILES
+    else: 
+      self.save_json(out_json)
+      stale_files = BINARY_MEMORY_FILES
+    for file_name in stale_files: 
+      if os.path.exists(f"{out_json}/{file_name}"): 
+        os.remove(f"{out_json}/{file_name}")
+
+
+  def save_binary(self, out_json): 
+    write_memory_columns(out_json, 
+                         list(self.id_to_node.values()), 
+                         self.kw_strength_event, 
+                         self.kw_strength_thought, 
+                         self.embeddings)
+
+
+  def save_json(self, out_json): 
     r = dict()
     for count in range(len(self.id_to_node.keys()), 0, -1): 
       node_id = f"node_{str(count)}"
-      node = self.id_to_node[node_id]
-
-      r[node_id] = dict()
-      r[node_id]["node_count"] = node.node_count
-      r[node_id]["type_count"] = node.type_count
-      r[node_id]["type"] = node.type
-      r[node_id]["depth"] = node.depth
-
-      r[node_id]["created"] = node.created.strftime('%Y-%m-%d %H:%M:%S')
-      r[node_id]["expiration"] = None
-      if node.expiration: 
-        r[node_id]["expiration"] = (node.expiration
-                                        .strftime('%Y-%m-%d %H:%M:%S'))
-
-      r[node_id]["subject"] = node.subject
-      r[node_id]["predicate"] = node.predicate
-      r[node_id]["object"] = node.object
-
-      r[node_id]["description"] = node.description
-      r[node_id]["embedding_key"] = node.embedding_key
-      r[node_id]["poignancy"] = node.poignancy
-      r[node_id]["keywords"] = list(node.keywords)
-      r[node_id]["filling"] = node.filling
+      r[node_id] = self.get_node_details(self.id_to_node[node_id])
 
     with open(out_json+"/nodes.json", "w") as outfile:
       json.dump(r, outfile)
@@ -155,7 +306,153 @@ class AssociativeMemory:
       json.dump(r, outfile)
 
     with open(out_json+"/embeddings.json", "w") as outfile:
-      json.dump(self.embeddings, outfile)
+      json.dump(self.dump_embeddings(self.embeddings), outfile)
+
+
+  def dump_embeddings(self, keys): 
+    """
+    Returns the embeddings of <keys> in the format of embeddings.json. When 
+    the shared embedding store is enabled, the vectors are also written to 
+    the store. Only with <embeddings_keys_only> (and the store enabled) are 
+    the vectors left out, as null. 
+    """
+    """
+    以embeddings.json的格式返回<keys>的嵌入。当共享嵌入存储启用时，向量也会写入
+    存储。只有在开启<embeddings_keys_only>（并且存储启用）时，向量才会被省略为
+    null。
+    """
+    if embedding_store.enabled: 
+      embedding_store.put_many({key: self.embeddings[key] for key in keys})
+      if embeddings_keys_only: 
+        return {key: None for key in keys}
+    return {key: self.embeddings[key].tolist() for key in keys}
+
+
+  def load_embeddings(self): 
+    """
+    Resolves the embeddings that were loaded from embeddings.json. Vectors
+    saved inline are written back to the shared embedding store, and keys
+    saved without a vector (i.e., null) are looked up in the store. Keys 
+    that are not in the store either are embedded again, in one batch and 
+    with a warning. 
+    """
+    """
+    解析从embeddings.json加载的嵌入。内联保存的向量会写回共享嵌入存储，没有向量
+    （即null）的键会在存储中查找。存储中也没有的键会被重新嵌入，一次批量完成并给出
+    警告。
+    """
+    found = self.resolve_embeddings(self.embeddings)
+    embeddings = EmbeddingMatrix(capacity=max(len(self.embeddings), 64))
+    for key in self.embeddings: 
+      embeddings[key] = found[key]
+    self.embeddings = embeddings
+
+
+  def resolve_embeddings(self, embeddings): 
+    """
+    Turns embeddings in the format of embeddings.json (where a vector may be
+    null) into vectors, as described in load_embeddings. 
+
+    INPUT: 
+      embeddings: A dictionary from embedding keys to vectors or None. 
+    OUTPUT: 
+      A dictionary from the same keys to their vectors. 
+    """
+    """
+    将embeddings.json格式的嵌入（其中向量可能为null）转换为向量，如
+    load_embeddings中所述。
+
+    输入：
+      embeddings：一个字典，键为嵌入键，值为向量或None。
+    输出：
+      一个字典，键相同，值为它们的向量。
+    """
+    found = {key: vector for key, vector in embeddings.items() 
+                         if vector is not None}
+    if embedding_store.enabled: 
+      embedding_store.put_many(found)
+      found = embedding_store.get_many(list(embeddings.keys()))
+    missing = [key for key in embeddings if key not in found]
+    if missing: 
+      # The saved simulation relied on a store that does not have these 
+      # vectors (e.g., it was copied without it), so they cost new requests.
+      # 保存的仿真依赖的存储中没有这些向量（例如复制仿真时没有复制存储），所以它们
+      # 需要新的请求。
+      print (f"WARNING: {len(missing)} embeddings are neither saved nor in "
+             f"the embedding store ({embedding_store.path}); embedding "
+             f"them again.")
+      found.update(zip(missing, get_embeddings(missing)))
+    return found
+
+
+  def add_scoring_entry(self, node): 
+    """
+    Appends <node> to the scoring arrays, in place unless they have to grow.
+    Idle nodes are never retrieved, so they are skipped. 
+    """
+    """
+    将<node>追加到评分数组中，除非需要扩容，否则原地追加。空闲节点永远不会被检索，
+    所以它们会被跳过。
+    """
+    if "idle" in node.embedding_key: 
+      return
+    count = len(self.scoring_nodes)
+    if count == len(self.scoring_data): 
+      scoring_data = numpy.zeros(2 * count, dtype=SCORING_DTYPE)
+      scoring_data[:count] = self.scoring_data
+      self.scoring_data = scoring_data
+    row = self.embeddings.row(node.embedding_key)
+    self.scoring_data[count] = (row, 
+                                node.poignancy, 
+                                numpy.datetime64(node.last_accessed, "us"), 
+                                node.type == "thought", 
+                                node.type_count)
+    self.scoring_nodes += [node]
+    if self.ann_index: 
+      self.ann_index.add(row)
+
+
+  def get_scoring_arrays(self): 
+    """
+    Returns the arrays that new_retrieve scores the memory with. They are 
+    views of the arrays that add_event and add_thought append to, so no 
+    conversion happens here. 
+
+    INPUT: 
+      None
+    OUTPUT: 
+      nodes: The list of event and thought nodes that can be retrieved (i.e.,
+             the non-idle ones), in the order they were added. 
+      rows: An int vector of the nodes' rows in the embedding matrix. 
+      poignancy: A float vector of the nodes' poignancy. 
+      last_accessed: A datetime64 vector of the nodes' last_accessed. 
+                     new_retrieve writes to it together with the nodes. 
+      seq_position: An int vector of the nodes' positions in 
+                    seq_event + seq_thought. 
+    """
+    """
+    返回new_retrieve用于给记忆评分的数组。它们是add_event和add_thought追加的数组
+    的视图，所以这里不会发生任何转换。
+
+    输入：
+      无
+    输出：
+      nodes：可以被检索的事件和想法节点列表（即非空闲的节点），按添加的顺序排列。
+      rows：一个节点在嵌入矩阵中所在行的整数向量。
+      poignancy：一个节点重要性的浮点数向量。
+      last_accessed：一个节点last_accessed的datetime64向量。new_retrieve会与
+                     节点一起写入它。
+      seq_position：一个节点在seq_event + seq_thought中位置的整数向量。
+    """
+    data = self.scoring_data[:len(self.scoring_nodes)]
+    # seq_event and seq_thought hold the newest node first. 
+    # seq_event和seq_thought中最新的节点在最前面。
+    seq_position = numpy.where(
+      data["is_thought"], 
+      len(self.seq_event) + len(self.seq_thought) - data["type_count"], 
+      len(self.seq_event) - data["type_count"])
+    return (self.scoring_nodes, data["row"], data["poignancy"], 
+            data["last_accessed"], seq_position)
 
 
   def add_event(self, created, expiration, s, p, o, 
@@ -205,6 +502,7 @@ class AssociativeMemory:
           self.kw_strength_event[kw] = 1
 
     self.embeddings[embedding_pair[0]] = embedding_pair[1]
+    self.add_scoring_entry(node)
 
     return node
 
@@ -253,6 +551,7 @@ class AssociativeMemory:
           self.kw_strength_thought[kw] = 1
 
     self.embeddings[embedding_pair[0]] = embedding_pair[1]
+    self.add_scoring_entry(node)
 
     return node
 
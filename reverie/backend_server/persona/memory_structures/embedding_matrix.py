@@ -0,0 +1,197 @@
+"""
+File: embedding_matrix.py
+Description: Defines the EmbeddingMatrix class, which holds the embeddings of
+a persona's associative memory in one contiguous float32 matrix. It can be
+used like the text -> embedding dictionary that it replaces, while letting
+the retrieval code score all memories against a query without converting
+Python lists into arrays on every call.
+"""
+"""
+文件：embedding_matrix.py
+描述：定义EmbeddingMatrix类，它将角色联想记忆中的嵌入保存在一个连续的float32矩阵
+中。它可以像它所替代的“文本 -> 嵌入”字典一样使用，同时让检索代码无需每次调用都将
+Python列表转换为数组就能针对查询给所有记忆评分。
+"""
+from collections.abc import Mapping
+
+import numpy
+
+
+class EmbeddingMatrix(Mapping):
+  def __init__(self, embeddings=None, capacity=64):
+    # <data> holds one embedding per row. Only the first <size> rows are in
+    # use; the matrix doubles its capacity when it runs out of rows.
+    # <norms> holds the precomputed L2 norm of each row.
+    # <index> maps each embedding key (text) to its row.
+
+    # <data>每一行保存一个嵌入。只有前<size>行被使用；当行用完时矩阵容量翻倍。
+    # <norms>保存每一行预先计算的L2范数。
+    # <index>将每个嵌入键（文本）映射到它所在的行。
+    self.capacity = capacity
+    self.size = 0
+    self.data = None
+    self.norms = numpy.zeros(capacity, dtype=numpy.float32)
+    self.index = dict()
+    self.keys_by_row = []
+
+    if embeddings:
+      for key, vector in embeddings.items():
+        self[key] = vector
+
+
+  @classmethod
+  def from_array(cls, keys, data, norms):
+    """
+    Creates a matrix around an existing (N x d) array without copying it,
+    e.g., a memory-mapped embeddings.npy. The array is only copied once a
+    new key is appended.
+
+    INPUT
+      keys: The list of N embedding keys, one per row.
+      data: The (N x d) float32 array.
+      norms: The L2 norm of each row.
+    OUTPUT
+      An EmbeddingMatrix.
+    """
+    """
+    围绕一个已有的(N x d)数组创建矩阵，而不复制它，例如一个内存映射的
+    embeddings.npy。只有在追加新的键时才会复制数组。
+
+    输入：
+      keys：N个嵌入键的列表，每行一个。
+      data：(N x d)的float32数组。
+      norms：每一行的L2范数。
+    输出：
+      一个EmbeddingMatrix。
+    """
+    embeddings = cls(capacity=max(len(keys), 1))
+    if len(keys):
+      embeddings.data = data
+      embeddings.norms = numpy.array(norms, dtype=numpy.float32)
+      embeddings.size = len(keys)
+      embeddings.keys_by_row = list(keys)
+      embeddings.index = {key: row for row, key in enumerate(keys)}
+    return embeddings
+
+
+  def __getitem__(self, key):
+    return self.data[self.index[key]]
+
+
+  def __contains__(self, key):
+    return key in self.index
+
+
+  def __iter__(self):
+    return iter(self.keys_by_row)
+
+
+  def __len__(self):
+    return self.size
+
+
+  def __setitem__(self, key, vector):
+    """
+    Stores the embedding of <key>. A new key is appended as a new row (in
+    place, unless the matrix has to grow); a known key has its row
+    overwritten.
+    """
+    """
+    存储<key>的嵌入。新的键作为新的一行追加（原地追加，除非矩阵需要扩容）；已知
+    的键会覆盖它所在的行。
+    """
+    vector = numpy.asarray(vector, dtype=numpy.float32)
+    if self.data is None:
+      self.data = numpy.zeros((self.capacity, len(vector)),
+                              dtype=numpy.float32)
+
+    if key in self.index:
+      row = self.index[key]
+      # Storing a row's own vector again (e.g., when nodes are loaded) is
+      # skipped, so that a memory-mapped matrix is not copied page by page.
+      # 再次存储某一行自己的向量（例如加载节点时）会被跳过，使得内存映射的矩阵
+      # 不会被逐页复制。
+      if numpy.may_share_memory(vector, self.data[row]):
+        return
+    else:
+      if self.size == self.capacity:
+        self._grow()
+      row = self.size
+      self.index[key] = row
+      self.keys_by_row += [key]
+      self.size += 1
+
+    self.data[row] = vector
+    self.norms[row] = numpy.linalg.norm(vector)
+
+
+  def _grow(self):
+    self.capacity *= 2
+    data = numpy.zeros((self.capacity, self.data.shape[1]),
+                       dtype=numpy.float32)
+    data[:self.size] = self.data[:self.size]
+    self.data = data
+    norms = numpy.zeros(self.capacity, dtype=numpy.float32)
+    norms[:self.size] = self.norms[:self.size]
+    self.norms = norms
+
+
+  def row(self, key):
+    """
+    Returns the row of <key> in the matrix.
+    """
+    """
+    返回<key>在矩阵中所在的行。
+    """
+    return self.index[key]
+
+
+  def matrix(self):
+    """
+    Returns a view of the rows that are in use, an (N x d) float32 matrix.
+    """
+    """
+    返回正在使用的行的视图，一个(N x d)的float32矩阵。
+    """
+    if self.data is None:
+      return numpy.zeros((0, 0), dtype=numpy.float32)
+    return self.data[:self.size]
+
+
+  def cos_sim(self, queries):
+    """
+    Computes the cosine similarity between every row and every query with a
+    single matrix multiply.
+
+    INPUT
+      queries: A (Q x d) array (or a list of Q embeddings).
+    OUTPUT
+      An (N x Q) float array whose [i, j] entry is the cosine similarity of
+      row i and query j.
+    """
+    """
+    通过一次矩阵乘法计算每一行与每个查询之间的余弦相似度。
+
+    输入：
+      queries：一个(Q x d)数组（或Q个嵌入的列表）。
+    输出：
+      一个(N x Q)的浮点数组，其中[i, j]是第i行与第j个查询的余弦相似度。
+    """
+    queries = numpy.asarray(queries, dtype=numpy.float32)
+    query_norms = numpy.linalg.norm(queries, axis=1)
+    norms = self.norms[:self.size]
+    sims = self.matrix() @ queries.T
+    sims /= numpy.where(norms == 0, 1, norms)[:, None]
+    sims /= numpy.where(query_norms == 0, 1, query_norms)[None, :]
+    return sims.astype(float)
+
+
+  def to_dict(self):
+    """
+    Returns a text -> embedding (list of floats) dictionary, e.g., to be
+    saved as embeddings.json.
+    """
+    """
+    返回一个“文本 -> 嵌入（浮点数列表）”字典，例如用于保存为embeddings.json。
+    """
+    return {key: self.data[row].tolist() for key, row in self.index.items()}
@@ -0,0 +1,283 @@
+"""
+File: memory_columns.py
+Description: Reads and writes the binary layout of a persona's associative
+memory. Node metadata is kept column by column in nodes.npz, all strings
+(including keywords) are interned into one string table, and the embeddings
+are kept in a float32 embeddings.npy that is memory-mapped when it is loaded.
+It only depends on NumPy, so the frontend can read it as well.
+"""
+"""
+文件：memory_columns.py
+描述：读写角色联想记忆的二进制布局。节点元数据按列保存在nodes.npz中，所有字符串
+（包括关键词）被驻留到一个字符串表中，嵌入保存在一个float32的embeddings.npy中，加载
+时会被内存映射。它只依赖NumPy，所以前端也可以读取它。
+"""
+import json
+import os
+
+import numpy
+
+NODE_TYPES = ["event", "chat", "thought"]
+
+# The files each layout keeps in an associative_memory folder.
+# 每种布局在associative_memory文件夹中保存的文件。
+JSON_MEMORY_FILES = ["nodes.json", "kw_strength.json", "embeddings.json"]
+BINARY_MEMORY_FILES = ["nodes.npz", "embeddings.npy"]
+
+
+def is_binary_memory(folder):
+  """
+  Returns True if the associative memory in <folder> was saved in the binary
+  layout.
+  """
+  """
+  如果<folder>中的联想记忆以二进制布局保存，则返回True。
+  """
+  return os.path.exists(f"{folder}/nodes.npz")
+
+
+class StringTable:
+  def __init__(self):
+    # <strings> lists every distinct string once, and <ids> maps each string
+    # to its position in <strings>.
+    # <strings>将每个不同的字符串列出一次，<ids>将每个字符串映射到它在<strings>
+    # 中的位置。
+    self.strings = []
+    self.ids = dict()
+
+
+  def intern(self, string):
+    if string not in self.ids:
+      self.ids[string] = len(self.strings)
+      self.strings += [string]
+    return self.ids[string]
+
+
+  def intern_many(self, strings):
+    return numpy.array([self.intern(i) for i in strings], dtype=numpy.int32)
+
+
+def _encode_json(value):
+  return numpy.frombuffer(json.dumps(value).encode("utf-8"), dtype=numpy.uint8)
+
+
+def _decode_json(array):
+  return json.loads(array.tobytes().decode("utf-8"))
+
+
+def _write_atomically(path, write_fn):
+  """
+  Writes a file through a temporary file that then replaces <path>. A
+  memory-mapped embeddings.npy that is still in use keeps pointing at the old
+  file instead of seeing it truncated.
+  """
+  """
+  通过一个临时文件写入，然后用它替换<path>。仍在使用的内存映射embeddings.npy会
+  继续指向旧文件，而不会看到它被截断。
+  """
+  tmp_path = f"{path}.tmp"
+  with open(tmp_path, "wb") as outfile:
+    write_fn(outfile)
+  os.replace(tmp_path, path)
+
+
+def write_memory_columns(folder, nodes, kw_strength_event,
+                         kw_strength_thought, embeddings):
+  """
+  Saves an associative memory in the binary layout.
+
+  INPUT
+    folder: The associative_memory folder to write to.
+    nodes: The list of ConceptNodes, from node_1 up.
+    kw_strength_event: The keyword -> strength dictionary of the events.
+    kw_strength_thought: The keyword -> strength dictionary of the thoughts.
+    embeddings: The EmbeddingMatrix of the memory.
+  OUTPUT
+    None
+  """
+  """
+  以二进制布局保存联想记忆。
+
+  输入：
+    folder：要写入的associative_memory文件夹。
+    nodes：ConceptNode列表，从node_1开始。
+    kw_strength_event：事件的“关键词 -> 强度”字典。
+    kw_strength_thought：想法的“关键词 -> 强度”字典。
+    embeddings：记忆的EmbeddingMatrix。
+  输出：
+    无
+  """
+  strings = StringTable()
+
+  # Keywords are stored as a flat array of string ids, where the keywords of
+  # node i are keyword_ids[keyword_offsets[i]:keyword_offsets[i+1]].
+  # 关键词保存为一个字符串id的扁平数组，第i个节点的关键词是
+  # keyword_ids[keyword_offsets[i]:keyword_offsets[i+1]]。
+  keyword_ids = []
+  keyword_offsets = [0]
+  for node in nodes:
+    keyword_ids += [strings.intern(kw) for kw in node.keywords]
+    keyword_offsets += [len(keyword_ids)]
+
+  # Poignancy is kept as integers unless some node has a fractional one, so
+  # that a round trip gives back the same values.
+  # 除非某个节点的重要性是小数，否则重要性保存为整数，使得往返转换得到相同的值。
+  poignancy = [node.poignancy for node in nodes]
+  poignancy_dtype = numpy.int64
+  if not all(isinstance(i, int) for i in poignancy):
+    poignancy_dtype = numpy.float64
+
+  columns = dict()
+  columns["type"] = numpy.array([NODE_TYPES.index(node.type) for node in nodes],
+                                dtype=numpy.int8)
+  columns["depth"] = numpy.array([node.depth for node in nodes],
+                                 dtype=numpy.int32)
+  columns["created"] = numpy.array([node.created for node in nodes],
+                                   dtype="datetime64[s]")
+  columns["expiration"] = numpy.array([node.expiration for node in nodes],
+                                      dtype="datetime64[s]")
+  columns["subject"] = strings.intern_many([node.subject for node in nodes])
+  columns["predicate"] = strings.intern_many([node.predicate for node in nodes])
+  columns["object"] = strings.intern_many([node.object for node in nodes])
+  columns["description"] = strings.intern_many([node.description
+                                                for node in nodes])
+  columns["embedding_key"] = strings.intern_many([node.embedding_key
+                                                  for node in nodes])
+  columns["poignancy"] = numpy.array(poignancy, dtype=poignancy_dtype)
+  columns["keyword_ids"] = numpy.array(keyword_ids, dtype=numpy.int32)
+  columns["keyword_offsets"] = numpy.array(keyword_offsets, dtype=numpy.int64)
+  columns["filling"] = _encode_json([node.filling for node in nodes])
+
+  columns["kw_strength_event_ids"] = strings.intern_many(kw_strength_event)
+  columns["kw_strength_event"] = numpy.array(
+    list(kw_strength_event.values()), dtype=numpy.int64)
+  columns["kw_strength_thought_ids"] = strings.intern_many(kw_strength_thought)
+  columns["kw_strength_thought"] = numpy.array(
+    list(kw_strength_thought.values()), dtype=numpy.int64)
+
+  # Row i of embeddings.npy is the embedding of embedding_keys[i].
+  # embeddings.npy的第i行是embedding_keys[i]的嵌入。
+  columns["embedding_keys"] = strings.intern_many(embeddings.keys_by_row)
+  columns["embedding_norms"] = embeddings.norms[:len(embeddings)]
+
+  columns["strings"] = _encode_json(strings.strings)
+
+  _write_atomically(f"{folder}/nodes.npz",
+                    lambda outfile: numpy.savez(outfile, **columns))
+  _write_atomically(f"{folder}/embeddings.npy",
+                    lambda outfile: numpy.save(outfile, embeddings.matrix()))
+
+
+def read_memory_columns(folder, mmap=True):
+  """
+  Loads an associative memory that was saved in the binary layout.
+
+  INPUT
+    folder: The associative_memory folder to read from.
+    mmap: Whether embeddings.npy is memory-mapped (copy-on-write) rather
+          than read into memory.
+  OUTPUT
+    A dictionary with the following keys:
+      nodes: A list of (type, depth, created, expiration, s, p, o,
+             description, embedding_key, poignancy, keywords, filling)
+             tuples, from node_1 up.
+      kw_strength_event, kw_strength_thought: The keyword -> strength
+                                              dictionaries.
+      embedding_keys: The list of embedding keys, one per matrix row.
+      embeddings: The (N x d) float32 embedding matrix.
+      embedding_norms: The L2 norm of each matrix row.
+  """
+  """
+  加载以二进制布局保存的联想记忆。
+
+  输入：
+    folder：要读取的associative_memory文件夹。
+    mmap：embeddings.npy是否被内存映射（写时复制），而不是读入内存。
+  输出：
+    一个包含以下键的字典：
+      nodes：一个(type, depth, created, expiration, s, p, o, description,
+             embedding_key, poignancy, keywords, filling)元组的列表，从node_1
+             开始。
+      kw_strength_event, kw_strength_thought：“关键词 -> 强度”字典。
+      embedding_keys：嵌入键的列表，矩阵每行一个。
+      embeddings：(N x d)的float32嵌入矩阵。
+      embedding_norms：矩阵每行的L2范数。
+  """
+  with numpy.load(f"{folder}/nodes.npz") as data:
+    columns = {key: data[key] for key in data.files}
+  strings = _decode_json(columns["strings"])
+
+  def lookup(ids):
+    return [strings[i] for i in ids.tolist()]
+
+  keyword_ids = lookup(columns["keyword_ids"])
+  offsets = columns["keyword_offsets"].tolist()
+  keywords = [keyword_ids[offsets[i]:offsets[i+1]]
+              for i in range(len(offsets) - 1)]
+
+  # datetime64 columns convert to datetime objects in bulk, and NaT (i.e.,
+  # no expiration) converts to None.
+  # datetime64列批量转换为datetime对象，NaT（即没有过期时间）转换为None。
+  nodes = list(zip([NODE_TYPES[i] for i in columns["type"].tolist()],
+                   columns["depth"].tolist(),
+                   columns["created"].tolist(),
+                   columns["expiration"].tolist(),
+                   lookup(columns["subject"]),
+                   lookup(columns["predicate"]),
+                   lookup(columns["object"]),
+                   lookup(columns["description"]),
+                   lookup(columns["embedding_key"]),
+                   columns["poignancy"].tolist(),
+                   keywords,
+                   _decode_json(columns["filling"])))
+
+  ret = dict()
+  ret["nodes"] = nodes
+  ret["kw_strength_event"] = dict(zip(
+    lookup(columns["kw_strength_event_ids"]),
+    columns["kw_strength_event"].tolist()))
+  ret["kw_strength_thought"] = dict(zip(
+    lookup(columns["kw_strength_thought_ids"]),
+    columns["kw_strength_thought"].tolist()))
+  ret["embedding_keys"] = lookup(columns["embedding_keys"])
+  ret["embeddings"] = numpy.load(f"{folder}/embeddings.npy",
+                                 mmap_mode="c" if mmap else None)
+  ret["embedding_norms"] = columns["embedding_norms"]
+  return ret
+
+
+def read_nodes_json(folder):
+  """
+  Returns the nodes of a binary associative memory in the layout of
+  nodes.json, without loading the embeddings.
+  """
+  """
+  以nodes.json的布局返回二进制联想记忆的节点，不会加载嵌入。
+  """
+  ret = dict()
+  type_counts = {node_type: 0 for node_type in NODE_TYPES}
+  nodes = read_memory_columns(folder)["nodes"]
+  for count, node in enumerate(nodes):
+    (node_type, depth, created, expiration, s, p, o,
+     description, embedding_key, poignancy, keywords, filling) = node
+    type_counts[node_type] += 1
+
+    node_details = dict()
+    node_details["node_count"] = count + 1
+    node_details["type_count"] = type_counts[node_type]
+    node_details["type"] = node_type
+    node_details["depth"] = depth
+    node_details["created"] = created.strftime('%Y-%m-%d %H:%M:%S')
+    node_details["expiration"] = None
+    if expiration:
+      node_details["expiration"] = expiration.strftime('%Y-%m-%d %H:%M:%S')
+    node_details["subject"] = s
+    node_details["predicate"] = p
+    node_details["object"] = o
+    node_details["description"] = description
+    node_details["embedding_key"] = embedding_key
+    node_details["poignancy"] = poignancy
+    node_details["keywords"] = keywords
+    node_details["filling"] = filling
+    ret[f"node_{count + 1}"] = node_details
+  return ret
@@ -0,0 +1,177 @@
+"""
+File: save_journal.py
+Description: Defines the append-only save journal of a persona. A full save
+(a checkpoint) writes spatial_memory.json, scratch.json and the associative
+memory. Until the next checkpoint, each save only appends one line to
+journal.jsonl with what changed since the previous save: the new nodes and
+their embeddings, the changed keyword strengths, the changed scratch fields
+and, if it changed, the spatial memory tree. Loading a persona replays the
+journal on top of the checkpoint.
+"""
+"""
+文件：save_journal.py
+描述：定义角色的只追加保存日志。一次完整保存（检查点）会写入spatial_memory.json、
+scratch.json和联想记忆。在下一个检查点之前，每次保存只会向journal.jsonl追加一行，
+记录自上次保存以来的变化：新的节点及其嵌入、变化的关键词强度、变化的痕迹字段，以及
+（如果变化了）空间记忆树。加载角色时会在检查点之上重放日志。
+"""
+import json
+import os
+
+import utils
+
+# <save_journal> turns incremental saves on. <save_journal_compact_every> is
+# the number of journal records after which the next save writes a full
+# checkpoint and clears the journal. They can be overridden in utils.py.
+
+# <save_journal>开启增量保存。<save_journal_compact_every>是日志记录的数量，超过
+# 它之后下一次保存会写入完整的检查点并清空日志。它们可以在utils.py中覆盖。
+save_journal = getattr(utils, "save_journal", False)
+save_journal_compact_every = getattr(utils, "save_journal_compact_every", 50)
+
+
+def _json_copy(value):
+  return json.loads(json.dumps(value))
+
+
+class SaveJournal:
+  def __init__(self, folder):
+    # <folder> is the persona's bootstrap_memory folder. <n_records> is the
+    # number of records in the journal since the last checkpoint.
+
+    # <folder>是角色的bootstrap_memory文件夹。<n_records>是自上次检查点以来日志
+    # 中的记录数量。
+    self.folder = folder
+    self.path = f"{folder}/journal.jsonl"
+    self.n_records = 0
+
+    # The state of the persona as of the last save, which the next record is
+    # computed against.
+    # 上次保存时角色的状态，下一条记录会与它比较得出。
+    self.node_count = 0
+    self.embedding_count = 0
+    self.kw_strength_event = dict()
+    self.kw_strength_thought = dict()
+    self.scratch = dict()
+    self.spatial_memory = None
+
+
+  def mark(self, persona):
+    """
+    Records the current state of <persona> as the saved state.
+    """
+    """
+    将<persona>的当前状态记录为已保存的状态。
+    """
+    self.node_count = len(persona.a_mem.id_to_node)
+    self.embedding_count = len(persona.a_mem.embeddings)
+    self.kw_strength_event = dict(persona.a_mem.kw_strength_event)
+    self.kw_strength_thought = dict(persona.a_mem.kw_strength_thought)
+    self.scratch = _json_copy(persona.scratch.to_dict())
+    self.spatial_memory = json.dumps(persona.s_mem.tree)
+
+
+  def replay(self, persona):
+    """
+    Applies the records of the journal (if there is one) to <persona>, which
+    was just loaded from the checkpoint, and marks the result as saved. A
+    last line that was cut short (e.g., by a crash during a save) is dropped
+    from the journal.
+    """
+    """
+    将日志中的记录（如果有日志）应用到刚从检查点加载的<persona>上，并将结果标记为
+    已保存。被截断的最后一行（例如保存时崩溃导致）会从日志中删除。
+    """
+    if os.path.exists(self.path):
+      valid_size = 0
+      with open(self.path, "rb") as infile:
+        for line in infile:
+          if not line.endswith(b"\n"):
+            break
+          try:
+            record = json.loads(line)
+          except json.JSONDecodeError:
+            break
+          self.apply(persona, record)
+          self.n_records += 1
+          valid_size += len(line)
+      if valid_size < os.path.getsize(self.path):
+        os.truncate(self.path, valid_size)
+    self.mark(persona)
+
+
+  def apply(self, persona, record):
+    a_mem = persona.a_mem
+    vectors = a_mem.resolve_embeddings(record["embeddings"])
+    for key in record["embeddings"]:
+      a_mem.embeddings[key] = vectors[key]
+    for node_details in record["nodes"]:
+      a_mem.load_node(a_mem.parse_node_details(node_details))
+    a_mem.kw_strength_event.update(record["kw_strength_event"])
+    a_mem.kw_strength_thought.update(record["kw_strength_thought"])
+
+    if record["scratch"]:
+      scratch = persona.scratch.to_dict()
+      scratch.update(record["scratch"])
+      persona.scratch.load(scratch)
+    if record["spatial_memory"] is not None:
+      persona.s_mem.tree = record["spatial_memory"]
+
+
+  def append(self, persona):
+    """
+    Appends one record with the changes of <persona> since the last save.
+    """
+    """
+    追加一条记录，包含<persona>自上次保存以来的变化。
+    """
+    a_mem = persona.a_mem
+    record = dict()
+    record["nodes"] = [
+      a_mem.get_node_details(a_mem.id_to_node[f"node_{count}"])
+      for count in range(self.node_count + 1, len(a_mem.id_to_node) + 1)]
+    record["embeddings"] = a_mem.dump_embeddings(
+      a_mem.embeddings.keys_by_row[self.embedding_count:])
+    record["kw_strength_event"] = {
+      kw: strength for kw, strength in a_mem.kw_strength_event.items()
+      if self.kw_strength_event.get(kw) != strength}
+    record["kw_strength_thought"] = {
+      kw: strength for kw, strength in a_mem.kw_strength_thought.items()
+      if self.kw_strength_thought.get(kw) != strength}
+
+    scratch = _json_copy(persona.scratch.to_dict())
+    record["scratch"] = {field: value for field, value in scratch.items()
+                         if self.scratch.get(field) != value}
+
+    spatial_memory = json.dumps(persona.s_mem.tree)
+    record["spatial_memory"] = None
+    if spatial_memory != self.spatial_memory:
+      record["spatial_memory"] = persona.s_mem.tree
+
+    # The record is written with a single call, so that a crash can at most
+    # leave a partial last line, which replay ignores.
+    # 记录通过一次调用写入，使得崩溃最多只会留下不完整的最后一行，重放时会忽略它。
+    with open(self.path, "a") as outfile:
+      outfile.write(json.dumps(record) + "\n")
+    self.n_records += 1
+
+    self.node_count = len(a_mem.id_to_node)
+    self.embedding_count = len(a_mem.embeddings)
+    self.kw_strength_event.update(record["kw_strength_event"])
+    self.kw_strength_thought.update(record["kw_strength_thought"])
+    self.scratch = scratch
+    self.spatial_memory = spatial_memory
+
+
+  def clear(self, persona):
+    """
+    Removes the journal after a checkpoint was written, and marks the state
+    of <persona> as saved.
+    """
+    """
+    在写入检查点之后删除日志，并将<persona>的状态标记为已保存。
+    """
+    if os.path.exists(self.path):
+      os.remove(self.path)
+    self.n_records = 0
+    self.mark(persona)
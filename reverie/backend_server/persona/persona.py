@@ -23,10 +23,12 @@ import random
 sys.path.append('../')
 
 from global_methods import *
+from instrumentation import step_profiler
 
 from persona.memory_structures.spatial_memory import *
 from persona.memory_structures.associative_memory import *
 from persona.memory_structures.scratch import *
+from persona.memory_structures.save_journal import *
 
 from persona.cognitive_modules.perceive import *
 from persona.cognitive_modules.retrieve import *
@@ -44,6 +46,15 @@ class Persona:
     # PERSONA 基本状态
     # <name>是指persona的全名。这是Reverie中角色的唯一标识符。
     self.name = name
+    # <rng> is the persona's own random number generator, which the random 
+    # choices of their cognitive sequence are made with. It is seeded at 
+    # the start of each step (see ReverieServer.start_server), so that the 
+    # choices do not depend on what the other personas drew before. 
+
+    # <rng>是角色自己的随机数生成器，角色认知序列中的随机选择都用它来做。它在每一步
+    # 开始时设置种子（参见ReverieServer.start_server），使得这些选择不取决于其他
+    # 角色之前抽取了什么。
+    self.rng = random.Random()
 
     # PERSONA MEMORY 
     # If there is already memory in folder_mem_saved, we load that. Otherwise,
@@ -63,25 +74,44 @@ class Persona:
     # <scratch> 是角色的短时记忆空间。
     scratch_saved = f"{folder_mem_saved}/bootstrap_memory/scratch.json"
     self.scratch = Scratch(scratch_saved)
+    # <journal> holds the saves made since the last full save (see 
+    # save_journal.py). They are replayed on top of the loaded memory. 
+    # <journal>保存自上次完整保存以来的保存（参见save_journal.py）。它们会在加载的
+    # 记忆之上重放。
+    self.journal = SaveJournal(f"{folder_mem_saved}/bootstrap_memory")
+    self.journal.replay(self)
 
 
-  def save(self, save_folder): 
+  def save(self, save_folder, compact=False): 
     """
-    Save persona's current state (i.e., memory). 
+    Save persona's current state (i.e., memory). If <save_journal> is on, 
+    the changes since the last save are appended to the journal instead, 
+    unless <compact> is True, the journal is full, or <save_folder> is not 
+    the folder the journal belongs to. 
 
     INPUT: 
       save_folder: The folder where we wil be saving our persona's state. 
+      compact: Whether a full save is forced. 
     OUTPUT: 
       None
     """
     """
-    保存角色当前的状态(i.e., 记忆)
+    保存角色当前的状态(i.e., 记忆)。如果<save_journal>开启，则改为将自上次保存以来
+    的变化追加到日志中，除非<compact>为True、日志已满，或者<save_folder>不是日志所属
+    的文件夹。
 
     输入: 
       save_folder:保存角色状态的文件夹名称
+      compact:是否强制进行完整保存
     输出: 
       无
     """
+    if (save_journal and not compact 
+        and self.journal.folder == save_folder 
+        and self.journal.n_records < save_journal_compact_every): 
+      self.journal.append(self)
+      return
+
     # Spatial memory contains a tree in a json format. 
     # e.g., {"double studio": 
     #         {"double studio": 
@@ -115,6 +145,11 @@ class Persona:
     f_scratch = f"{save_folder}/scratch.json"
     self.scratch.save(f_scratch)
 
+    # The full save is the new checkpoint, so the journal starts over. 
+    # 完整保存是新的检查点，所以日志重新开始。
+    self.journal = SaveJournal(save_folder)
+    self.journal.clear(self)
+
 
   def perceive(self, maze):
     """
@@ -228,7 +263,7 @@ class Persona:
     return plan(self, maze, personas, new_day, retrieved)
 
 
-  def execute(self, maze, personas, plan):
+  def execute(self, maze, personas, plan, personas_tile):
     """
     This function takes the agent's current plan and outputs a concrete 
     execution (what object to use, and what tile to travel to). 
@@ -239,6 +274,8 @@ class Persona:
                 Persona instance as values. 
       plan: The target action address of the persona  
             (persona.scratch.act_address).
+      personas_tile: A dictionary that contains all persona names as keys, 
+                     and their tile at the start of the step as values. 
     OUTPUT: 
       execution: A triple set that contains the following components: 
         <next_tile> is a x,y coordinate. e.g., (58, 9)
@@ -255,6 +292,8 @@ class Persona:
       maze：当前世界的<Maze>类示例
       personas：一个字典，以所有角色的名字为键，Persona类实例为值。
       plan：角色的目标行为地址（persona.scratch.act_address）
+      personas_tile：一个字典，以所有角色的名字为键，他们在这一步开始时所在的地图块
+                     为值。
     输出:
       execution：一个元组集合，存储了以下的内容：
       <next_tile>是一个x，y坐标。例如，(58, 9)
@@ -263,7 +302,7 @@ class Persona:
       编辑她的小说）
       @ double studio:double studio:common room:sofa
     """
-    return execute(self, maze, personas, plan)
+    return execute(self, maze, personas, plan, personas_tile)
 
 
   def reflect(self):
@@ -286,7 +325,7 @@ class Persona:
     reflect(self)
 
 
-  def move(self, maze, personas, curr_tile, curr_time):
+  def move(self, maze, personas, curr_tile, curr_time, personas_tile):
     """
     This is the main cognitive function where our main sequence is called. 
 
@@ -297,6 +336,8 @@ class Persona:
       curr_tile: A tuple that designates the persona's current tile location 
                  in (row, col) form. e.g., (58, 39)
       curr_time: datetime instance that indicates the game's current time. 
+      personas_tile: A dictionary that contains all persona names as keys, 
+                     and their tile at the start of the step as values. 
     OUTPUT: 
       execution: A triple set that contains the following components: 
         <next_tile> is a x,y coordinate. e.g., (58, 9)
@@ -313,6 +354,8 @@ class Persona:
       personas：一个字典，以所有角色的名字为键，Persona类实例为值。
       curr_tile：一个元组，表示角色的当前地图位置坐标。例如：(58, 39)
       curr_time：表示游戏当前时间的日期时间实例
+      personas_tile：一个字典，以所有角色的名字为键，他们在这一步开始时所在的地图块
+                     为值。
     输出：
       execution：一个元组集合，存储了以下的内容：
       <next_tile>是一个x，y坐标。例如，(58, 9)
@@ -340,27 +383,35 @@ class Persona:
       new_day = "New day"
     self.scratch.curr_time = curr_time
 
-    # Main cognitive sequence begins here. 
-    # 主要的感知序列在这里开始。
-    perceived = self.perceive(maze)
-    retrieved = self.retrieve(perceived)
-    plan = self.plan(maze, personas, new_day, retrieved)
-    self.reflect()
-
-    # <execution> is a triple set that contains the following components: 
-    # <next_tile> is a x,y coordinate. e.g., (58, 9)
-    # <pronunciatio> is an emoji. e.g., "\ud83d\udca4"
-    # <description> is a string description of the movement. e.g., 
-    #   writing her next novel (editing her novel) 
-    #   @ double studio:double studio:common room:sofa
-
-    # execution：一个元组集合，存储了以下的内容：
-    # <next_tile>是一个x，y坐标。例如，(58, 9)
-    # <pronunciatio>是一个表情。
-    # <description>是动作的一个字符串描述。例如，写下她的下一篇小说（
-    # 编辑她的小说）
-    # @ double studio:double studio:common room:sofa
-    return self.execute(maze, personas, plan)
+    # Main cognitive sequence begins here. The time of each phase is 
+    # recorded by the step profiler (see instrumentation.py). 
+    # 主要的感知序列在这里开始。每个阶段的耗时由步骤分析器记录（参见
+    # instrumentation.py）。
+    with step_profiler.persona(self.name): 
+      with step_profiler.phase("perceive"): 
+        perceived = self.perceive(maze)
+      with step_profiler.phase("retrieve"): 
+        retrieved = self.retrieve(perceived)
+      with step_profiler.phase("plan"): 
+        plan = self.plan(maze, personas, new_day, retrieved)
+      with step_profiler.phase("reflect"): 
+        self.reflect()
+
+      # <execution> is a triple set that contains the following components: 
+      # <next_tile> is a x,y coordinate. e.g., (58, 9)
+      # <pronunciatio> is an emoji. e.g., "\ud83d\udca4"
+      # <description> is a string description of the movement. e.g., 
+      #   writing her next novel (editing her novel) 
+      #   @ double studio:double studio:common room:sofa
+
+      # execution：一个元组集合，存储了以下的内容：
+      # <next_tile>是一个x，y坐标。例如，(58, 9)
+      # <pronunciatio>是一个表情。
+      # <description>是动作的一个字符串描述。例如，写下她的下一篇小说（
+      # 编辑她的小说）
+      # @ double studio:double studio:common room:sofa
+      with step_profiler.phase("execute"): 
+        return self.execute(maze, personas, plan, personas_tile)
 
 
   def open_convo_session(self, convo_mode): 
@@ -0,0 +1,219 @@
+"""
+File: embedding_store.py
+Description: Defines the embedding store that is shared by every persona in
+the process and, through SQLite, by every simulation under the storage
+folder. Embeddings are keyed by (model, normalized text), so that a text like
+"bed is idle" is embedded only once no matter how many personas perceive it
+or how many times the simulation is forked.
+"""
+"""
+文件：embedding_store.py
+描述：定义嵌入存储。进程内的每个角色共享它，并且通过SQLite，存储文件夹下的每个仿真
+也共享它。嵌入的键为（模型，规范化的文本），使得像"bed is idle"这样的文本无论被多少
+角色感知、仿真被分叉多少次都只会嵌入一次。
+"""
+import os
+import sqlite3
+import threading
+
+import numpy
+
+import utils
+
+# <embedding_store_enabled> and <embedding_store_path> can be overridden in
+# utils.py.
+# <embedding_store_enabled>和<embedding_store_path>可以在utils.py中覆盖。
+embedding_store_enabled = getattr(utils, "embedding_store_enabled", True)
+embedding_store_path = getattr(utils, "embedding_store_path",
+                               f"{utils.fs_storage}/embedding_store.sqlite3")
+
+DEFAULT_EMBEDDING_MODEL = "text-embedding-ada-002"
+
+
+def normalize_embedding_text(text):
+  """
+  Returns the text that is actually sent to the embedding API for <text>.
+  This is also the text part of the store's key.
+  """
+  """
+  返回对于<text>实际发送到嵌入API的文本。它也是存储键的文本部分。
+  """
+  text = text.replace("\n", " ")
+  if not text:
+    text = "this is blank"
+  return text
+
+
+class EmbeddingStore:
+  def __init__(self, path=embedding_store_path,
+                     enabled=embedding_store_enabled):
+    # <path> is the SQLite file of the store. If <enabled> is False, the
+    # store never holds anything and every lookup misses.
+
+    # <path>是存储的SQLite文件。如果<enabled>为False，存储不保存任何内容，每次查找
+    # 都不会命中。
+    self.path = path
+    self.enabled = enabled
+
+    # <memory> is the in-process layer of the store. Its values are the
+    # float32 embedding arrays handed out to the personas, so that personas
+    # that embedded the same text share one array.
+
+    # <memory>是存储的进程内层。它的值是分发给角色的float32嵌入数组，使得嵌入了
+    # 相同文本的角色共享同一个数组。
+    self.memory = dict()
+
+    self._lock = threading.RLock()
+    self._pid = None
+    self._conn = None
+
+
+  def _connect(self):
+    """
+    Opens the SQLite connection the first time it is needed (again in a child
+    process, since SQLite connections must not be shared across a fork).
+    """
+    """
+    在第一次需要时打开SQLite连接（子进程中会重新打开，因为SQLite连接不能在fork之后
+    共享）。
+    """
+    if self._conn and self._pid == os.getpid():
+      return self._conn
+    folder = os.path.dirname(self.path)
+    if folder:
+      os.makedirs(folder, exist_ok=True)
+    conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""CREATE TABLE IF NOT EXISTS embeddings (
+                      model TEXT,
+                      text TEXT,
+                      vector BLOB,
+                      PRIMARY KEY (model, text))""")
+    conn.commit()
+    self._conn = conn
+    self._pid = os.getpid()
+    return conn
+
+
+  def get_many(self, texts, model=DEFAULT_EMBEDDING_MODEL):
+    """
+    Looks up the embeddings of several texts at once.
+
+    INPUT
+      texts: A list of str texts (they do not need to be normalized).
+      model: The name of the embedding model.
+    OUTPUT
+      A dictionary from each text that is in the store to its embedding
+      (a read-only float32 array). Texts that are not in the store are left
+      out.
+    """
+    """
+    一次查找多个文本的嵌入。
+
+    输入：
+      texts：一个文本字符串列表（不需要规范化）。
+      model：嵌入模型的名称。
+    输出：
+      一个字典，键为在存储中的每个文本，值为它的嵌入（只读的float32数组）。不在
+      存储中的文本不包含在内。
+    """
+    if not self.enabled:
+      return dict()
+    ret = dict()
+    with self._lock:
+      missing = dict()
+      for text in texts:
+        key = normalize_embedding_text(text)
+        if (model, key) in self.memory:
+          ret[text] = self.memory[(model, key)]
+        else:
+          missing.setdefault(key, []).append(text)
+
+      if missing:
+        conn = self._connect()
+        keys = list(missing.keys())
+        # SQLite limits the number of parameters of a statement.
+        # SQLite限制了一条语句的参数数量。
+        for i in range(0, len(keys), 500):
+          chunk = keys[i:i+500]
+          rows = conn.execute(
+            f"""SELECT text, vector FROM embeddings WHERE model=? AND
+                text IN ({",".join("?" * len(chunk))})""",
+            [model] + chunk).fetchall()
+          for key, blob in rows:
+            vector = numpy.frombuffer(blob, dtype=numpy.float32)
+            self.memory[(model, key)] = vector
+            for text in missing[key]:
+              ret[text] = vector
+    return ret
+
+
+  def get(self, text, model=DEFAULT_EMBEDDING_MODEL):
+    """
+    Returns the embedding of <text>, or None if it is not in the store.
+    """
+    """
+    返回<text>的嵌入，如果不在存储中则返回None。
+    """
+    return self.get_many([text], model).get(text)
+
+
+  def put_many(self, embeddings, model=DEFAULT_EMBEDDING_MODEL):
+    """
+    Writes several embeddings back to the store at once. Texts that are
+    already in the in-process layer are skipped.
+
+    INPUT
+      embeddings: A dictionary from str texts to their embeddings.
+      model: The name of the embedding model.
+    OUTPUT
+      None
+    """
+    """
+    一次将多个嵌入写回存储。已经在进程内层中的文本会被跳过。
+
+    输入：
+      embeddings：一个字典，键为文本字符串，值为它们的嵌入。
+      model：嵌入模型的名称。
+    输出：
+      无
+    """
+    if not self.enabled:
+      return
+    with self._lock:
+      rows = []
+      for text, vector in embeddings.items():
+        key = normalize_embedding_text(text)
+        if (model, key) in self.memory:
+          continue
+        vector = numpy.array(vector, dtype=numpy.float32)
+        vector.flags.writeable = False
+        self.memory[(model, key)] = vector
+        rows += [(model, key, vector.tobytes())]
+      if rows:
+        conn = self._connect()
+        conn.executemany("""INSERT OR IGNORE INTO embeddings
+                            (model, text, vector) VALUES (?, ?, ?)""", rows)
+        conn.commit()
+
+
+  def put(self, text, vector, model=DEFAULT_EMBEDDING_MODEL):
+    """
+    Writes the embedding of <text> back to the store.
+    """
+    """
+    将<text>的嵌入写回存储。
+    """
+    self.put_many({text: vector}, model)
+
+
+  def close(self):
+    with self._lock:
+      if self._conn and self._pid == os.getpid():
+        self._conn.close()
+      self._conn = None
+
+
+# <embedding_store> is the process-wide store shared by all personas.
+# <embedding_store>是所有角色共享的进程级存储。
+embedding_store = EmbeddingStore()
@@ -10,33 +10,122 @@ Description: Wrapper functions for calling OpenAI APIs.
 文件：gpt_structure.py
 描述：调用OpenAI API的封装函数。
 """
+import contextvars
 import json
 import random
 import openai
 import time 
+import threading
 
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import utils
 from utils import *
+from persona.prompt_template.llm_client import llm_client, llm_max_concurrency
+from instrumentation import step_profiler, llm_cost
+from persona.prompt_template.llm_cache import llm_cache, LLMCacheMiss
+from persona.prompt_template.embedding_store import (embedding_store, 
+                                                     normalize_embedding_text)
 
 openai.api_key = openai_api_key
 
+# <embedding_batch_size> and <embedding_batch_wait> can be overridden in 
+# utils.py. 
+# <embedding_batch_size>和<embedding_batch_wait>可以在utils.py中覆盖。
+embedding_batch_size = getattr(utils, "embedding_batch_size", 64)
+embedding_batch_wait = getattr(utils, "embedding_batch_wait", 0.05)
+
 def temp_sleep(seconds=0.1):
   time.sleep(seconds)
 
-def ChatGPT_single_request(prompt): 
-  temp_sleep()
+def _account_request(model, response): 
+  """
+  Records the tokens and the estimated cost of a request that was sent to 
+  OpenAI under the prompt function that sent it (see 
+  StepProfiler.count_llm). 
+  """
+  """
+  将发送给OpenAI的一次请求的token和估算费用记在发送它的提示函数名下（参见
+  StepProfiler.count_llm）。
+  """
+  usage = response.get("usage") or dict()
+  prompt_tokens = usage.get("prompt_tokens", 0)
+  completion_tokens = usage.get("completion_tokens", 0)
+  step_profiler.count_llm(requests=1, 
+                          prompt_tokens=prompt_tokens, 
+                          completion_tokens=completion_tokens, 
+                          cost=llm_cost(model, prompt_tokens, 
+                                        completion_tokens))
+
+async def chat_completion_async(model, prompt, attempt=0): 
+  """
+  Sends <prompt> to a chat model as a single user message, going through the
+  LLM response cache. 
+  INPUT
+    model: the name of the chat model, e.g., "gpt-3.5-turbo"
+    prompt: a str prompt
+    attempt: the retry count of the request (see LLMResponseCache.make_key)
+  OUTPUT
+    a str of the model's response. 
+  The call is accounted under the prompt function that made it (see 
+  StepProfiler.count_llm). 
+  """
+  """
+  将<prompt>作为一条用户消息发送给聊天模型，经过LLM响应缓存。这次调用会记在发起它的
+  提示函数名下（参见StepProfiler.count_llm）。
+  输入：
+    model：聊天模型的名称，例如"gpt-3.5-turbo"
+    prompt：一串提示词
+    attempt：请求的重试次数（参见LLMResponseCache.make_key）
+  输出：
+    一个模型的响应字符串。
+  """
+  async def request(): 
+    completion = await llm_client.call(
+      openai.ChatCompletion.acreate,
+      model=model, 
+      messages=[{"role": "user", "content": prompt}]
+    )
+    _account_request(model, completion)
+    return completion["choices"][0]["message"]["content"]
+
+  start = time.perf_counter()
+  try: 
+    return await llm_cache.cached_call(model, {}, prompt, attempt, request)
+  finally: 
+    step_profiler.count_llm(calls=1, latency=time.perf_counter() - start)
+
+
+async def ChatGPT_single_request_async(prompt): 
+  return await chat_completion_async("gpt-3.5-turbo", prompt)
 
-  completion = openai.ChatCompletion.create(
-    model="gpt-3.5-turbo", 
-    messages=[{"role": "user", "content": prompt}]
-  )
-  return completion["choices"][0]["message"]["content"]
+
+def ChatGPT_single_request(prompt): 
+  return llm_client.run(ChatGPT_single_request_async(prompt))
 
 
 # ============================================================================
 # #####################[SECTION 1: CHATGPT-3 STRUCTURE] ######################
 # ============================================================================
 
-def GPT4_request(prompt): 
+async def GPT4_request_async(prompt, attempt=0): 
+  """
+  The awaitable version of GPT4_request. 
+  """
+  """
+  GPT4_request的可等待版本。
+  """
+  try: 
+    return await chat_completion_async("gpt-4", prompt, attempt)
+  
+  except LLMCacheMiss: 
+    raise
+  except: 
+    print ("ChatGPT ERROR")
+    return "ChatGPT ERROR"
+
+
+def GPT4_request(prompt, attempt=0): 
   """
   Given a prompt and a dictionary of GPT parameters, make a request to OpenAI
   server and returns the response. 
@@ -45,6 +134,7 @@ def GPT4_request(prompt):
     gpt_parameter: a python dictionary with the keys indicating the names of  
                    the parameter and the values indicating the parameter 
                    values.   
+    attempt: the retry count of the request, used by the response cache 
   RETURNS: 
     a str of GPT-4's response. 
   """
@@ -53,24 +143,31 @@ def GPT4_request(prompt):
   参数：
     prompt：一串提示词
     gpt_parameter：一个Python字典，其中键表示参数的名称，值表示参数的取值。
+    attempt：请求的重试次数，由响应缓存使用
   返回：
     一个GPT-4的响应字符串。
   """
-  temp_sleep()
+  return llm_client.run(GPT4_request_async(prompt, attempt))
+
 
+async def ChatGPT_request_async(prompt, attempt=0): 
+  """
+  The awaitable version of ChatGPT_request. 
+  """
+  """
+  ChatGPT_request的可等待版本。
+  """
   try: 
-    completion = openai.ChatCompletion.create(
-    model="gpt-4", 
-    messages=[{"role": "user", "content": prompt}]
-    )
-    return completion["choices"][0]["message"]["content"]
+    return await chat_completion_async("gpt-3.5-turbo", prompt, attempt)
   
+  except LLMCacheMiss: 
+    raise
   except: 
     print ("ChatGPT ERROR")
     return "ChatGPT ERROR"
 
 
-def ChatGPT_request(prompt): 
+def ChatGPT_request(prompt, attempt=0): 
   """
   Given a prompt and a dictionary of GPT parameters, make a request to OpenAI
   server and returns the response. 
@@ -79,6 +176,7 @@ def ChatGPT_request(prompt):
     gpt_parameter: a python dictionary with the keys indicating the names of  
                    the parameter and the values indicating the parameter 
                    values.   
+    attempt: the retry count of the request, used by the response cache 
   RETURNS: 
     a str of GPT-3's response. 
   """
@@ -87,20 +185,11 @@ def ChatGPT_request(prompt):
   参数：
     prompt：一串提示词
     gpt_parameter：一个Python字典，其中键表示参数的名称，值表示参数的取值。
+    attempt：请求的重试次数，由响应缓存使用
   返回：
     一个GPT-3的响应字符串。
   """
-  # temp_sleep()
-  try: 
-    completion = openai.ChatCompletion.create(
-    model="gpt-3.5-turbo", 
-    messages=[{"role": "user", "content": prompt}]
-    )
-    return completion["choices"][0]["message"]["content"]
-  
-  except: 
-    print ("ChatGPT ERROR")
-    return "ChatGPT ERROR"
+  return llm_client.run(ChatGPT_request_async(prompt, attempt))
 
 
 def GPT4_safe_generate_response(prompt, 
@@ -120,25 +209,36 @@ def GPT4_safe_generate_response(prompt,
     print ("CHAT GPT PROMPT")
     print (prompt)
 
+  # The attempts, the responses that fail to parse or validate and the 
+  # fail safes are accounted under the prompt function (see 
+  # StepProfiler.count_llm). 
+  # 尝试次数、无法解析或验证的响应以及失败保护都会记在提示函数名下（参见
+  # StepProfiler.count_llm）。
   for i in range(repeat): 
+    if i: 
+      step_profiler.count_llm(retries=1)
 
     try: 
-      curr_gpt_response = GPT4_request(prompt).strip()
+      curr_gpt_response = GPT4_request(prompt, i).strip()
       end_index = curr_gpt_response.rfind('}') + 1
       curr_gpt_response = curr_gpt_response[:end_index]
       curr_gpt_response = json.loads(curr_gpt_response)["output"]
       
       if func_validate(curr_gpt_response, prompt=prompt): 
         return func_clean_up(curr_gpt_response, prompt=prompt)
+      step_profiler.count_llm(validation_failures=1)
       
       if verbose: 
         print ("---- repeat count: \n", i, curr_gpt_response)
         print (curr_gpt_response)
         print ("~~~~")
 
+    except LLMCacheMiss: 
+      raise
     except: 
-      pass
+      step_profiler.count_llm(validation_failures=1)
 
+  step_profiler.count_llm(fail_safes=1)
   return False
 
 
@@ -160,10 +260,17 @@ def ChatGPT_safe_generate_response(prompt,
     print ("CHAT GPT PROMPT")
     print (prompt)
 
+  # The attempts, the responses that fail to parse or validate and the 
+  # fail safes are accounted under the prompt function (see 
+  # StepProfiler.count_llm). 
+  # 尝试次数、无法解析或验证的响应以及失败保护都会记在提示函数名下（参见
+  # StepProfiler.count_llm）。
   for i in range(repeat): 
+    if i: 
+      step_profiler.count_llm(retries=1)
 
     try: 
-      curr_gpt_response = ChatGPT_request(prompt).strip()
+      curr_gpt_response = ChatGPT_request(prompt, i).strip()
       end_index = curr_gpt_response.rfind('}') + 1
       curr_gpt_response = curr_gpt_response[:end_index]
       curr_gpt_response = json.loads(curr_gpt_response)["output"]
@@ -174,15 +281,19 @@ def ChatGPT_safe_generate_response(prompt,
       
       if func_validate(curr_gpt_response, prompt=prompt): 
         return func_clean_up(curr_gpt_response, prompt=prompt)
+      step_profiler.count_llm(validation_failures=1)
       
       if verbose: 
         print ("---- repeat count: \n", i, curr_gpt_response)
         print (curr_gpt_response)
         print ("~~~~")
 
+    except LLMCacheMiss: 
+      raise
     except: 
-      pass
+      step_profiler.count_llm(validation_failures=1)
 
+  step_profiler.count_llm(fail_safes=1)
   return False
 
 
@@ -197,18 +308,24 @@ def ChatGPT_safe_generate_response_OLD(prompt,
     print (prompt)
 
   for i in range(repeat): 
+    if i: 
+      step_profiler.count_llm(retries=1)
     try: 
-      curr_gpt_response = ChatGPT_request(prompt).strip()
+      curr_gpt_response = ChatGPT_request(prompt, i).strip()
       if func_validate(curr_gpt_response, prompt=prompt): 
         return func_clean_up(curr_gpt_response, prompt=prompt)
+      step_profiler.count_llm(validation_failures=1)
       if verbose: 
         print (f"---- repeat count: {i}")
         print (curr_gpt_response)
         print ("~~~~")
 
+    except LLMCacheMiss: 
+      raise
     except: 
-      pass
+      step_profiler.count_llm(validation_failures=1)
   print ("FAIL SAFE TRIGGERED") 
+  step_profiler.count_llm(fail_safes=1)
   return fail_safe_response
 
 
@@ -216,7 +333,43 @@ def ChatGPT_safe_generate_response_OLD(prompt,
 # ###################[SECTION 2: ORIGINAL GPT-3 STRUCTURE] ###################
 # ============================================================================
 
-def GPT_request(prompt, gpt_parameter): 
+async def GPT_request_async(prompt, gpt_parameter, attempt=0): 
+  """
+  The awaitable version of GPT_request. 
+  """
+  """
+  GPT_request的可等待版本。
+  """
+  async def request(): 
+    response = await llm_client.call(
+                openai.Completion.acreate,
+                model=gpt_parameter["engine"],
+                prompt=prompt,
+                temperature=gpt_parameter["temperature"],
+                max_tokens=gpt_parameter["max_tokens"],
+                top_p=gpt_parameter["top_p"],
+                frequency_penalty=gpt_parameter["frequency_penalty"],
+                presence_penalty=gpt_parameter["presence_penalty"],
+                stream=gpt_parameter["stream"],
+                stop=gpt_parameter["stop"],)
+    _account_request(gpt_parameter["engine"], response)
+    return response.choices[0].text
+
+  params = {k: v for k, v in gpt_parameter.items() if k != "engine"}
+  start = time.perf_counter()
+  try: 
+    return await llm_cache.cached_call(gpt_parameter["engine"], params, 
+                                       prompt, attempt, request)
+  except LLMCacheMiss: 
+    raise
+  except: 
+    print ("TOKEN LIMIT EXCEEDED")
+    return "TOKEN LIMIT EXCEEDED"
+  finally: 
+    step_profiler.count_llm(calls=1, latency=time.perf_counter() - start)
+
+
+def GPT_request(prompt, gpt_parameter, attempt=0): 
   """
   Given a prompt and a dictionary of GPT parameters, make a request to OpenAI
   server and returns the response. 
@@ -225,6 +378,7 @@ def GPT_request(prompt, gpt_parameter):
     gpt_parameter: a python dictionary with the keys indicating the names of  
                    the parameter and the values indicating the parameter 
                    values.   
+    attempt: the retry count of the request, used by the response cache 
   RETURNS: 
     a str of GPT-3's response. 
   """
@@ -233,25 +387,11 @@ def GPT_request(prompt, gpt_parameter):
   参数：
     prompt：一串提示词
     gpt_parameter：一个Python字典，其中键表示参数的名称，值表示参数的取值。
+    attempt：请求的重试次数，由响应缓存使用
   返回：
     一个GPT-3的响应字符串。
   """
-  temp_sleep()
-  try: 
-    response = openai.Completion.create(
-                model=gpt_parameter["engine"],
-                prompt=prompt,
-                temperature=gpt_parameter["temperature"],
-                max_tokens=gpt_parameter["max_tokens"],
-                top_p=gpt_parameter["top_p"],
-                frequency_penalty=gpt_parameter["frequency_penalty"],
-                presence_penalty=gpt_parameter["presence_penalty"],
-                stream=gpt_parameter["stream"],
-                stop=gpt_parameter["stop"],)
-    return response.choices[0].text
-  except: 
-    print ("TOKEN LIMIT EXCEEDED")
-    return "TOKEN LIMIT EXCEEDED"
+  return llm_client.run(GPT_request_async(prompt, gpt_parameter, attempt))
 
 
 def generate_prompt(curr_input, prompt_lib_file): 
@@ -303,22 +443,240 @@ def safe_generate_response(prompt,
     print (prompt)
 
   for i in range(repeat): 
-    curr_gpt_response = GPT_request(prompt, gpt_parameter)
+    if i: 
+      step_profiler.count_llm(retries=1)
+    curr_gpt_response = GPT_request(prompt, gpt_parameter, i)
     if func_validate(curr_gpt_response, prompt=prompt): 
       return func_clean_up(curr_gpt_response, prompt=prompt)
+    step_profiler.count_llm(validation_failures=1)
     if verbose: 
       print ("---- repeat count: ", i, curr_gpt_response)
       print (curr_gpt_response)
       print ("~~~~")
+  step_profiler.count_llm(fail_safes=1)
   return fail_safe_response
 
 
+async def get_embedding_async(text, model="text-embedding-ada-002"):
+  text = normalize_embedding_text(text)
+  embedding = embedding_store.get(text, model)
+  if embedding is not None: 
+    return embedding
+
+  response = await llm_client.call(
+               openai.Embedding.acreate, input=[text], model=model)
+  _account_request(model, response)
+  embedding = response['data'][0]['embedding']
+  # Another persona may have stored the same text in the meantime; the 
+  # stored array is returned so that both share it. 
+  # 其他角色可能在此期间存储了相同的文本；返回存储的数组，使它们共享同一个数组。
+  embedding_store.put(text, embedding, model)
+  stored = embedding_store.get(text, model)
+  return embedding if stored is None else stored
+
+
 def get_embedding(text, model="text-embedding-ada-002"):
-  text = text.replace("\n", " ")
-  if not text: 
-    text = "this is blank"
-  return openai.Embedding.create(
-          input=[text], model=model)['data'][0]['embedding']
+  return llm_client.run(get_embedding_async(text, model))
+
+
+async def get_embeddings_async(texts, model="text-embedding-ada-002"): 
+  """
+  Embeds several texts with a single request. Texts that are already in the
+  embedding store are not sent, and each distinct text is sent only once. 
+  INPUT
+    texts: a list of str texts
+    model: the name of the embedding model
+  OUTPUT
+    a list of embeddings, in the same order as <texts>. 
+  """
+  """
+  用一次请求嵌入多个文本。已经在嵌入存储中的文本不会被发送，每个不同的文本只发送
+  一次。
+  输入：
+    texts：一个文本字符串列表
+    model：嵌入模型的名称
+  输出：
+    一个嵌入列表，顺序与<texts>相同。
+  """
+  texts = [normalize_embedding_text(text) for text in texts]
+  found = embedding_store.get_many(texts, model)
+  missing = list(dict.fromkeys(t for t in texts if t not in found))
+  if missing: 
+    response = await llm_client.call(
+                 openai.Embedding.acreate, input=missing, model=model)
+    _account_request(model, response)
+    data = sorted(response['data'], key=lambda x: x['index'])
+    new = {text: d['embedding'] for text, d in zip(missing, data)}
+    embedding_store.put_many(new, model)
+    found.update(new)
+    found.update(embedding_store.get_many(missing, model))
+  return [found[text] for text in texts]
+
+
+def get_embeddings(texts, model="text-embedding-ada-002"): 
+  return embedding_batcher.get_embeddings(texts, model)
+
+
+class EmbeddingBatcher: 
+  """
+  Collects texts that are waiting to be embedded and resolves them together
+  in one request. A batch is sent once it holds <max_batch> texts, or 
+  <max_wait> seconds after its first text was submitted, whichever comes 
+  first. 
+  """
+  """
+  收集等待嵌入的文本，并在一次请求中一起处理它们。当一批文本达到<max_batch>个，或
+  者第一个文本提交<max_wait>秒之后（以先到者为准），这批文本就会被发送。
+  """
+  def __init__(self, max_batch=embedding_batch_size, 
+                     max_wait=embedding_batch_wait): 
+    self.max_batch = max_batch
+    self.max_wait = max_wait
+
+    self._lock = threading.Lock()
+    # <pending> is a dictionary of model -> {text: future}. 
+    # <pending>是一个字典，模型 -> {文本: future}。
+    self._pending = dict()
+    self._timer = None
+
+
+  def submit(self, text, model="text-embedding-ada-002"): 
+    """
+    Adds <text> to the pending batch. 
+    INPUT
+      text: a str text
+      model: the name of the embedding model
+    OUTPUT
+      a concurrent.futures.Future of the text's embedding. 
+    """
+    """
+    将<text>加入待处理的批次。
+    输入：
+      text：一个文本字符串
+      model：嵌入模型的名称
+    输出：
+      一个该文本嵌入的concurrent.futures.Future。
+    """
+    text = normalize_embedding_text(text)
+    with self._lock: 
+      pending = self._pending.setdefault(model, dict())
+      if text in pending: 
+        return pending[text]
+      future = Future()
+      pending[text] = future
+      if sum(len(i) for i in self._pending.values()) >= self.max_batch: 
+        self._flush_locked()
+      elif not self._timer: 
+        self._timer = threading.Timer(self.max_wait, self.flush)
+        self._timer.daemon = True
+        self._timer.start()
+    return future
+
+
+  def flush(self): 
+    """
+    Sends the pending batch right away. 
+    """
+    """
+    立即发送待处理的批次。
+    """
+    with self._lock: 
+      self._flush_locked()
+
+
+  def _flush_locked(self): 
+    if self._timer: 
+      self._timer.cancel()
+      self._timer = None
+    for model, pending in self._pending.items(): 
+      if not pending: 
+        continue
+      texts = list(pending.keys())
+      futures = list(pending.values())
+      batch = llm_client.submit(get_embeddings_async(texts, model))
+      batch.add_done_callback(
+        lambda batch, futures=futures: self._resolve(batch, futures))
+    self._pending = dict()
+
+
+  def _resolve(self, batch, futures): 
+    if batch.exception(): 
+      for future in futures: 
+        future.set_exception(batch.exception())
+      return
+    for future, embedding in zip(futures, batch.result()): 
+      future.set_result(embedding)
+
+
+  def get_embeddings(self, texts, model="text-embedding-ada-002"): 
+    """
+    Embeds <texts> and waits for the result. Since the caller already has the
+    whole batch, it is sent right away rather than after <max_wait>. 
+    INPUT
+      texts: a list of str texts
+      model: the name of the embedding model
+    OUTPUT
+      a list of embeddings, in the same order as <texts>. 
+    """
+    """
+    嵌入<texts>并等待结果。因为调用者已经有了完整的批次，所以它会被立即发送，而不是
+    在<max_wait>之后。
+    输入：
+      texts：一个文本字符串列表
+      model：嵌入模型的名称
+    输出：
+      一个嵌入列表，顺序与<texts>相同。
+    """
+    futures = [self.submit(text, model) for text in texts]
+    self.flush()
+    return [future.result() for future in futures]
+
+
+# <embedding_batcher> is the process-wide batcher shared by all personas. 
+# <embedding_batcher>是所有角色共享的进程级批处理器。
+embedding_batcher = EmbeddingBatcher()
+
+# <prompt_executor> is the process-wide thread pool of run_concurrently. It 
+# has as many threads as the LLM client lets requests be in flight, since the 
+# prompt calls it runs mostly wait on their requests. 
+# <prompt_executor>是run_concurrently的进程级线程池。它的线程数与LLM客户端允许
+# 同时进行的请求数相同，因为它运行的提示调用大部分时间都在等待请求。
+prompt_executor = ThreadPoolExecutor(max_workers=llm_max_concurrency, 
+                                     thread_name_prefix="prompt")
+
+
+def run_concurrently(*funcs): 
+  """
+  Runs independent blocking prompt calls (e.g., several run_gpt_prompt_* 
+  calls that do not depend on each other's output) at the same time, so that
+  their requests are in flight together on the shared LLM client. 
+  INPUT
+    funcs: zero-argument callables, e.g., 
+           lambda: run_gpt_prompt_event_poignancy(persona, description)[0]
+  OUTPUT
+    A list of the callables' return values, in the same order as <funcs>. 
+  """
+  """
+  同时运行互相独立的阻塞提示调用（例如几个不依赖彼此输出的run_gpt_prompt_*调用），
+  使它们的请求在共享的LLM客户端上同时进行。
+  输入：
+    funcs：无参数的可调用对象，例如
+           lambda: run_gpt_prompt_event_poignancy(persona, description)[0]
+  输出：
+    一个可调用对象返回值的列表，顺序与<funcs>相同。
+  """
+  if len(funcs) <= 1: 
+    return [func() for func in funcs]
+  # Each callable runs in a copy of the caller's context, so that the step 
+  # profiler still attributes its calls to the caller's persona. The 
+  # callables must not call run_concurrently themselves, or they could 
+  # wait on each other for the threads of <prompt_executor>. 
+  # 每个可调用对象都在调用者上下文的副本中运行，使得步骤分析器仍将其调用归于调用者
+  # 的角色。可调用对象自身不能调用run_concurrently，否则它们可能会互相等待
+  # <prompt_executor>的线程。
+  futures = [prompt_executor.submit(contextvars.copy_context().run, func) 
+             for func in funcs]
+  return [future.result() for future in futures]
 
 
 if __name__ == '__main__':
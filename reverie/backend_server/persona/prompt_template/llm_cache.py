@@ -0,0 +1,309 @@
+"""
+File: llm_cache.py
+Description: Defines the on-disk, content-addressed cache of LLM responses.
+Responses are stored in SQLite and keyed by a hash of the model, the request
+parameters and the rendered prompt, so that re-running a forked simulation
+from the same step does not send the same prompts to OpenAI again.
+"""
+"""
+文件：llm_cache.py
+描述：定义LLM响应的磁盘内容寻址缓存。响应存储在SQLite中，键为模型、请求参数和渲染后
+提示的哈希值，使得从同一步重新运行分叉的仿真时不会再次向OpenAI发送相同的提示。
+"""
+import atexit
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import utils
+from instrumentation import step_profiler
+
+# The cache modes.
+# "read_through": return the cached response if there is one, otherwise send
+#                 the request and store its response.
+# "write_through": always send the request and store (refresh) its response.
+# "replay_only": only return cached responses; a miss raises LLMCacheMiss.
+# "off": do not use the cache at all.
+
+# 缓存模式。
+# "read_through"：如果有缓存的响应就返回它，否则发送请求并存储响应。
+# "write_through"：总是发送请求并存储（刷新）响应。
+# "replay_only"：只返回缓存的响应；未命中时抛出LLMCacheMiss。
+# "off"：完全不使用缓存。
+LLM_CACHE_MODES = ["read_through", "write_through", "replay_only", "off"]
+
+# <llm_cache_mode>, <llm_cache_path> and <llm_cache_max_mb> can be overridden
+# in utils.py.
+# <llm_cache_mode>、<llm_cache_path>和<llm_cache_max_mb>可以在utils.py中覆盖。
+llm_cache_mode = getattr(utils, "llm_cache_mode", "read_through")
+llm_cache_path = getattr(utils, "llm_cache_path",
+                         f"{utils.fs_temp_storage}/llm_cache.sqlite3")
+llm_cache_max_mb = getattr(utils, "llm_cache_max_mb", 512)
+
+
+class LLMCacheMiss(KeyError):
+  """
+  Raised in the "replay_only" mode when a request is not in the cache.
+  """
+  """
+  在"replay_only"模式下，请求不在缓存中时抛出。
+  """
+  pass
+
+
+class LLMResponseCache:
+  def __init__(self, path=llm_cache_path, mode=llm_cache_mode,
+                     max_mb=llm_cache_max_mb):
+    if mode not in LLM_CACHE_MODES:
+      raise ValueError(f"Unknown LLM cache mode: {mode}")
+    # <path> is the SQLite file of the cache. <mode> is one of
+    # LLM_CACHE_MODES. <max_mb> is the size limit of the stored responses;
+    # the least recently used responses are evicted past this limit.
+
+    # <path>是缓存的SQLite文件。<mode>是LLM_CACHE_MODES之一。<max_mb>是存储
+    # 响应的大小上限；超过上限时最近最少使用的响应会被淘汰。
+    self.path = path
+    self.mode = mode
+    self.max_bytes = int(max_mb * 1024 * 1024)
+
+    # <hits> and <misses> count the lookups since the cache was created.
+    # <hits>和<misses>统计缓存创建以来的查找次数。
+    self.hits = 0
+    self.misses = 0
+    # <namespace> separates the responses of runs that must not share them
+    # (e.g., the seed of a seeded simulation, see ReverieServer.seed). With
+    # None, the keys only depend on the request.
+    # <namespace>将不能共享响应的运行的响应分开（例如有种子的仿真的种子，参见
+    # ReverieServer.seed）。为None时，键只取决于请求。
+    self.namespace = None
+
+    self._lock = threading.RLock()
+    self._pid = None
+    self._conn = None
+    self._total_bytes = 0
+    # <_accessed> maps the keys of the responses that were looked up to the
+    # time of their last lookup, until it is written to the database (see
+    # flush), so that a hit does not wait on a write.
+    # <_accessed>将被查找的响应的键映射到它们最近一次被查找的时间，直到写入数据库
+    # （参见flush），使得命中时不需要等待写入。
+    self._accessed = dict()
+
+
+  def _connect(self):
+    """
+    Opens the SQLite connection the first time it is needed (again in a child
+    process, since SQLite connections must not be shared across a fork).
+    """
+    """
+    在第一次需要时打开SQLite连接（子进程中会重新打开，因为SQLite连接不能在fork之后
+    共享）。
+    """
+    if self._conn and self._pid == os.getpid():
+      return self._conn
+    folder = os.path.dirname(self.path)
+    if folder:
+      os.makedirs(folder, exist_ok=True)
+    conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""CREATE TABLE IF NOT EXISTS responses (
+                      key TEXT PRIMARY KEY,
+                      model TEXT,
+                      response TEXT,
+                      size INTEGER,
+                      last_access REAL)""")
+    conn.execute("""CREATE INDEX IF NOT EXISTS responses_last_access
+                    ON responses (last_access)""")
+    conn.commit()
+    self._total_bytes = conn.execute(
+      "SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+    self._conn = conn
+    self._pid = os.getpid()
+    return conn
+
+
+  def make_key(self, model, params, prompt, attempt=0):
+    """
+    Returns the content address of a request.
+
+    INPUT
+      model: The name of the model (e.g., "gpt-3.5-turbo").
+      params: A dictionary of the request parameters other than the model
+              and the prompt (e.g., temperature, max_tokens).
+      prompt: The rendered prompt str.
+      attempt: The retry count of the request in the safe_generate loops. It
+               is part of the key so that a retry after a failed validation
+               does not get the same cached response back.
+    The cache's <namespace>, if any, is part of the key as well.
+    OUTPUT
+      A sha256 hex digest str.
+    """
+    """
+    返回一个请求的内容地址。
+
+    输入：
+      model：模型名称（例如"gpt-3.5-turbo"）。
+      params：除模型和提示以外的请求参数字典（例如temperature、max_tokens）。
+      prompt：渲染后的提示字符串。
+      attempt：请求在safe_generate循环中的重试次数。它是键的一部分，使得验证失败
+               后的重试不会得到同一个缓存的响应。
+    缓存的<namespace>（如果有）也是键的一部分。
+    输出：
+      一个sha256的十六进制摘要字符串。
+    """
+    request = [model, params, prompt, attempt]
+    if self.namespace is not None:
+      request += [self.namespace]
+    payload = json.dumps(request, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+  def get(self, key):
+    """
+    Returns the cached response of <key>, or None if there is none. The
+    lookup refreshes the last access time of the response (on the next
+    flush).
+    """
+    """
+    返回<key>缓存的响应，如果没有则返回None。查找会（在下一次flush时）刷新响应的
+    最近访问时间。
+    """
+    if self.mode in ["off", "write_through"]:
+      return None
+    with self._lock:
+      conn = self._connect()
+      row = conn.execute("SELECT response FROM responses WHERE key=?",
+                         (key,)).fetchone()
+      if row is None:
+        self.misses += 1
+        if self.mode == "replay_only":
+          raise LLMCacheMiss(key)
+        return None
+      self.hits += 1
+      self._accessed[key] = time.time()
+      return row[0]
+
+
+  def flush(self):
+    """
+    Writes the last access times of the responses looked up since the last
+    flush to the database. This happens on each put (before anything is
+    evicted) and when the cache is closed.
+    """
+    """
+    将自上次flush以来被查找的响应的最近访问时间写入数据库。这在每次put时（在淘汰
+    任何响应之前）以及缓存关闭时进行。
+    """
+    with self._lock:
+      if not self._accessed:
+        return
+      conn = self._connect()
+      self._flush(conn)
+      conn.commit()
+
+
+  def _flush(self, conn):
+    conn.executemany("UPDATE responses SET last_access=? WHERE key=?",
+                     [(t, key) for key, t in self._accessed.items()])
+    self._accessed = dict()
+
+
+  def put(self, key, model, response):
+    """
+    Stores <response> under <key>, evicting the least recently used
+    responses if the cache grows past its size limit.
+    """
+    """
+    将<response>存储在<key>下，如果缓存超过大小上限，就淘汰最近最少使用的响应。
+    """
+    if self.mode in ["off", "replay_only"]:
+      return
+    size = len(key) + len(response.encode("utf-8"))
+    with self._lock:
+      conn = self._connect()
+      old = conn.execute("SELECT size FROM responses WHERE key=?",
+                         (key,)).fetchone()
+      conn.execute("""INSERT OR REPLACE INTO responses
+                      (key, model, response, size, last_access)
+                      VALUES (?, ?, ?, ?, ?)""",
+                   (key, model, response, size, time.time()))
+      self._accessed.pop(key, None)
+      self._flush(conn)
+      self._total_bytes += size - (old[0] if old else 0)
+      if self._total_bytes > self.max_bytes:
+        self._evict(conn)
+      conn.commit()
+
+
+  def _evict(self, conn):
+    """
+    Deletes the least recently used responses until the cache is back under
+    90% of its size limit.
+    """
+    """
+    删除最近最少使用的响应，直到缓存回到大小上限的90%以下。
+    """
+    target = self.max_bytes * 0.9
+    rows = conn.execute(
+      "SELECT key, size FROM responses ORDER BY last_access").fetchall()
+    evicted = []
+    for key, size in rows:
+      if self._total_bytes <= target:
+        break
+      evicted += [(key,)]
+      self._total_bytes -= size
+    conn.executemany("DELETE FROM responses WHERE key=?", evicted)
+
+
+  async def cached_call(self, model, params, prompt, attempt, request_fn):
+    """
+    Returns the response of a request, going through the cache according to
+    the cache mode. Failed requests (i.e., request_fn raising) are not
+    cached.
+
+    INPUT
+      model, params, prompt, attempt: See make_key.
+      request_fn: A zero-argument coroutine function that sends the request
+                  and returns the response str.
+    OUTPUT
+      The response str.
+    """
+    """
+    根据缓存模式经过缓存返回一个请求的响应。失败的请求（即request_fn抛出异常）
+    不会被缓存。
+
+    输入：
+      model、params、prompt、attempt：参见make_key。
+      request_fn：一个发送请求并返回响应字符串的无参数协程函数。
+    输出：
+      响应字符串。
+    """
+    if self.mode == "off":
+      return await request_fn()
+    key = self.make_key(model, params, prompt, attempt)
+    response = self.get(key)
+    if response is None:
+      response = await request_fn()
+      self.put(key, model, response)
+    else:
+      step_profiler.count(llm_cache_hits=1)
+    return response
+
+
+  def close(self):
+    with self._lock:
+      if self._conn and self._pid == os.getpid():
+        if self._accessed:
+          self._flush(self._conn)
+          self._conn.commit()
+        self._conn.close()
+      self._conn = None
+      self._accessed = dict()
+
+
+# <llm_cache> is the process-wide cache shared by all personas.
+# <llm_cache>是所有角色共享的进程级缓存。
+llm_cache = LLMResponseCache()
+atexit.register(llm_cache.close)
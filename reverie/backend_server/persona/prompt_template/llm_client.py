@@ -0,0 +1,206 @@
+"""
+File: llm_client.py
+Description: Defines the asyncio client that every OpenAI request of Reverie
+goes through. The client owns a background event loop, a shared aiohttp
+connection pool and a semaphore that caps the number of requests in flight,
+so that synchronous callers (e.g., the cognitive modules) and coroutines can
+share the same rate limit budget.
+"""
+"""
+文件：llm_client.py
+描述：定义Reverie中所有OpenAI请求都要经过的asyncio客户端。这个客户端拥有一个后台
+事件循环、一个共享的aiohttp连接池和一个限制同时进行的请求数量的信号量，使得同步调用者
+（例如认知模块）和协程可以共享同一个速率限制额度。
+"""
+import asyncio
+import atexit
+import os
+import threading
+
+import aiohttp
+import openai
+
+import utils
+from instrumentation import step_profiler
+
+# <llm_max_concurrency> and <llm_pool_size> can be overridden in utils.py.
+# <llm_max_concurrency>和<llm_pool_size>可以在utils.py中覆盖。
+llm_max_concurrency = getattr(utils, "llm_max_concurrency", 8)
+llm_pool_size = getattr(utils, "llm_pool_size", llm_max_concurrency)
+
+
+class AsyncLLMClient:
+  def __init__(self, max_concurrency=llm_max_concurrency,
+                     pool_size=llm_pool_size):
+    # <max_concurrency> is the maximum number of OpenAI requests that may be
+    # in flight at the same time. <pool_size> is the maximum number of open
+    # connections kept by the shared aiohttp session.
+
+    # <max_concurrency>是同时进行的OpenAI请求的最大数量。<pool_size>是共享的
+    # aiohttp会话保持的最大连接数。
+    self.max_concurrency = max_concurrency
+    self.pool_size = pool_size
+
+    self._lock = threading.Lock()
+    self._pid = None
+    self._loop = None
+    self._thread = None
+    self._session = None
+    self._semaphore = None
+
+
+  def _ensure_loop(self):
+    """
+    Starts the background event loop (and the shared session that lives on
+    it) the first time it is needed. The loop is started again in a child
+    process, since event loop threads do not survive a fork.
+    """
+    """
+    在第一次需要时启动后台事件循环（以及其上的共享会话）。子进程中会重新启动循环，
+    因为事件循环线程不会在fork之后保留。
+    """
+    with self._lock:
+      if self._loop and self._pid == os.getpid():
+        return self._loop
+
+      loop = asyncio.new_event_loop()
+      thread = threading.Thread(target=loop.run_forever,
+                                name="llm-client-loop",
+                                daemon=True)
+      thread.start()
+
+      async def setup():
+        connector = aiohttp.TCPConnector(limit=self.pool_size)
+        self._session = aiohttp.ClientSession(connector=connector)
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+      asyncio.run_coroutine_threadsafe(setup(), loop).result()
+
+      self._loop = loop
+      self._thread = thread
+      self._pid = os.getpid()
+      return loop
+
+
+  async def call(self, create_fn, **kwargs):
+    """
+    Awaits one OpenAI API call (e.g., openai.ChatCompletion.acreate) using
+    the shared session, while holding a slot of the concurrency limit.
+
+    INPUT
+      create_fn: The awaitable OpenAI API function to call.
+      kwargs: The keyword arguments passed to create_fn.
+    OUTPUT
+      The raw OpenAI response object.
+    """
+    """
+    在占用一个并发限制名额的同时，使用共享会话等待一次OpenAI API调用
+    （例如openai.ChatCompletion.acreate）。
+
+    输入：
+      create_fn：要调用的可等待OpenAI API函数。
+      kwargs：传给create_fn的关键字参数。
+    输出：
+      原始的OpenAI响应对象。
+    """
+    if asyncio.get_running_loop() is not self._loop:
+      # Coroutines awaited on a foreign loop are handed over to ours, since
+      # the session and the semaphore belong to it.
+      # 在其他事件循环上等待的协程会交给本客户端的循环，因为会话和信号量属于它。
+      future = asyncio.run_coroutine_threadsafe(
+                 self.call(create_fn, **kwargs), self._ensure_loop())
+      return await asyncio.wrap_future(future)
+
+    async with self._semaphore:
+      openai.aiosession.set(self._session)
+      response = await create_fn(**kwargs)
+
+    # The requests and their tokens are counted by the step profiler (see
+    # instrumentation.py). Embedding requests are the ones with an input.
+    # 请求及其token由步骤分析器计数（参见instrumentation.py）。嵌入请求是带有
+    # input的请求。
+    usage = response.get("usage") or dict()
+    if "input" in kwargs:
+      step_profiler.count(embedding_requests=1,
+                          embedded_texts=len(kwargs["input"]),
+                          embedding_tokens=usage.get("total_tokens", 0))
+    else:
+      step_profiler.count(llm_requests=1,
+                          llm_prompt_tokens=usage.get("prompt_tokens", 0),
+                          llm_completion_tokens=usage.get(
+                            "completion_tokens", 0))
+    return response
+
+
+  def run(self, coro):
+    """
+    Runs a coroutine on the client's event loop and blocks until it is done.
+    This is what the synchronous request functions in gpt_structure.py use.
+    It is safe to call from several threads at once.
+
+    INPUT
+      coro: The coroutine to run.
+    OUTPUT
+      The return value of the coroutine.
+    """
+    """
+    在客户端的事件循环上运行一个协程，并阻塞直到它完成。gpt_structure.py中的同步
+    请求函数使用的就是它。可以同时从多个线程调用。
+
+    输入：
+      coro：要运行的协程。
+    输出：
+      协程的返回值。
+    """
+    loop = self._ensure_loop()
+    if threading.current_thread() is self._thread:
+      coro.close()
+      raise RuntimeError("AsyncLLMClient.run cannot be called from inside "
+                         "the client's event loop; await the coroutine.")
+    return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+
+  def submit(self, coro):
+    """
+    Schedules a coroutine on the client's event loop without waiting for it.
+
+    INPUT
+      coro: The coroutine to run.
+    OUTPUT
+      A concurrent.futures.Future of the coroutine's return value.
+    """
+    """
+    在客户端的事件循环上调度一个协程，但不等待它完成。
+
+    输入：
+      coro：要运行的协程。
+    输出：
+      一个协程返回值的concurrent.futures.Future。
+    """
+    return asyncio.run_coroutine_threadsafe(coro, self._ensure_loop())
+
+
+  def close(self):
+    """
+    Closes the shared session and stops the background event loop.
+    """
+    """
+    关闭共享会话并停止后台事件循环。
+    """
+    with self._lock:
+      if not self._loop or self._pid != os.getpid():
+        return
+      loop = self._loop
+      asyncio.run_coroutine_threadsafe(self._session.close(), loop).result()
+      loop.call_soon_threadsafe(loop.stop)
+      self._thread.join()
+      loop.close()
+      self._loop = None
+      self._thread = None
+      self._session = None
+      self._semaphore = None
+
+
+# <llm_client> is the process-wide client shared by all personas.
+# <llm_client>是所有角色共享的进程级客户端。
+llm_client = AsyncLLMClient()
+atexit.register(llm_client.close)
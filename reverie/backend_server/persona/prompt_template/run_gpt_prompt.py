@@ -21,8 +21,9 @@ sys.path.append('../../')
 from global_methods import *
 from persona.prompt_template.gpt_structure import *
 from persona.prompt_template.print_prompt import *
+from instrumentation import step_profiler
 
-def get_random_alphanumeric(i=6, j=6): 
+def get_random_alphanumeric(i=6, j=6, seed=None): 
   """
   Returns a random alpha numeric strength that has the length of somewhere
   between i and j. 
@@ -30,14 +31,20 @@ def get_random_alphanumeric(i=6, j=6):
   INPUT: 
     i: min_range for the length
     j: max_range for the length
+    seed: if given, the str is derived from it, so that the same seed always
+          gives the same str (this keeps the prompts that contain the str 
+          cacheable). 
   OUTPUT: 
     an alpha numeric str with the length of somewhere between i and j.
   """
   """
   返回一个长度在i和j之间的随机字母数字强度（字符串）。
+  如果给定seed，字符串由它生成，相同的seed总是得到相同的字符串（这使得包含该字符串
+  的提示可以被缓存）。
   """
-  k = random.randint(i, j)
-  x = ''.join(random.choices(string.ascii_letters + string.digits, k=k))
+  rng = random.Random(seed) if seed is not None else random
+  k = rng.randint(i, j)
+  x = ''.join(rng.choices(string.ascii_letters + string.digits, k=k))
   return x
 
 
@@ -216,13 +223,15 @@ def run_gpt_prompt_generate_hourly_schedule(persona,
     if p_f_ds_hourly_org: 
       prior_schedule = "\n"
       for count, i in enumerate(p_f_ds_hourly_org): 
-        prior_schedule += f"[(ID:{get_random_alphanumeric()})" 
+        id_seed = f"{persona.name} {persona.scratch.get_str_curr_date_str()} {hour_str[count]}"
+        prior_schedule += f"[(ID:{get_random_alphanumeric(seed=id_seed)})" 
         prior_schedule += f" {persona.scratch.get_str_curr_date_str()} --"
         prior_schedule += f" {hour_str[count]}] Activity:"
         prior_schedule += f" {persona.scratch.get_str_firstname()}"
         prior_schedule += f" is {i}\n"
 
-    prompt_ending = f"[(ID:{get_random_alphanumeric()})"
+    id_seed = f"{persona.name} {persona.scratch.get_str_curr_date_str()} {curr_hour_str}"
+    prompt_ending = f"[(ID:{get_random_alphanumeric(seed=id_seed)})"
     prompt_ending += f" {persona.scratch.get_str_curr_date_str()}"
     prompt_ending += f" -- {curr_hour_str}] Activity:"
     prompt_ending += f" {persona.scratch.get_str_firstname()} is"
@@ -651,7 +660,7 @@ def run_gpt_prompt_action_sector(action_description,
     # output = random.choice(x)
     output = persona.scratch.living_area.split(":")[1]
 
-  print ("DEBUG", random.choice(x), "------", output)
+  print ("DEBUG", x, "------", output)
 
   if debug or verbose: 
     print_run_prompts(prompt_template, persona, gpt_param, 
@@ -804,7 +813,7 @@ def run_gpt_prompt_action_game_object(action_description,
 
   x = [i.strip() for i in persona.s_mem.get_str_accessible_arena_game_objects(temp_address).split(",")]
   if output not in x: 
-    output = random.choice(x)
+    output = persona.rng.choice(x)
 
   if debug or verbose: 
     print_run_prompts(prompt_template, persona, gpt_param, 
@@ -2932,6 +2941,13 @@ def run_gpt_generate_iterative_chat_utt(maze, init_persona, target_persona, retr
   return output, [output, prompt, gpt_param, prompt_input, fail_safe]
 
 
+# Every run_gpt_prompt_* function is wrapped so that the step profiler 
+# records its calls and their time (see instrumentation.py). 
+# 每个run_gpt_prompt_*函数都被包装，使得步骤分析器记录它的调用及其耗时（参见
+# instrumentation.py）。
+for _name, _func in list(globals().items()): 
+  if _name.startswith("run_gpt_prompt_") and callable(_func): 
+    globals()[_name] = step_profiler.profiled_prompt(_func)
 
 
 
@@ -31,6 +31,7 @@ Simulacra of Human Behavior》 描述的核心的仿真工作。如果你在阅
 会注意到我使用较旧的术语来描述生成代理及其认知模块。最主要的是，我用"personas"代表生成的
 代理，"associative memory"代表记忆流，还有"reverie"代表整体的模拟框架。
 """
+import argparse
 import json
 import numpy
 import datetime
@@ -38,15 +39,20 @@ import pickle
 import time
 import math
 import os
+import random
 import shutil
 import traceback
 
+from concurrent.futures import ThreadPoolExecutor
 from selenium import webdriver
 
 from global_methods import *
 from utils import *
 from maze import *
+from frontend_channel import *
+from instrumentation import *
 from persona.persona import *
+from persona.prompt_template.llm_cache import llm_cache
 
 ##############################################################################
 #                                  REVERIE                                   #
@@ -55,7 +61,8 @@ from persona.persona import *
 class ReverieServer: 
   def __init__(self, 
                fork_sim_code,
-               sim_code):
+               sim_code, 
+               temp_storage=fs_temp_storage):
     # FORKING FROM A PRIOR SIMULATION:
     # <fork_sim_code> indicates the simulation we are forking from. 
     # Interestingly, all simulations must be forked from some initial 
@@ -188,8 +195,8 @@ class ReverieServer:
       self.personas[persona_name] = curr_persona # 存储人物实例
       self.personas_tile[persona_name] = (p_x, p_y) # 存储人物当前的位置
        # 获取人物当前执行的事件及其描述
-      self.maze.tiles[p_y][p_x]["events"].add(curr_persona.scratch
-                                              .get_curr_event_and_desc())
+      self.maze.add_event_from_tile(curr_persona.scratch
+                                    .get_curr_event_and_desc(), (p_x, p_y))
 
     # REVERIE SETTINGS PARAMETERS:  
     # <server_sleep> denotes the amount of time that our while loop rests each
@@ -198,6 +205,41 @@ class ReverieServer:
     # Reverie设置参数：
     # <server_sleep> 表示循环休息的时间，目的是防止机器宕机。
     self.server_sleep = 0.1
+    # <persona_workers> is the maximum number of threads that run the
+    # personas' cognitive sequences at the same time when the simulation is
+    # run in parallel mode (e.g., "run parallel 100").
+
+    # <persona_workers> 表示以并行模式运行仿真时（例如 "run parallel 100"），
+    # 同时运行角色认知序列的最大线程数。
+    self.persona_workers = max(len(self.personas), 1)
+    # <frontend_channel> hands the environment and the movements of each step
+    # over between this server and the frontend server. 
+
+    # <frontend_channel> 在此服务和前端服务之间传递每一步的环境和移动。
+    self.frontend_channel = FrontendChannel(sim_folder, self.sim_code, 
+                                            self.maze.maze_name, 
+                                            self.server_sleep)
+    # <seed> varies the random choices of the steps (see start_server) 
+    # between simulations forked from the same one. With None, they only 
+    # depend on the step count. A seeded simulation also keeps its own LLM 
+    # responses in the LLM cache (under the seed as the cache's namespace), 
+    # so that the forks with different seeds do not replay each other's. 
+
+    # <seed> 让从同一个仿真分叉出的各个仿真在各步骤中做出不同的随机选择（参见
+    # start_server）。为None时，随机选择只取决于步数。有种子的仿真还会在LLM缓存中
+    # 保留自己的LLM响应（以种子作为缓存的命名空间），使得不同种子的分叉不会重放彼此
+    # 的响应。
+    self.seed = None
+    # <llm_usage> is the LLM usage of each prompt function (see 
+    # StepProfiler.count_llm) saved with the simulation before this session. 
+    # The usage of this session is counted from zero by the step profiler, 
+    # and added to it on each save. 
+
+    # <llm_usage> 是本次会话之前随仿真保存的每个提示函数的LLM使用情况（参见
+    # StepProfiler.count_llm）。本次会话的使用情况由步骤分析器从零开始统计，并在每次
+    # 保存时加到它上面。
+    self.llm_usage = read_llm_usage(f"{sim_folder}/reverie/llm_usage.json")
+    step_profiler.reset()
 
     # SIGNALING THE FRONTEND SERVER: 
     # curr_sim_code.json contains the current simulation code, and
@@ -210,24 +252,34 @@ class ReverieServer:
     # curr_sim_code.json保存当前仿真码, 仿真码是一个自定义的值，curr_step.json保存当前仿真的步数。
     # 它们被用于将代码信息和步数信息发送给前端
     # 注意当前端打开仿真时这个步数文件就会被删除。
+    # <temp_storage> is the folder of these files. Simulations that run next 
+    # to each other without the frontend (see run_simulations.py) each get 
+    # their own, so that they do not overwrite the simulation the frontend 
+    # shows. 
+    # <temp_storage> 是这些文件所在的文件夹。在没有前端的情况下同时运行的仿真
+    # （参见run_simulations.py）各自使用自己的文件夹，使得它们不会覆盖前端显示的
+    # 仿真。
+    self.temp_storage = temp_storage
+    os.makedirs(self.temp_storage, exist_ok=True)
     curr_sim_code = dict()
     curr_sim_code["sim_code"] = self.sim_code
-    with open(f"{fs_temp_storage}/curr_sim_code.json", "w") as outfile: 
+    with open(f"{self.temp_storage}/curr_sim_code.json", "w") as outfile: 
       outfile.write(json.dumps(curr_sim_code, indent=2))
     
     curr_step = dict()
     curr_step["step"] = self.step
-    with open(f"{fs_temp_storage}/curr_step.json", "w") as outfile: 
+    with open(f"{self.temp_storage}/curr_step.json", "w") as outfile: 
       outfile.write(json.dumps(curr_step, indent=2))
 
 
-  def save(self): 
+  def save(self, compact=False): 
     """
     Save all Reverie progress -- this includes Reverie's global state as well
     as all the personas.  
 
     INPUT
-      None
+      compact: Whether the personas are fully saved even if the save 
+               journal is on (see Persona.save). 
     OUTPUT 
       None
       * Saves all relevant data to the designated memory directory
@@ -236,7 +288,7 @@ class ReverieServer:
     保存所有Reverie类的进展-包括Reverie的全局状态和所有人物
 
     INPUT
-      无
+      compact：即使保存日志开启，是否也完整保存角色（参见Persona.save）。
     OUTPUT
       None
       * 保存所有相关数据到指定的记忆文件夹
@@ -259,11 +311,64 @@ class ReverieServer:
     with open(reverie_meta_f, "w") as outfile: 
       outfile.write(json.dumps(reverie_meta, indent=2))
 
+    # Save the LLM usage of the simulation so far. 
+    # 保存仿真到目前为止的LLM使用情况。
+    write_llm_usage(f"{sim_folder}/reverie/llm_usage.json", self.llm_usage)
+
+    # The simulation resumes from the environment of the current step. 
+    # 仿真会从当前步数的环境恢复。
+    self.frontend_channel.save_resume_environment(self.step)
+
     # Save the personas.
     # 保存每一个人物
     for persona_name, persona in self.personas.items(): 
       save_folder = f"{sim_folder}/personas/{persona_name}/bootstrap_memory"
-      persona.save(save_folder)
+      persona.save(save_folder, compact)
+
+
+  def load_history(self, history_file): 
+    """
+    Whispers the history of <history_file> to the personas, i.e., adds each 
+    of its lines to the memory of its persona. 
+
+    INPUT
+      history_file: The path of a CSV file relative to maze_assets_loc, with 
+                    a persona name and the ";"-separated whispers on each 
+                    row, e.g., "the_ville/agent_history_init_n3.csv". 
+    OUTPUT
+      None
+    """
+    """
+    将<history_file>中的历史悄悄告诉角色，即把它的每一行加入对应角色的记忆。
+
+    输入：
+      history_file：相对于maze_assets_loc的CSV文件路径，每一行是一个角色名和用
+                    ";"分隔的悄悄话，例如"the_ville/agent_history_init_n3.csv"。
+    输出：
+      无
+    """
+    curr_file = maze_assets_loc + "/" + history_file
+    rows = read_file_to_list(curr_file, header=True, strip_trail=True)[1]
+    clean_whispers = []
+    for row in rows: 
+      agent_name = row[0].strip() 
+      whispers = row[1].split(";")
+      whispers = [whisper.strip() for whisper in whispers]
+      for whisper in whispers: 
+        clean_whispers += [[agent_name, whisper]]
+
+    # The whispers are dated with the personas' current time, which a
+    # persona that has not moved yet does not have. It only gets it for the
+    # whispers, since its first move tells the first day by it being None.
+    # 悄悄话以角色的当前时间为日期，而还没有移动过的角色没有当前时间。它只在悄悄话
+    # 期间获得当前时间，因为它的第一次移动通过当前时间为None来判断是否为第一天。
+    new_personas = [persona for persona in self.personas.values()
+                    if not persona.scratch.curr_time]
+    for persona in new_personas:
+      persona.scratch.curr_time = self.curr_time
+    load_history_via_whisper(self.personas, clean_whispers)
+    for persona in new_personas:
+      persona.scratch.curr_time = None
 
 
   def start_path_tester_server(self): 
@@ -320,7 +425,7 @@ class ReverieServer:
     while (True): 
       try: 
         curr_dict = {}
-        tester_file = fs_temp_storage + "/path_tester_env.json"
+        tester_file = self.temp_storage + "/path_tester_env.json"
         if check_if_file_exists(tester_file): 
           with open(tester_file) as json_file: 
             curr_dict = json.load(json_file)
@@ -361,7 +466,7 @@ class ReverieServer:
         # Incrementally outputting the s_mem and saving the json file. 
         # 增量输出s_mem并保存json文件。
         print ("= " * 15)
-        out_file = fs_temp_storage + "/path_tester_out.json"
+        out_file = self.temp_storage + "/path_tester_out.json"
         with open(out_file, "w") as outfile: 
           outfile.write(json.dumps(s_mem, indent=2))
         print_tree(s_mem)
@@ -372,7 +477,164 @@ class ReverieServer:
       time.sleep(self.server_sleep * 10)
 
 
-  def start_server(self, int_counter): 
+  def get_interacting_persona_groups(self):
+    """
+    Partitions the personas into groups that cannot affect one another during
+    the current step. Two personas end up in the same group if one of them
+    can perceive the other (same arena and within the larger of their vision
+    radii), or if one of them is chatting with the other. The relation is
+    transitive, so chains of such personas form a single group.
+
+    A persona only reads or writes another persona's state when it perceives
+    it or talks to it, so each group can run its cognitive sequence
+    independently of the others. Within a group, personas keep the order of
+    self.personas.
+
+    INPUT
+      None
+    OUTPUT
+      A list of lists of persona names.
+    EXAMPLE OUTPUT
+      [["Isabella Rodriguez", "Maria Lopez"], ["Klaus Mueller"]]
+    """
+    """
+    把角色划分为在当前步骤中不会互相影响的分组。如果两个角色中的一个能感知到另一个
+    （在同一场地并且在两者中较大的可视半径内），或者其中一个正在与另一个聊天，它们就
+    会被分到同一组。这种关系是可传递的，所以这样的角色链会形成一个分组。
+
+    角色只有在感知到或者与另一个角色交谈时才会读写其状态，所以每个分组都可以独立于
+    其他分组运行认知序列。在组内，角色保持self.personas中的顺序。
+
+    输入：
+      无
+    输出：
+      角色名称列表的列表。
+    示例输出：
+      [["Isabella Rodriguez", "Maria Lopez"], ["Klaus Mueller"]]
+    """
+    persona_names = list(self.personas.keys())
+    parent = {name: name for name in persona_names}
+
+    def find(name):
+      while parent[name] != name:
+        parent[name] = parent[parent[name]]
+        name = parent[name]
+      return name
+
+    def union(a, b):
+      root_a, root_b = find(a), find(b)
+      if root_a != root_b:
+        parent[root_b] = root_a
+
+    arenas = dict()
+    for name in persona_names:
+      arenas[name] = self.maze.arena_id(self.personas_tile[name])
+
+    for count, a in enumerate(persona_names):
+      persona_a = self.personas[a]
+      if persona_a.scratch.chatting_with in self.personas:
+        union(a, persona_a.scratch.chatting_with)
+      for b in persona_names[count+1:]:
+        if arenas[a] != arenas[b]:
+          continue
+        vision_r = max(persona_a.scratch.vision_r,
+                       self.personas[b].scratch.vision_r)
+        tile_a = self.personas_tile[a]
+        tile_b = self.personas_tile[b]
+        if (abs(tile_a[0] - tile_b[0]) <= vision_r
+            and abs(tile_a[1] - tile_b[1]) <= vision_r):
+          union(a, b)
+
+    groups = dict()
+    for name in persona_names:
+      groups.setdefault(find(name), []).append(name)
+    return list(groups.values())
+
+
+  def move_personas(self, parallel=False):
+    """
+    Runs the main cognitive sequence (perceive, retrieve, plan, reflect,
+    execute) of every persona for the current step.
+
+    In parallel mode, the personas are split with
+    get_interacting_persona_groups and the groups run at the same time on a
+    thread pool, while the personas inside a group still run one after
+    another. The step takes roughly as long as its slowest group, and the
+    movements are the same as in a serial run: what the personas share
+    across groups is fixed for the step before anyone moves. They read where
+    the others stand from a snapshot of <personas_tile>, and draw their
+    random choices from their own generators (seeded in start_server). The
+    maze's path cache takes no new paths until the step is over (see
+    Maze.freeze_path_cache). The paths they set out on are reserved
+    afterwards in persona order (see Maze.reserve_requested_paths).
+
+    INPUT
+      parallel: If True, independent groups of personas move concurrently.
+    OUTPUT
+      A dictionary that takes the persona's full name as its keys, and the
+      execution triple returned by Persona.move as its values.
+    """
+    """
+    为当前步骤运行每个角色的主要认知序列（感知、检索、计划、反思、执行）。
+
+    在并行模式下，角色会用get_interacting_persona_groups分组，各分组在线程池上同时
+    运行，而组内的角色仍然依次运行。一个步骤的耗时大致等于最慢分组的耗时，并且移动与
+    串行运行相同：角色在分组之间共享的东西在任何人移动之前就已经为这一步固定下来。他们
+    从<personas_tile>的快照中读取其他角色所在的位置，并用自己的生成器（在start_server
+    中设置种子）做随机选择。迷宫的路径缓存在这一步结束之前不会加入新的路径（参见
+    Maze.freeze_path_cache）。他们出发的路径之后会按角色顺序预留（参见
+    Maze.reserve_requested_paths）。
+
+    输入：
+      parallel：如果为True，相互独立的角色分组会并发移动。
+    输出：
+      一个以角色全名为键，Persona.move返回的执行三元组为值的字典。
+    """
+    # The personas read where the others stand from this snapshot, taken
+    # before anyone moves.
+    # 角色从这份在任何人移动之前获取的快照中读取其他角色所在的位置。
+    personas_tile = dict(self.personas_tile)
+
+    def move_group(group):
+      group_executions = dict()
+      for persona_name in group:
+        persona = self.personas[persona_name]
+        group_executions[persona_name] = persona.move(
+          self.maze, self.personas, personas_tile[persona_name],
+          self.curr_time, personas_tile)
+      return group_executions
+
+    executions = dict()
+    self.maze.freeze_path_cache()
+    try:
+      if not parallel or self.persona_workers <= 1:
+        executions = move_group(list(self.personas.keys()))
+      else:
+        groups = self.get_interacting_persona_groups()
+        workers = min(self.persona_workers, len(groups))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+          for group_executions in executor.map(move_group, groups):
+            executions.update(group_executions)
+    finally:
+      self.maze.commit_path_cache()
+
+    # The paths the personas set out on are reserved in persona order (see
+    # Maze.reserve_requested_paths). A reserved path may wait or go around
+    # someone, so the next tile and the rest of the path are taken from it.
+    # 角色出发的路径按角色顺序预留（参见Maze.reserve_requested_paths）。预留的
+    # 路径可能会等待或绕开别人，所以下一个地图块和剩余的路径都取自它。
+    reserved = self.maze.reserve_requested_paths(list(self.personas.keys()))
+    for persona_name, path in reserved.items():
+      persona = self.personas[persona_name]
+      next_tile = path[1] if len(path) > 1 else path[0]
+      persona.scratch.planned_path = path[2:]
+      executions[persona_name] = ((next_tile,)
+                                  + tuple(executions[persona_name][1:]))
+    return executions
+
+
+  def start_server(self, int_counter, parallel=False, headless=False, 
+                   step_callback=None): 
     """
     The main backend server of Reverie. 
     This function retrieves the environment file from the frontend to 
@@ -382,6 +644,13 @@ class ReverieServer:
     INPUT
       int_counter: Integer value for the number of steps left for us to take
                    in this iteration. 
+      parallel: If True, personas that cannot interact with each other in
+                a step run their cognitive sequences concurrently.
+      headless: If True, the steps run back to back without the frontend: 
+                each persona is moved to the tile of their movement, as the 
+                frontend would (see FrontendChannel). 
+      step_callback: A function that is called without arguments after 
+                     each step (e.g., to report progress), or None. 
     OUTPUT 
       None
     """
@@ -391,12 +660,18 @@ class ReverieServer:
     做决策，并保存每一步的移动距离。
     输入：
       int_counter: 整型数值，保存了这个循环中剩余的步数。
+      parallel: 如果为True，在一个步骤中不会互相影响的角色会并发运行认知序列。
+      headless: 如果为True，在没有前端的情况下连续运行这些步骤：每个角色会像在前端
+                中一样被移动到其移动的地图块上（参见FrontendChannel）。
+      step_callback: 每一步之后不带参数调用的函数（例如用于报告进度），或None。
     输出：
       无
     """
     # <sim_folder> points to the current simulation folder.
     # <sim_folder> 指向当前仿真的文件夹。
     sim_folder = f"{fs_storage}/{self.sim_code}"
+    self.frontend_channel.headless = headless
+    llm_cache.namespace = self.seed
 
     # When a persona arrives at a game object, we give a unique event
     # to that object. 
@@ -422,156 +697,180 @@ class ReverieServer:
       if int_counter == 0: 
         break
 
-      # <curr_env_file> file is the file that our frontend outputs. When the
-      # frontend has done its job and moved the personas, then it will put a 
-      # new environment file that matches our step count. That's when we run 
-      # the content of this for loop. Otherwise, we just wait. 
-
-      # <curr_env_file>文件是前端输出的文件。当前端结束任务并移动角色时，它会发送
-      # 一个符合步长的环境文件，这时就可以运行for循环的内容。否则只能等待。
-      curr_env_file = f"{sim_folder}/environment/{self.step}.json"
-      if check_if_file_exists(curr_env_file):
-        # If we have an environment file, it means we have a new perception
-        # input to our personas. So we first retrieve it.
-
-        # 如果有一个环境文件，意味着给角色提供了一个新的感知输入。因此首先检索此文件
-        try: 
-          # Try and save block for robustness of the while loop.
-
-          # 尝试保存块以增强while循环的健壮性。
-          with open(curr_env_file) as json_file:
-            new_env = json.load(json_file)
-            env_retrieved = True
-        except: 
-          pass
-      
-        if env_retrieved: 
-          # This is where we go through <game_obj_cleanup> to clean up all 
-          # object actions that were used in this cylce. 
-
-          # 通过<game_obj_cleanup> 清理所有在循环内使用的对象动作。
-          for key, val in game_obj_cleanup.items(): 
-            # We turn all object actions to their blank form (with None). 
-            # 把所有对象动作转为空值（用None填充）。
-            self.maze.turn_event_from_tile_idle(key, val)
-          # Then we initialize game_obj_cleanup for this cycle. 
-          # 为此次循环初始化game_obj_cleanup
-          game_obj_cleanup = dict()
-
-          # We first move our personas in the backend environment to match 
-          # the frontend environment. 
-
-          # 首先在后端环境移动角色去匹配前端环境。
-          for persona_name, persona in self.personas.items(): 
-            # <curr_tile> is the tile that the persona was at previously. 
-
-            # <curr_tile> 是角色以前所在的地图块。
-            curr_tile = self.personas_tile[persona_name]
-            # <new_tile> is the tile that the persona will move to right now,
-            # during this cycle. 
-
-            # <new_tile> 是此次循环中角色即将移动到的地图块。
-            new_tile = (new_env[persona_name]["x"], 
-                        new_env[persona_name]["y"])
-
-            # We actually move the persona on the backend tile map here. 
-
-            # 将后端地图块上的角色移动到这个位置。
-            self.personas_tile[persona_name] = new_tile
-            self.maze.remove_subject_events_from_tile(persona.name, curr_tile)
-            self.maze.add_event_from_tile(persona.scratch
-                                         .get_curr_event_and_desc(), new_tile)
-
-            # Now, the persona will travel to get to their destination. *Once*
-            # the persona gets there, we activate the object action.
-
-            # 现在，这个角色会循迹到目的地，当角色到达后，对象动作即被激活。
-            # 一旦人物角色到达那里，激活对象动作。
-            if not persona.scratch.planned_path: 
-              # We add that new object action event to the backend tile map. 
-              # At its creation, it is stored in the persona's backend. 
-              
-              # 将新的对象操作事件添加到后端的地图块映射中。
-              # 在创建时，它被存储在角色的后端。
-              # 添加新对象动作事件到后端地图。在创建时，它存储在角色的后端。
-              game_obj_cleanup[persona.scratch
-                               .get_curr_obj_event_and_desc()] = new_tile
-              self.maze.add_event_from_tile(persona.scratch
-                                     .get_curr_obj_event_and_desc(), new_tile)
-              # We also need to remove the temporary blank action for the 
-              # object that is currently taking the action. 
-
-              # 我们还需要移除当前正在执行动作的对象的临时空动作。
-              blank = (persona.scratch.get_curr_obj_event_and_desc()[0], 
-                       None, None, None)
-              self.maze.remove_event_from_tile(blank, new_tile)
-
-          # Then we need to actually have each of the personas perceive and
-          # move. The movement for each of the personas comes in the form of
-          # x y coordinates where the persona will move towards. e.g., (50, 34)
-          # This is where the core brains of the personas are invoked. 
-
-          # 让每个人物角色都能感知和移动。每个角色的一次移动是以角色将移动到的x y坐标
-          # 为格式存储。 e.g., (50, 34) 这就是调用人物角色的核心大脑的地方。
-          movements = {"persona": dict(), 
-                       "meta": dict()}
-          for persona_name, persona in self.personas.items(): 
-            # <next_tile> is a x,y coordinate. e.g., (58, 9)
-            # <pronunciatio> is an emoji. e.g., "\ud83d\udca4"
-            # <description> is a string description of the movement. e.g., 
-            #   writing her next novel (editing her novel) 
-            #   @ double studio:double studio:common room:sofa
-
-            # <next_tile>是一个x,y 坐标。e.g., (58, 9)
-            # <pronunciatio>是一个表情。 e.g., "\ud83d\udca4"
-            # <description>是移动的字符串描述。e.g., 写她的下一部小说
-            #   @ double studio:double studio:common room:sofa
-            next_tile, pronunciatio, description = persona.move(
-              self.maze, self.personas, self.personas_tile[persona_name], 
-              self.curr_time)
-            movements["persona"][persona_name] = {}
-            movements["persona"][persona_name]["movement"] = next_tile
-            movements["persona"][persona_name]["pronunciatio"] = pronunciatio
-            movements["persona"][persona_name]["description"] = description
-            movements["persona"][persona_name]["chat"] = (persona
-                                                          .scratch.chat)
-
-          # Include the meta information about the current stage in the 
-          # movements dictionary. 
-
-          # 在移动字典里写入当前状态的元信息。
-          movements["meta"]["curr_time"] = (self.curr_time 
-                                             .strftime("%B %d, %Y, %H:%M:%S"))
-
-          # We then write the personas' movements to a file that will be sent 
-          # to the frontend server. 
-          # Example json output: 
-          # {"persona": {"Maria Lopez": {"movement": [58, 9]}},
-          #  "persona": {"Klaus Mueller": {"movement": [38, 12]}}, 
-          #  "meta": {curr_time: <datetime>}}
-
-          # 然后把角色的动作写到会发给前端服务的文件中。
-          # json输出的例子：
-          # {"persona": {"Maria Lopez": {"movement": [58, 9]}},
-          #  "persona": {"Klaus Mueller": {"movement": [38, 12]}}, 
-          #  "meta": {curr_time: <datetime>}}
-
-          curr_move_file = f"{sim_folder}/movement/{self.step}.json"
-          with open(curr_move_file, "w") as outfile: 
-            outfile.write(json.dumps(movements, indent=2))
-
-          # After this cycle, the world takes one step forward, and the 
-          # current time moves by <sec_per_step> amount. 
-
-          # 这个循环后，整个小镇会前进一步，当前时间增加<sec_per_step>。
-          self.step += 1
-          self.curr_time += datetime.timedelta(seconds=self.sec_per_step)
-
-          int_counter -= 1
-          
-      # Sleep so we don't burn our machines. 
-      # Sleep才不会导致宕机。
-      time.sleep(self.server_sleep)
+      # <new_env> is what our frontend outputs. When the frontend has done 
+      # its job and moved the personas, then it will hand over a new 
+      # environment that matches our step count (see FrontendChannel). That's
+      # when we run the content of this for loop. Otherwise, we just wait. 
+
+      # <new_env>是前端的输出。当前端结束任务并移动角色时，它会传递一个符合步长的
+      # 环境（参见FrontendChannel），这时就可以运行for循环的内容。否则只能等待。
+      new_env = self.frontend_channel.receive_environment(self.step)
+      if new_env is not None: 
+        # The step profiler records where the time of this step goes (see 
+        # instrumentation.py). 
+        # 步骤分析器记录这一步的时间花在哪里（参见instrumentation.py）。
+        step_profiler.start_step(self.step, self.curr_time)
+
+        # The changes to the events on the tiles in this cycle are gathered
+        # in <event_updates> and applied to the maze as one batch. 
+
+        # 这个循环中对地图块事件的修改收集在<event_updates>中，并作为一批应用到迷宫。
+        event_updates = []
+
+        # This is where we go through <game_obj_cleanup> to clean up all 
+        # object actions that were used in this cylce. 
+
+        # 通过<game_obj_cleanup> 清理所有在循环内使用的对象动作。
+        for key, val in game_obj_cleanup.items(): 
+          # We turn all object actions to their blank form (with None). 
+          # 把所有对象动作转为空值（用None填充）。
+          event_updates += [("idle", key, val)]
+        # Then we initialize game_obj_cleanup for this cycle. 
+        # 为此次循环初始化game_obj_cleanup
+        game_obj_cleanup = dict()
+
+        # We first move our personas in the backend environment to match 
+        # the frontend environment. 
+
+        # 首先在后端环境移动角色去匹配前端环境。
+        for persona_name, persona in self.personas.items(): 
+          # <curr_tile> is the tile that the persona was at previously. 
+
+          # <curr_tile> 是角色以前所在的地图块。
+          curr_tile = self.personas_tile[persona_name]
+          # <new_tile> is the tile that the persona will move to right now,
+          # during this cycle. 
+
+          # <new_tile> 是此次循环中角色即将移动到的地图块。
+          new_tile = (new_env[persona_name]["x"], 
+                      new_env[persona_name]["y"])
+
+          # We actually move the persona on the backend tile map here. 
+
+          # 将后端地图块上的角色移动到这个位置。
+          self.personas_tile[persona_name] = new_tile
+          event_updates += [("remove_subject", persona.name, curr_tile)]
+          event_updates += [("add", persona.scratch
+                                    .get_curr_event_and_desc(), new_tile)]
+
+          # Now, the persona will travel to get to their destination. *Once*
+          # the persona gets there, we activate the object action.
+
+          # 现在，这个角色会循迹到目的地，当角色到达后，对象动作即被激活。
+          # 一旦人物角色到达那里，激活对象动作。
+          if not persona.scratch.planned_path: 
+            # We add that new object action event to the backend tile map. 
+            # At its creation, it is stored in the persona's backend. 
+            
+            # 将新的对象操作事件添加到后端的地图块映射中。
+            # 在创建时，它被存储在角色的后端。
+            # 添加新对象动作事件到后端地图。在创建时，它存储在角色的后端。
+            game_obj_cleanup[persona.scratch
+                             .get_curr_obj_event_and_desc()] = new_tile
+            event_updates += [("add", persona.scratch
+                                      .get_curr_obj_event_and_desc(), 
+                               new_tile)]
+            # We also need to remove the temporary blank action for the 
+            # object that is currently taking the action. 
+
+            # 我们还需要移除当前正在执行动作的对象的临时空动作。
+            blank = (persona.scratch.get_curr_obj_event_and_desc()[0], 
+                     None, None, None)
+            event_updates += [("remove", blank, new_tile)]
+
+        # <event_diff> is what the batch changed on the tiles. It is sent 
+        # to the frontend along with the movements. 
+        # <event_diff>是这一批更新对地图块的修改。它会和移动一起发送给前端。
+        event_diff = self.maze.apply_event_updates(event_updates)
+
+        # Then we need to actually have each of the personas perceive and
+        # move. The movement for each of the personas comes in the form of
+        # x y coordinates where the persona will move towards. e.g., (50, 34)
+        # This is where the core brains of the personas are invoked. 
+
+        # 让每个人物角色都能感知和移动。每个角色的一次移动是以角色将移动到的x y坐标
+        # 为格式存储。 e.g., (50, 34) 这就是调用人物角色的核心大脑的地方。
+        movements = {"persona": dict(), 
+                     "meta": dict()}
+        # The random choices of this step (e.g., the target tile of an 
+        # action) are made with each persona's own generator, seeded by the 
+        # step count (and <seed>) and the persona's name, so that re-running
+        # a forked simulation from the same step with cached LLM responses 
+        # gives the same result, whether or not the personas move in 
+        # parallel. 
+
+        # 这一步的随机选择（例如动作的目标地图块）用每个角色自己的生成器来做，它以
+        # 步数（和<seed>）以及角色的名字作为种子，使得用缓存的LLM响应从同一步重新
+        # 运行分叉的仿真时得到相同的结果，无论角色是否并行移动。
+        for persona_name, persona in self.personas.items(): 
+          if self.seed is None: 
+            persona.rng.seed(f"{self.step}-{persona_name}")
+          else: 
+            persona.rng.seed(f"{self.seed}-{self.step}-{persona_name}")
+        # The paths the personas set out on in this step are planned from 
+        # this step on, against the reservations of the others. 
+        # 这一步中角色出发的路径从这一步开始规划，并根据其他角色的预留进行规划。
+        self.maze.advance_reservations(self.step)
+        executions = self.move_personas(parallel)
+        for persona_name, persona in self.personas.items(): 
+          # <next_tile> is a x,y coordinate. e.g., (58, 9)
+          # <pronunciatio> is an emoji. e.g., "\ud83d\udca4"
+          # <description> is a string description of the movement. e.g., 
+          #   writing her next novel (editing her novel) 
+          #   @ double studio:double studio:common room:sofa
+
+          # <next_tile>是一个x,y 坐标。e.g., (58, 9)
+          # <pronunciatio>是一个表情。 e.g., "\ud83d\udca4"
+          # <description>是移动的字符串描述。e.g., 写她的下一部小说
+          #   @ double studio:double studio:common room:sofa
+          next_tile, pronunciatio, description = executions[persona_name]
+          movements["persona"][persona_name] = {}
+          movements["persona"][persona_name]["movement"] = next_tile
+          movements["persona"][persona_name]["pronunciatio"] = pronunciatio
+          movements["persona"][persona_name]["description"] = description
+          movements["persona"][persona_name]["chat"] = (persona
+                                                        .scratch.chat)
+
+        # Include the meta information about the current stage in the 
+        # movements dictionary. 
+
+        # 在移动字典里写入当前状态的元信息。
+        movements["meta"]["curr_time"] = (self.curr_time 
+                                           .strftime("%B %d, %Y, %H:%M:%S"))
+        movements["meta"]["event_diff"] = event_diff
+
+        # We then write the personas' movements to a file that will be sent 
+        # to the frontend server. 
+        # Example json output: 
+        # {"persona": {"Maria Lopez": {"movement": [58, 9]}},
+        #  "persona": {"Klaus Mueller": {"movement": [38, 12]}}, 
+        #  "meta": {curr_time: <datetime>, 
+        #           event_diff: {"added": [[[58, 9], [event]], ...], 
+        #                        "removed": [...]}}}
+
+        # 然后把角色的动作写到会发给前端服务的文件中。
+        # json输出的例子：
+        # {"persona": {"Maria Lopez": {"movement": [58, 9]}},
+        #  "persona": {"Klaus Mueller": {"movement": [38, 12]}}, 
+        #  "meta": {curr_time: <datetime>, 
+        #           event_diff: {"added": [[[58, 9], [event]], ...], 
+        #                        "removed": [...]}}}
+
+        self.frontend_channel.send_movement(self.step, movements)
+        step_profiler.end_step(
+          f"{sim_folder}/reverie/trace.jsonl" if step_trace else None)
+
+        # After this cycle, the world takes one step forward, and the 
+        # current time moves by <sec_per_step> amount. 
+
+        # 这个循环后，整个小镇会前进一步，当前时间增加<sec_per_step>。
+        self.step += 1
+        self.curr_time += datetime.timedelta(seconds=self.sec_per_step)
+
+        int_counter -= 1
+        if step_callback: 
+          step_callback()
+        
 
 
   def open_server(self): 
@@ -611,9 +910,12 @@ class ReverieServer:
       try: 
         if sim_command.lower() in ["f", "fin", "finish", "save and finish"]: 
           # Finishes the simulation environment and saves the progress. 
+          # The save is always a full one, so that the saved files are 
+          # complete without the save journal. 
           # Example: fin
-          # 完成仿真环境并保存此次操作。例子：fin
-          self.save()
+          # 完成仿真环境并保存此次操作。保存总是完整的，使得保存的文件在没有保存
+          # 日志的情况下也是完整的。例子：fin
+          self.save(compact=True)
           break
 
         elif sim_command.lower() == "start path tester mode": 
@@ -646,13 +948,23 @@ class ReverieServer:
           self.save()
 
         elif sim_command[:3].lower() == "run": 
-          # Runs the number of steps specified in the prompt.
+          # Runs the number of steps specified in the prompt. With
+          # "run parallel", personas that cannot interact with each other
+          # move concurrently. With "run headless", the steps run without 
+          # the frontend. 
           # Example: run 1000
+          # Example: run parallel 1000
+          # Example: run headless parallel 1000
 
-          # 按照输入的步数运行仿真
+          # 按照输入的步数运行仿真。使用"run parallel"时，不会互相影响的角色会
+          # 并发移动。使用"run headless"时，在没有前端的情况下运行这些步骤。
           # 例子: run 1000
+          # 例子: run parallel 1000
+          # 例子: run headless parallel 1000
           int_count = int(sim_command.split()[-1])
-          rs.start_server(int_count)
+          rs.start_server(int_count,
+                          parallel="parallel" in sim_command.lower(), 
+                          headless="headless" in sim_command.lower())
 
         elif ("print persona schedule" 
               in sim_command[:22].lower()): 
@@ -789,6 +1101,42 @@ class ReverieServer:
           for key, val in self.maze.access_tile(cooordinate).items(): 
             ret_str += f"{key}: {val}\n"
 
+        elif ("print path cache stats" 
+              in sim_command.lower()): 
+          # Print how often paths were reused from the maze's path cache. 
+          # Ex: print path cache stats
+
+          # 打印路径从迷宫的路径缓存中被重复使用的频率。
+          # 例子: print path cache stats
+          for key in ["hits", "subpath_hits", "misses"]: 
+            ret_str += f"{key}: {self.maze.path_cache_stats[key]}\n"
+          ret_str += f"hit rate: {self.maze.path_cache_hit_rate():.2%}\n"
+          ret_str += f"cached paths: {len(self.maze.path_cache)}"
+
+        elif ("print step profile" 
+              in sim_command.lower()): 
+          # Print where the time of the steps run so far went: the time of 
+          # each phase of each persona, the prompt functions that took the 
+          # most time, and the LLM, embedding and path finder counts. 
+          # Ex: print step profile
+
+          # 打印到目前为止运行的步骤的时间花在哪里：每个角色每个阶段的耗时、耗时最多的
+          # 提示函数，以及LLM、嵌入和寻路的计数。
+          # 例子: print step profile
+          ret_str += summarize_profile(step_profiler.totals)
+
+        elif ("print llm usage" 
+              in sim_command.lower()): 
+          # Print the LLM calls, requests, tokens, estimated cost, latency, 
+          # retries and fail safes of each prompt function, since the 
+          # simulation was first forked from its base. 
+          # Ex: print llm usage
+
+          # 打印自仿真最初从基础仿真分叉以来，每个提示函数的LLM调用、请求、token、
+          # 估算费用、延迟、重试次数和失败保护次数。
+          # 例子: print llm usage
+          ret_str += summarize_llm_usage(total_llm_usage(self.llm_usage))
+
         elif ("call -- analysis" 
               in sim_command.lower()): 
           # Starts a stateless chat session with the agent. It does not save 
@@ -802,19 +1150,8 @@ class ReverieServer:
 
         elif ("call -- load history" 
               in sim_command.lower()): 
-          curr_file = maze_assets_loc + "/" + sim_command[len("call -- load history"):].strip() 
           # 例子：call -- load history the_ville/agent_history_init_n3.csv
-
-          rows = read_file_to_list(curr_file, header=True, strip_trail=True)[1]
-          clean_whispers = []
-          for row in rows: 
-            agent_name = row[0].strip() 
-            whispers = row[1].split(";")
-            whispers = [whisper.strip() for whisper in whispers]
-            for whisper in whispers: 
-              clean_whispers += [[agent_name, whisper]]
-
-          load_history_via_whisper(self.personas, clean_whispers)
+          self.load_history(sim_command[len("call -- load history"):].strip())
 
         print (ret_str)
 
@@ -831,8 +1168,33 @@ if __name__ == '__main__':
   #                    "July1_the_ville_isabella_maria_klaus-step-3-21")
   # rs.open_server()
 
-  origin = input("Enter the name of the forked simulation: ").strip()
-  target = input("Enter the name of the new simulation: ").strip()
-
-  rs = ReverieServer(origin, target)
-  rs.open_server()
+  # With arguments, the simulation is run headless and saved, without the 
+  # prompt or the frontend. 
+  # Example: python reverie.py base_the_ville_isabella_maria_klaus test-run 
+  #          8640 --parallel
+  # 带参数时，仿真会在没有提示符和前端的情况下无头运行并保存。
+  # 例子：python reverie.py base_the_ville_isabella_maria_klaus test-run 
+  #       8640 --parallel
+  if len(sys.argv) > 1: 
+    parser = argparse.ArgumentParser(
+      description="Runs a simulation headless and saves it.")
+    parser.add_argument("origin", help="The name of the forked simulation.")
+    parser.add_argument("target", help="The name of the new simulation.")
+    parser.add_argument("steps", type=int, help="The number of steps to run.")
+    parser.add_argument("--parallel", action="store_true", 
+                        help="Run the personas that cannot interact with "
+                             "each other concurrently.")
+    args = parser.parse_args()
+
+    rs = ReverieServer(args.origin, args.target)
+    rs.start_server(args.steps, parallel=args.parallel, headless=True)
+    # The save is a full one, as with "fin" at the prompt. 
+    # 保存是完整的，与在提示符下输入"fin"相同。
+    rs.save(compact=True)
+
+  else: 
+    origin = input("Enter the name of the forked simulation: ").strip()
+    target = input("Enter the name of the new simulation: ").strip()
+
+    rs = ReverieServer(origin, target)
+    rs.open_server()
@@ -0,0 +1,312 @@
+"""
+File: run_simulations.py
+Description: Runs a batch of simulations headless, side by side in a pool of
+processes, and reports their aggregate progress. Each simulation is forked
+into its own storage folder and gets its own temp storage folder (with its
+log), so that they do not contend on curr_sim_code.json. They all share the
+LLM response cache (llm_cache.py) and the embedding store
+(embedding_store.py), which are SQLite files that several processes can use
+at once.
+
+The batch is a JSON file, e.g.:
+  {"workers": 4,
+   "simulations": [
+     {"origin": "base_the_ville_n25", "target": "n25-whispers", "steps": 8640,
+      "seed": 1, "whispers": "the_ville/agent_history_init_n25.csv",
+      "parallel": true, "save_every": 360},
+     {"origin": "base_the_ville_n25", "target": "n25", "steps": 8640,
+      "seeds": [1, 2, 3]}]}
+Only "origin", "target" and "steps" are required. A simulation with "seeds"
+instead of "seed" is run once per seed, as "<target>-seed<seed>". The
+responses of a seeded simulation are cached under its seed, so that the
+simulations with different seeds do not replay each other's.
+
+Usage: python run_simulations.py <batch-file> [--workers N]
+"""
+"""
+文件：run_simulations.py
+描述：在一个进程池中无头地同时运行一批仿真，并报告它们的总体进度。每个仿真都分叉到
+自己的存储文件夹，并使用自己的临时存储文件夹（其中包括它的日志），使得它们不会争用
+curr_sim_code.json。它们共享LLM响应缓存（llm_cache.py）和嵌入存储
+（embedding_store.py），这两者都是可以被多个进程同时使用的SQLite文件。
+
+这一批仿真是一个JSON文件，例如：
+  {"workers": 4,
+   "simulations": [
+     {"origin": "base_the_ville_n25", "target": "n25-whispers", "steps": 8640,
+      "seed": 1, "whispers": "the_ville/agent_history_init_n25.csv",
+      "parallel": true, "save_every": 360},
+     {"origin": "base_the_ville_n25", "target": "n25", "steps": 8640,
+      "seeds": [1, 2, 3]}]}
+只有"origin"、"target"和"steps"是必需的。使用"seeds"而不是"seed"的仿真会对每个
+种子运行一次，名称为"<target>-seed<seed>"。有种子的仿真的响应缓存在它的种子下，
+使得不同种子的仿真不会重放彼此的响应。
+
+用法：python run_simulations.py <batch-file> [--workers N]
+"""
+import argparse
+import contextlib
+import multiprocessing
+import queue
+import traceback
+
+from concurrent.futures import ProcessPoolExecutor
+
+import utils
+from global_methods import *
+from utils import *
+from reverie import *
+from persona.prompt_template.llm_cache import *
+
+# <simulation_report_every> is how many seconds apart the aggregate progress
+# is printed. It can be overridden in utils.py.
+# <simulation_report_every>是打印总体进度的时间间隔（秒）。它可以在utils.py中
+# 覆盖。
+simulation_report_every = getattr(utils, "simulation_report_every", 10)
+
+
+def load_batch(batch_file):
+  """
+  Reads a batch file (see the top of this file) and checks that its
+  simulations can be run.
+
+  INPUT
+    batch_file: The path of the JSON batch file.
+  OUTPUT
+    The number of workers of the batch (or None), and the list of its
+    simulations, with the "seeds" expanded.
+  """
+  """
+  读取一个批次文件（参见本文件开头）并检查其中的仿真是否可以运行。
+
+  输入：
+    batch_file：JSON批次文件的路径。
+  输出：
+    批次的工作进程数（或None），以及展开"seeds"之后的仿真列表。
+  """
+  with open(batch_file) as json_file:
+    batch = json.load(json_file)
+
+  simulations = []
+  for sim in batch["simulations"]:
+    for key in ["origin", "target", "steps"]:
+      if key not in sim:
+        raise ValueError(f"A simulation of the batch has no {key}: {sim}")
+    if "seeds" not in sim:
+      simulations += [dict(sim)]
+      continue
+    for seed in sim["seeds"]:
+      seeded_sim = {key: val for key, val in sim.items() if key != "seeds"}
+      seeded_sim["target"] = f"{sim['target']}-seed{seed}"
+      seeded_sim["seed"] = seed
+      simulations += [seeded_sim]
+
+  targets = set()
+  for sim in simulations:
+    if sim["target"] in targets:
+      raise ValueError(f"{sim['target']} is in the batch more than once")
+    if os.path.exists(f"{fs_storage}/{sim['target']}"):
+      raise ValueError(f"{fs_storage}/{sim['target']} already exists")
+    if not os.path.exists(f"{fs_storage}/{sim['origin']}"):
+      raise ValueError(f"{fs_storage}/{sim['origin']} does not exist")
+    targets.add(sim["target"])
+  return batch.get("workers"), simulations
+
+
+def run_simulation(sim, progress_queue):
+  """
+  Runs one simulation of a batch headless and saves it. This runs in a
+  worker process of run_simulations; the output of the simulation goes to
+  log.txt in its temp storage folder, and its progress to <progress_queue>.
+
+  INPUT
+    sim: A simulation of the batch (see load_batch).
+    progress_queue: The queue the progress updates are put on.
+  OUTPUT
+    None
+  """
+  """
+  无头运行批次中的一个仿真并保存它。它在run_simulations的工作进程中运行；仿真的
+  输出写入其临时存储文件夹中的log.txt，进度放入<progress_queue>。
+
+  输入：
+    sim：批次中的一个仿真（参见load_batch）。
+    progress_queue：放入进度更新的队列。
+  输出：
+    无
+  """
+  target = sim["target"]
+  temp_storage = f"{fs_temp_storage}/runs/{target}"
+  os.makedirs(temp_storage, exist_ok=True)
+
+  # The LLM cache counts the lookups of the whole process, which may have
+  # run other simulations of the batch before.
+  # LLM缓存统计的是整个进程的查找次数，而这个进程之前可能运行过批次中的其他仿真。
+  cache_hits, cache_misses = llm_cache.hits, llm_cache.misses
+
+  def report(status, steps, error=None):
+    progress_queue.put({"target": target,
+                        "status": status,
+                        "steps": steps,
+                        "llm_cache_hits": llm_cache.hits - cache_hits,
+                        "llm_cache_misses": llm_cache.misses - cache_misses,
+                        "error": error})
+
+  steps = 0
+  with open(f"{temp_storage}/log.txt", "w") as log_file, \
+       contextlib.redirect_stdout(log_file), \
+       contextlib.redirect_stderr(log_file):
+    try:
+      report("running", steps)
+      rs = ReverieServer(sim["origin"], target, temp_storage)
+      rs.seed = sim.get("seed")
+      # The whispers are already part of the seeded run (see
+      # ReverieServer.seed), so their responses are cached under its seed too.
+      # 悄悄话已经是有种子的运行的一部分（参见ReverieServer.seed），因此它们的响应
+      # 也缓存在它的种子下。
+      llm_cache.namespace = rs.seed
+      if sim.get("whispers"):
+        rs.load_history(sim["whispers"])
+      start_step = rs.step
+
+      def step_callback():
+        nonlocal steps
+        steps = rs.step - start_step
+        if sim.get("save_every") and steps % sim["save_every"] == 0:
+          rs.save()
+        report("running", steps)
+
+      rs.start_server(sim["steps"], parallel=sim.get("parallel", False),
+                      headless=True, step_callback=step_callback)
+      # The last save is a full one, as with "fin" at the prompt.
+      # 最后一次保存是完整的，与在提示符下输入"fin"相同。
+      rs.save(compact=True)
+      report("done", steps)
+    except Exception:
+      traceback.print_exc()
+      report("failed", steps, traceback.format_exc(limit=-1).strip())
+
+
+def _format_progress(progress, total_steps, elapsed):
+  counts = {"queued": 0, "running": 0, "done": 0, "failed": 0}
+  steps, hits, misses = 0, 0, 0
+  for sim_progress in progress.values():
+    counts[sim_progress["status"]] += 1
+    steps += sim_progress["steps"]
+    hits += sim_progress["llm_cache_hits"]
+    misses += sim_progress["llm_cache_misses"]
+
+  rate = steps / elapsed if elapsed else 0
+  eta = (total_steps - steps) / rate if rate else 0
+  line = (f"[{datetime.timedelta(seconds=int(elapsed))}] "
+          f"{steps}/{total_steps} steps ({steps / total_steps:.1%}), "
+          f"{rate:.2f} steps/s, eta {datetime.timedelta(seconds=int(eta))}"
+          f" | {counts['running']} running, {counts['done']} done, "
+          f"{counts['failed']} failed, {counts['queued']} queued"
+          f" | LLM cache: {hits} hits, {misses} misses")
+  if hits + misses:
+    line += f" ({hits / (hits + misses):.1%})"
+  return line
+
+
+def run_simulations(simulations, workers=None,
+                    report_every=simulation_report_every):
+  """
+  Runs <simulations> in a pool of <workers> processes, printing their
+  aggregate progress every <report_every> seconds, and each simulation as it
+  finishes.
+
+  INPUT
+    simulations: A list of simulations (see load_batch).
+    workers: The number of processes, or None for one per CPU (at most one
+             per simulation).
+    report_every: The number of seconds between two progress reports.
+  OUTPUT
+    A dictionary that takes the target of each simulation as its keys, and
+    its final progress (status, steps, LLM cache hits and misses, error) as
+    its values.
+  """
+  """
+  在<workers>个进程的进程池中运行<simulations>，每隔<report_every>秒打印一次
+  总体进度，并在每个仿真结束时打印它。
+
+  输入：
+    simulations：仿真列表（参见load_batch）。
+    workers：进程数，为None时每个CPU一个（最多每个仿真一个）。
+    report_every：两次进度报告之间的秒数。
+  输出：
+    一个以每个仿真的目标名称为键，其最终进度（状态、步数、LLM缓存命中和未命中次数、
+    错误）为值的字典。
+  """
+  workers = min(workers or os.cpu_count() or 1, len(simulations))
+  total_steps = sum(sim["steps"] for sim in simulations)
+  progress = dict()
+  for sim in simulations:
+    progress[sim["target"]] = {"status": "queued", "steps": 0,
+                               "llm_cache_hits": 0, "llm_cache_misses": 0,
+                               "error": None}
+  print (f"Running {len(simulations)} simulations ({total_steps} steps) in "
+         f"{workers} processes; logs are in {fs_temp_storage}/runs/")
+
+  # The workers are spawned rather than forked, so that they do not inherit
+  # the threads and connections of this process.
+  # 工作进程通过spawn而不是fork启动，使得它们不会继承这个进程的线程和连接。
+  context = multiprocessing.get_context("spawn")
+  start = time.time()
+  last_report = start
+  with context.Manager() as manager:
+    progress_queue = manager.Queue()
+    with ProcessPoolExecutor(max_workers=workers,
+                             mp_context=context) as executor:
+      futures = dict()
+      for sim in simulations:
+        future = executor.submit(run_simulation, sim, progress_queue)
+        futures[future] = sim["target"]
+
+      pending = set(futures)
+      while pending or not progress_queue.empty():
+        try:
+          update = progress_queue.get(timeout=0.5)
+          target = update.pop("target")
+          progress[target].update(update)
+          if update["status"] == "done":
+            print (f"{target} done ({update['steps']} steps)")
+          elif update["status"] == "failed":
+            print (f"{target} failed after {update['steps']} steps: "
+                   f"{update['error']}")
+        except queue.Empty:
+          pass
+
+        for future in [future for future in pending if future.done()]:
+          pending.discard(future)
+          target = futures[future]
+          if (future.exception() is not None
+              and progress[target]["status"] not in ["done", "failed"]):
+            # The worker process died (e.g., it ran out of memory).
+            # 工作进程异常退出（例如内存耗尽）。
+            progress[target]["status"] = "failed"
+            progress[target]["error"] = repr(future.exception())
+            print (f"{target} failed: {progress[target]['error']}")
+
+        if time.time() - last_report >= report_every:
+          last_report = time.time()
+          print (_format_progress(progress, total_steps, last_report - start))
+
+  print (_format_progress(progress, total_steps, time.time() - start))
+  return progress
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+    description="Runs a batch of simulations headless in a process pool.")
+  parser.add_argument("batch_file", help="The JSON batch file.")
+  parser.add_argument("--workers", type=int,
+                      help="The number of processes (default: the batch "
+                           "file's, or one per CPU).")
+  args = parser.parse_args()
+
+  batch_workers, simulations = load_batch(args.batch_file)
+  progress = run_simulations(simulations, args.workers or batch_workers)
+  if any(sim_progress["status"] != "done"
+         for sim_progress in progress.values()):
+    sys.exit(1)